@@ -29,6 +29,8 @@
 Request Tracker querying plugin
 """
 
+import sys
+
 import supybot
 import supybot.world as world
 
@@ -45,9 +47,41 @@ __contributors__ = {}
 # This is a url where the most recent plugin package can be downloaded.
 __url__ = 'https://github.com/gholms/supybot-rtquery'
 
+# If our modules are already loaded, we're being reloaded and they need to
+# be too.  If not, they're about to be loaded fresh, so don't do it twice.
+reloading = __name__ + '.plugin' in sys.modules
+
 import config
 import plugin
-reload(plugin) # In case we're being reloaded.
+import local.breaker
+import local.cache
+import local.diskcache
+import local.engine
+import local.httppool
+import local.metrics
+import local.ratelimit
+import local.replyformat
+import local.rtparse
+import local.rtsession
+import local.settings
+import local.singleflight
+if reloading:
+    reload(local.cache)
+    reload(local.diskcache)
+    reload(local.httppool)
+    reload(local.metrics)
+    reload(local.ratelimit)
+    reload(local.replyformat)
+    reload(local.engine)
+    reload(local.breaker)
+    reload(local.rtparse)
+    reload(local.rtsession)
+    reload(local.settings)
+    reload(local.singleflight)
+    if hasattr(local, 'webhook'):
+        # Only loaded once something listens for notifications
+        reload(local.webhook)
+    reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
 
@@ -28,6 +28,25 @@
 import supybot.conf as conf
 import supybot.registry as registry
 
+from local import replyformat
+
+# The fields that replyTemplate may use
+REPLY_FIELDS = ('id', 'flags', 'status', 'subject', 'url')
+
+class ReplyTemplate(registry.String):
+    """Value must be a reply template that only uses the fields listed in
+    its help."""
+    __slots__ = ()
+    errormsg = ('Value must be a reply template that only uses the fields '
+                'listed in its help, not %r.')
+
+    def setValue(self, v):
+        try:
+            replyformat.check_template(v, REPLY_FIELDS)
+        except ValueError:
+            self.error(v)
+        registry.String.setValue(self, v)
+
 def configure(advanced):
     # This will be called by supybot to configure this module.  advanced is
     # a bool that specifies whether the user identified himself as an advanced
@@ -52,5 +71,131 @@ conf.registerGlobalValue(RTQuery, 'password',
 conf.registerGlobalValue(RTQuery, 'authType',
         registry.String('builtin', 'Authentication method (builtin, basic)'))
 conf.registerGlobalValue(RTQuery, 'authRealm',
-        registry.String('', ('Realm to use for authentication (only works with '
-                             'authType = "basic")')))
+        registry.String('', ('Realm to use for authentication (unused; '
+                             'basic auth credentials are sent preemptively)')))
+conf.registerGlobalValue(RTQuery, 'replyTemplate',
+        ReplyTemplate('Ticket {id}{flags}: {subject} - {url}',
+                      ('Template for the line shown for each ticket.  It '
+                       'may use {id} (with a * in front if RT showed the '
+                       'ticket it was merged into instead), {flags} (such '
+                       'as " (open, security)", or nothing), {status}, '
+                       '{subject} and {url}')))
+conf.registerGlobalValue(RTQuery, 'maxTickets',
+        registry.PositiveInteger(50, ('Maximum number of tickets the '
+                                      'gettickets command will show at once')))
+conf.registerGlobalValue(RTQuery, 'requestTimeout',
+        registry.PositiveInteger(30, ('Number of seconds to wait for RT to '
+                                      'answer before giving up')))
+conf.registerGlobalValue(RTQuery, 'connectTimeout',
+        registry.PositiveFloat(5.0, ('Number of seconds to wait for a '
+                                     'connection to RT before giving up')))
+conf.registerGlobalValue(RTQuery, 'readTimeout',
+        registry.PositiveFloat(15.0, ('Number of seconds to wait for RT to '
+                                      'send anything before giving up on '
+                                      'a request')))
+conf.registerGlobalValue(RTQuery, 'breakerThreshold',
+        registry.NonNegativeInteger(5, ('Number of requests to RT in a row '
+                                        'that must fail before the plugin '
+                                        'stops sending more for a while and '
+                                        'answers from the cache or with an '
+                                        'error instead.  A value of 0 never '
+                                        'stops sending requests')))
+conf.registerGlobalValue(RTQuery, 'breakerCooldown',
+        registry.PositiveInteger(30, ('Number of seconds to wait after RT '
+                                      'stops answering before trying it '
+                                      'again with a single request')))
+conf.registerGlobalValue(RTQuery, 'rateLimit',
+        registry.Float(10.0, ('Maximum number of requests per second to send '
+                              'to RT on average.  RT asking the bot to slow '
+                              'down with a Retry-After or X-RateLimit-* '
+                              'header slows it down further, but commands '
+                              'that would have to wait longer than '
+                              'requestTimeout fail right away, saying how '
+                              'long to wait.  A value of 0 means no '
+                              'limit')))
+conf.registerGlobalValue(RTQuery, 'rateBurst',
+        registry.PositiveInteger(20, ('Maximum number of requests to send to '
+                                      'RT at once when the bot has not sent '
+                                      'any for a while')))
+conf.registerGlobalValue(RTQuery, 'maxQueuedPerChannel',
+        registry.NonNegativeInteger(10, ('Maximum number of lookups from one '
+                                         'channel, or one person in private, '
+                                         'that may wait for RT at once.  '
+                                         'Lookups beyond that are turned away '
+                                         'with an error.  Channels take turns '
+                                         'regardless.  A value of 0 means no '
+                                         'limit')))
+conf.registerGlobalValue(RTQuery, 'metricsFile',
+        registry.String('', ('File to write request timing metrics to in '
+                             'Prometheus text format, or nothing to not '
+                             'write them')))
+conf.registerGlobalValue(RTQuery, 'metricsInterval',
+        registry.PositiveInteger(60, ('Number of seconds between writes of '
+                                      'the metrics file.  Takes effect when '
+                                      'the plugin is reloaded.')))
+conf.registerGlobalValue(RTQuery, 'cacheTTL',
+        registry.NonNegativeInteger(300, ("Number of seconds to remember a "
+                                          "ticket's details.  A value of 0 "
+                                          "disables the ticket cache.")))
+conf.registerGlobalValue(RTQuery, 'cacheSize',
+        registry.NonNegativeInteger(500, ('Maximum number of tickets to '
+                                          'remember at once')))
+conf.registerGlobalValue(RTQuery, 'cacheHardTTL',
+        registry.NonNegativeInteger(3600, ('Number of seconds after a ticket '
+                                           'was fetched that it may still be '
+                                           'shown from the cache once cacheTTL '
+                                           'has passed, while it gets '
+                                           'refreshed in the background.  If '
+                                           'this is no more than cacheTTL, the '
+                                           'bot waits for RT instead.')))
+conf.registerChannelValue(RTQuery, 'postCorrections',
+        registry.Boolean(True, ('Whether to show a ticket again if refreshing '
+                                'it after showing it from the cache finds that '
+                                'its status or subject changed.')))
+conf.registerGlobalValue(RTQuery, 'diskCache',
+        registry.Boolean(False, ('Whether to also keep cached tickets in a '
+                                 'database in the bot\'s data directory so '
+                                 'that they survive restarts.  Takes effect '
+                                 'when the plugin is reloaded.')))
+conf.registerGlobalValue(RTQuery, 'diskCacheSize',
+        registry.NonNegativeInteger(5000, ('Maximum number of tickets to keep '
+                                           'in the database.  Takes effect '
+                                           'when the plugin is reloaded.')))
+conf.registerGlobalValue(RTQuery, 'prefetchInterval',
+        registry.NonNegativeInteger(0, ('Number of seconds between '
+                                        'background refreshes of tickets '
+                                        'that people have been asking '
+                                        'about, which keeps them in the '
+                                        'cache.  Keep this below cacheTTL.  '
+                                        'A value of 0 disables '
+                                        'prefetching.  Takes effect when '
+                                        'the plugin is reloaded.')))
+conf.registerGlobalValue(RTQuery, 'prefetchWindow',
+        registry.PositiveInteger(1800, ('Number of seconds after anyone last '
+                                        'asked about a ticket that it stops '
+                                        'being refreshed in the background')))
+conf.registerGlobalValue(RTQuery, 'prefetchBudget',
+        registry.PositiveInteger(20, ('Maximum number of tickets to refresh '
+                                      'in the background each time')))
+conf.registerGlobalValue(RTQuery, 'webhookPort',
+        registry.NonNegativeInteger(0, ('Port to listen on for notifications '
+                                        'that tickets changed, which drop '
+                                        'them from the cache right away.  '
+                                        'Send webhookSecret with them in an '
+                                        'X-Webhook-Secret header rather '
+                                        'than in the URL, which web servers '
+                                        'and proxies are more likely to '
+                                        'log.  A value of 0 disables the '
+                                        'listener.  '
+                                        'Takes effect when the plugin is '
+                                        'reloaded.')))
+conf.registerGlobalValue(RTQuery, 'webhookAddress',
+        registry.String('127.0.0.1', ('Address to listen on for '
+                                      'notifications.  Takes effect when the '
+                                      'plugin is reloaded.')))
+conf.registerGlobalValue(RTQuery, 'webhookSecret',
+        registry.String('', ('Secret that notifications must send, either in '
+                             'an X-Webhook-Secret header or in a secret query '
+                             'parameter.  The listener does not start '
+                             'without one.'),
+        private=True))
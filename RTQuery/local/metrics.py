@@ -0,0 +1,246 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Request timing histograms, with Prometheus text format export
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+class Histogram(object):
+    '''
+    Counts observations in fixed buckets, the way Prometheus does, along
+    with their count and sum.  Not thread-safe on its own.
+    '''
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts  = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count   = 0
+        self.sum     = 0.0
+
+    def observe(self, value):
+        for (index, bound) in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum   += value
+
+    def copy(self):
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count  = self.count
+        histogram.sum    = self.sum
+        return histogram
+
+    def quantile(self, q):
+        '''
+        Return the upper bound of the bucket that holds the q quantile, or
+        None if that is past the last bucket.
+        '''
+        wanted = q * self.count
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and seen > 0:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                return None
+        return None
+
+
+class _Timing(object):
+    '''
+    Times a block of code for Metrics.timed.  Set outcome in the block to
+    record something other than "ok"; if the block raises, the outcome
+    comes from the exception.
+    '''
+    def __init__(self, metrics, endpoint):
+        self.metrics  = metrics
+        self.endpoint = endpoint
+        self.outcome  = 'ok'
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.outcome = outcome_for(exc_value)
+        self.metrics.observe(self.endpoint, self.outcome,
+                             time.time() - self.start)
+        return False
+
+
+def outcome_for(exc):
+    '''
+    Describe how a request failed: an HTTP status code, "bad_json" for a
+    response we couldn't decode, or else the exception's class name.
+    '''
+    code = getattr(exc, 'code', None)
+    if code is not None:
+        return str(code)
+    if isinstance(exc, ValueError):
+        return 'bad_json'
+    return exc.__class__.__name__
+
+
+class Metrics(object):
+    '''
+    Thread-safe timing histograms for one plugin, one per endpoint and
+    outcome, plus counters for other events.
+    '''
+    def __init__(self, plugin, buckets=DEFAULT_BUCKETS):
+        self.plugin  = plugin
+        self.buckets = buckets
+        self.__histograms = {}  # (endpoint, outcome) -> Histogram
+        self.__counters   = {}  # event -> count
+        self.__lock = threading.Lock()
+
+    def increment(self, event, amount=1):
+        with self.__lock:
+            self.__counters[event] = self.__counters.get(event, 0) + amount
+
+    def observe(self, endpoint, outcome, seconds):
+        with self.__lock:
+            histogram = self.__histograms.get((endpoint, outcome))
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self.__histograms[(endpoint, outcome)] = histogram
+            histogram.observe(seconds)
+
+    def timed(self, endpoint):
+        '''
+        Return a context manager that times its block as a request to
+        endpoint:
+
+            with metrics.timed('GET issue') as timing:
+                response = ...
+                timing.outcome = str(response.status)
+        '''
+        return _Timing(self, endpoint)
+
+    def clear(self):
+        with self.__lock:
+            self.__histograms.clear()
+            self.__counters.clear()
+
+    def __snapshot(self):
+        with self.__lock:
+            return sorted((key, histogram.copy())
+                          for (key, histogram) in self.__histograms.items())
+
+    def __counter_snapshot(self):
+        with self.__lock:
+            return sorted(self.__counters.items())
+
+    def summary(self):
+        '''
+        Return a line of text for each endpoint and outcome with its request
+        count, mean, and approximate 50th, 95th and 99th percentiles, and
+        one for each counter.
+        '''
+        lines = []
+        for ((endpoint, outcome), histogram) in self.__snapshot():
+            quantiles = []
+            for q in (0.5, 0.95, 0.99):
+                bound = histogram.quantile(q)
+                if bound is None:
+                    quantiles.append('>{0:g}s'.format(self.buckets[-1]))
+                else:
+                    quantiles.append('<={0:g}s'.format(bound))
+            lines.append(('{0} {1}: {2} requests, mean {3:.3f}s, p50 {4}, '
+                          'p95 {5}, p99 {6}').format(endpoint, outcome,
+                                  histogram.count,
+                                  histogram.sum / histogram.count,
+                                  *quantiles))
+        for (event, count) in self.__counter_snapshot():
+            lines.append('{0}: {1}'.format(event, count))
+        return lines
+
+    def prometheus_text(self):
+        '''
+        Return the histograms in Prometheus's text exposition format.
+        '''
+        name = 'supybot_tracker_request_seconds'
+        lines = ['# HELP {0} Time spent on issue tracker requests.'.format(
+                         name),
+                 '# TYPE {0} histogram'.format(name)]
+        for ((endpoint, outcome), histogram) in self.__snapshot():
+            labels = 'plugin="{0}",endpoint="{1}",outcome="{2}"'.format(
+                    _escape(self.plugin), _escape(endpoint), _escape(outcome))
+            cumulative = 0
+            for (bound, bucket_count) in zip(self.buckets, histogram.counts):
+                cumulative += bucket_count
+                lines.append('{0}_bucket{{{1},le="{2:g}"}} {3}'.format(
+                        name, labels, bound, cumulative))
+            lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(
+                    name, labels, histogram.count))
+            lines.append('{0}_sum{{{1}}} {2!r}'.format(name, labels,
+                                                       histogram.sum))
+            lines.append('{0}_count{{{1}}} {2}'.format(name, labels,
+                                                       histogram.count))
+        counters = self.__counter_snapshot()
+        if counters:
+            lines.append('# HELP supybot_tracker_events_total Other things '
+                         'that happened while talking to issue trackers.')
+            lines.append('# TYPE supybot_tracker_events_total counter')
+            for (event, count) in counters:
+                lines.append(('supybot_tracker_events_total{{plugin="{0}",'
+                              'event="{1}"}} {2}').format(_escape(self.plugin),
+                                      _escape(event), count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        '''
+        Write the histograms to a Prometheus text file, such as for
+        node_exporter's textfile collector.  The file is replaced in one
+        step so readers never see half of it.
+        '''
+        directory = os.path.dirname(os.path.abspath(path))
+        (fd, tmp_path) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                tmp_file.write(self.prometheus_text())
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
@@ -0,0 +1,188 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Incremental parser for RT's REST 1.0 response format
+"""
+
+import httppool
+
+# Partial lines longer than this that we don't need get thrown away
+_DISCARD_THRESHOLD = 4096
+
+class RTError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+def parse_rt_stream(read, url=None, fields=None, chunk_size=8192):
+    """
+    Parse an RT response, calling read(chunk_size) for more of it as
+    needed, and yield one dict of attributes per object in the response
+    (or an RTError for each object that RT reported an error for).
+
+    Values that span several lines come back joined with newlines.  If
+    fields is given, only those attributes are kept and each object is
+    yielded as soon as all of them have been seen, so a caller that only
+    wants the first object can stop reading right there.  An object that
+    lacks some of them, such as a ticket whose queue doesn't have one of
+    the custom fields asked for, still comes back once it ends.
+    """
+    parser = _RTParser(url, fields)
+    buf = ''
+    discarding = False
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        if discarding:
+            # Skip the rest of a huge line we don't care about.
+            newline = chunk.find('\n')
+            if newline < 0:
+                continue
+            chunk = chunk[newline + 1:]
+            discarding = False
+        buf += chunk
+        start = 0
+        newline = buf.find('\n')
+        while newline >= 0:
+            record = parser.feed(buf[start:newline])
+            if record is not None:
+                yield record
+            start = newline + 1
+            newline = buf.find('\n', start)
+        buf = buf[start:]
+        if len(buf) > _DISCARD_THRESHOLD and not parser.wants(buf):
+            # The line so far is enough to end the value before it, which
+            # may finish an object.
+            record = parser.feed(buf[:buf.find(':') + 1])
+            if record is not None:
+                yield record
+            buf = ''
+            discarding = True
+    if buf:
+        record = parser.feed(buf)
+        if record is not None:
+            yield record
+    record = parser.finish()
+    if record is not None:
+        yield record
+
+
+class _RTParser(object):
+    """
+    A line-at-a-time state machine behind parse_rt_stream
+    """
+    def __init__(self, url, fields):
+        self.url      = url
+        self.fields   = frozenset(fields) if fields is not None else None
+        self.preamble = True
+        self.reset()
+
+    def reset(self):
+        self.attrs = {}
+        self.error = None
+        self.key   = None   # the attribute whose value we are reading
+        self.done  = False  # already yielded this object; skip the rest
+
+    def wants(self, line):
+        """
+        Return whether a (possibly partial) line is worth keeping.
+        """
+        if self.done or self.error is not None:
+            return False
+        if line[:1] in (' ', '\t'):
+            return self.key is not None
+        if self.fields is None or ':' not in line:
+            return True
+        return line.split(':', 1)[0].strip() in self.fields
+
+    def feed(self, line):
+        """
+        Process one line, returning an object if that line completed one.
+        """
+        line = line.rstrip('\r')
+        if self.preamble and line.startswith('RT/'):
+            # RT puts its real response codes at the top of the response
+            # content like so:  "RT/3.8.8 200 Ok"
+            self.preamble = False
+            bits = line.split(None, 2)
+            if len(bits) == 3 and bits[1][:1] in ('4', '5'):
+                raise httppool.HTTPError(self.url, int(bits[1]), bits[2])
+            return None
+        self.preamble = False
+        if line == '--':
+            # The end of one object and the start of the next
+            record = self.finish()
+            self.reset()
+            return record
+        if self.done or self.error is not None:
+            return None
+        if line[:1] in (' ', '\t'):
+            # A continuation of a multi-line value
+            if self.key is not None:
+                self.attrs[self.key] += '\n' + line.strip()
+            return None
+        record = None
+        if self.key is not None and self.__complete():
+            # Nothing left in this object that we need
+            record = self.attrs
+            self.done = True
+        self.key = None
+        if record is not None or not line:
+            return record
+        if line.startswith('#'):
+            # RT's error messages appear after octothorpes like this:
+            # "# Ticket 0 does not exist."
+            self.error = RTError(line.split('#', 1)[1].strip())
+        elif ':' in line:
+            # Key: value pair
+            (key, val) = line.split(':', 1)
+            key = key.strip()
+            if self.fields is None or key in self.fields:
+                self.attrs[key] = val.strip()
+                self.key = key
+        return None
+
+    def finish(self):
+        """
+        Return the object in progress, if there is one that hasn't already
+        been returned.
+        """
+        if self.done:
+            return None
+        self.done = True
+        if self.error is not None:
+            return self.error
+        return self.attrs or None
+
+    def __complete(self):
+        # A ticket without some of the fields, such as custom fields its
+        # queue doesn't have, is never complete early.  RT lists custom
+        # fields after all the others, so only the end of the ticket shows
+        # that one is missing.
+        return (self.fields is not None and
+                len(self.attrs) == len(self.fields))
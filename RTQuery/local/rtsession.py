@@ -0,0 +1,154 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Long-lived, thread-safe sessions with RT's REST 1.0 interface
+"""
+
+import base64
+import threading
+import urllib
+import urllib2
+from urlparse import urljoin
+
+def rt_status(response):
+    """
+    Return the status code RT puts at the top of a response body, e.g.
+    200 for "RT/3.8.8 200 Ok", or None if there isn't one.  The body is
+    left unconsumed.
+    """
+    first_line = ''
+    while '\n' not in first_line and len(first_line) < 256:
+        data = response.read(256 - len(first_line))
+        if not data:
+            break
+        first_line += data
+    response.unread(first_line)
+    first_line = first_line.split('\n', 1)[0]
+    if first_line.startswith('RT/'):
+        bits = first_line.split(None, 2)
+        if len(bits) >= 2 and bits[1].isdigit():
+            return int(bits[1])
+    return None
+
+
+class RTSession(object):
+    """
+    One RT login shared by every thread that talks to a given RT server.
+
+    With "builtin" auth we log in lazily by POSTing the credentials along
+    with the first request, which also returns that request's content, and
+    then reuse RT's session cookie until RT says that it has expired.  With
+    "basic" auth we send the Authorization header preemptively so no
+    request has to wait for a challenge.
+
+    If metrics (a metrics.Metrics) is given, logins are timed there.
+    """
+    def __init__(self, pool_manager, base_uri, auth_type, username, password,
+                 metrics=None):
+        self.pool      = pool_manager
+        self.metrics   = metrics
+        self.base_uri  = base_uri
+        self.auth_type = auth_type.lower()
+        self.username  = username
+        self.password  = password
+        self.requests  = 0
+        self.logins    = 0
+        # Sessions are only made when someone first asks about a ticket,
+        # so cookielib need not slow down loading the plugin.
+        import cookielib
+        self.__cookies    = cookielib.CookieJar()  # has its own lock
+        self.__logged_in  = False
+        self.__generation = 0
+        self.__lock       = threading.Lock()
+        if self.auth_type not in ('basic', 'builtin'):
+            raise ValueError('unknown authType "{0}"'.format(auth_type))
+
+    def get(self, relative_uri):
+        """
+        Fetch a location relative to RT's base URI, logging in first if
+        necessary, and return an httppool.StreamingResponse.  Callers must
+        close it when they are done with it.
+        """
+        uri = urljoin(self.base_uri, relative_uri)
+        if self.auth_type == 'basic':
+            return self.__send(uri, headers=self.__basic_auth_header())
+
+        generation = self.__generation
+        if not self.__logged_in:
+            with self.__lock:
+                if not self.__logged_in:
+                    return self.__login(uri)
+                generation = self.__generation
+        response = self.__send(uri)
+        if rt_status(response) == 401:
+            response.read()
+            response.close()
+            # Our session expired.  Only one thread needs to log in again;
+            # the rest can simply retry with the new cookie.
+            with self.__lock:
+                if self.__generation == generation:
+                    return self.__login(uri)
+            response = self.__send(uri)
+        return response
+
+    def __login(self, uri):
+        # Callers must hold self.__lock.
+        self.__cookies.clear()
+        data = urllib.urlencode({'user': self.username,
+                                 'pass': self.password})
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if self.metrics is None:
+            response = self.__send(uri, data, headers)
+        else:
+            with self.metrics.timed('login'):
+                response = self.__send(uri, data, headers)
+        self.logins += 1
+        self.__generation += 1
+        self.__logged_in = (rt_status(response) != 401)
+        return response
+
+    def __send(self, uri, data=None, headers=None):
+        headers = dict(headers or {})
+        # cookielib only knows how to deal with urllib2's objects.
+        cookie_req = urllib2.Request(uri)
+        self.__cookies.add_cookie_header(cookie_req)
+        if cookie_req.has_header('Cookie'):
+            headers['Cookie'] = cookie_req.get_header('Cookie')
+        if data is None:
+            response = self.pool.request('GET', uri, headers=headers,
+                                         stream=True)
+        else:
+            # Logging in twice does no harm.
+            response = self.pool.request('POST', uri, data, headers,
+                                         stream=True, idempotent=True)
+        self.__cookies.extract_cookies(response, cookie_req)
+        self.requests += 1
+        return response
+
+    def __basic_auth_header(self):
+        auth = base64.b64encode(self.username + ':' + self.password)
+        return {'Authorization': 'Basic ' + auth}
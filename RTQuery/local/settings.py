@@ -0,0 +1,108 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""
+Snapshots of a plugin's registry values that are cheap to read
+"""
+
+import threading
+
+class Settings(object):
+    '''
+    A plugin's configuration, read through snapshots whose attributes are
+    its registry values:  settings.get(channel).enabled rather than
+    plugin.registryValue('enabled', channel).  A snapshot looks each value
+    up in the registry the first time it is asked for it; after that the
+    value is a plain attribute.  Changing any value that has been looked
+    up throws all of the snapshots away, so the next get starts afresh.
+
+    group is the plugin's registry group, such as
+    conf.supybot.plugins.SimpleJira.  Call close when the plugin dies so
+    the registry stops telling this about changes.
+    '''
+    def __init__(self, group):
+        self.group       = group
+        self.__snapshots = {}  # channel (None for global) -> Snapshot
+        self.__watched   = {}  # id(registry value) -> registry value
+        self.__lock      = threading.Lock()
+        # removeCallback compares callbacks with "is", so keep just one.
+        self.__on_change = self.__forget
+
+    def get(self, channel=None):
+        '''
+        Return the snapshot for a channel, or for the global values if
+        channel is None.  Channel snapshots have the global values too.
+        A snapshot should only be kept as long as a command takes:  once
+        something changes it is no longer kept up to date.
+        '''
+        snapshot = self.__snapshots.get(channel)
+        if snapshot is None:
+            snapshot = Snapshot(self, channel)
+            self.__snapshots[channel] = snapshot
+        return snapshot
+
+    def lookup(self, name, channel=None):
+        '''
+        Read a value from the registry the way registryValue does, and
+        watch it for changes.
+        '''
+        value = self.group.get(name)
+        if channel:
+            value = value.getSpecific(channel=channel, check=False)
+        with self.__lock:
+            if id(value) not in self.__watched:
+                # Watch before reading so a change in between is noticed.
+                value.addCallback(self.__on_change)
+                self.__watched[id(value)] = value
+        return value()
+
+    def close(self):
+        with self.__lock:
+            for value in self.__watched.itervalues():
+                value.removeCallback(self.__on_change)
+            self.__watched.clear()
+        self.__snapshots = {}
+
+    def __forget(self):
+        self.__snapshots = {}
+
+
+class Snapshot(object):
+    '''
+    One channel's registry values, as attributes
+    '''
+    def __init__(self, settings, channel):
+        self._settings = settings
+        self._channel  = channel
+
+    def __getattr__(self, name):
+        # Only reached the first time each value is asked for
+        if name.startswith('_'):
+            raise AttributeError(name)
+        value = self._settings.lookup(name, self._channel)
+        setattr(self, name, value)
+        return value
@@ -0,0 +1,72 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Coalescing of identical concurrent requests
+"""
+
+import threading
+
+class SingleFlight(object):
+    '''
+    Makes concurrent requests for the same thing share one fetch.  While
+    work for a key is in flight, submitting more work for that key just
+    returns the Future for the work already under way, so every caller
+    gets the same result, or the same exception.  If given, on_coalesce
+    is called each time that happens.
+    '''
+    def __init__(self, on_coalesce=None):
+        self.on_coalesce = on_coalesce
+        self.coalesced   = 0
+        self.__flights   = {}  # key -> Future
+        self.__lock      = threading.Lock()
+
+    def submit(self, key, submit, func, *args, **kwargs):
+        '''
+        Return the Future for key's work in flight, or if there isn't any,
+        start some with submit(func, *args, **kwargs) (typically a
+        RequestEngine's submit method) and return its Future.
+        '''
+        with self.__lock:
+            future = self.__flights.get(key)
+            if future is not None and not future.done():
+                self.coalesced += 1
+                coalesced = True
+            else:
+                future = submit(func, *args, **kwargs)
+                self.__flights[key] = future
+                coalesced = False
+        if coalesced:
+            if self.on_coalesce is not None:
+                self.on_coalesce(key)
+        else:
+            future.add_done_callback(lambda done: self.__land(key, done))
+        return future
+
+    def __land(self, key, future):
+        with self.__lock:
+            if self.__flights.get(key) is future:
+                del self.__flights[key]
@@ -26,19 +26,38 @@
 ###
 
 import supybot.utils as utils
+import supybot.conf as conf
 from supybot.commands import *
-import supybot.plugins as plugins
 import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
+import supybot.schedule as schedule
 
-import cookielib
-import urllib
-import urllib2
-from urlparse import urljoin
+import functools
+import httplib
+import socket
+import threading
+from urlparse import urljoin, urlparse
 
-class RTError(Exception):
-    def __init__(self, value):
-        self.value = value
+from local import breaker
+from local import cache
+from local import diskcache
+from local import engine
+from local import httppool
+from local import metrics
+from local import ratelimit
+from local import replyformat
+from local import rtparse
+from local import rtsession
+from local import singleflight
+from local.rtparse import RTError
+from local.settings import Settings
+
+# The ticket attributes we display
+TICKET_FIELDS = ('id', 'Status', 'Subject', 'CF.{Security}',
+                 'CF.{Security Threat}')
+
+# RT keeps ticket ids in 32-bit integer columns, so none are bigger.
+MAX_TICKET_ID = 2 ** 31 - 1
 
 class RTQuery(callbacks.Plugin):
     """Add the help for "@plugin help RTQuery" here
@@ -46,7 +65,246 @@ class RTQuery(callbacks.Plugin):
     threaded = True
 
     def __init__(self, irc):
-        super(RTQuery, self).__init__(irc)
+        self.__parent = super(RTQuery, self)
+        self.__parent.__init__(irc)
+        self.__settings     = Settings(conf.supybot.plugins.get(self.name()))
+        self.__metrics      = metrics.Metrics('RTQuery')
+        self.__engine       = engine.RequestEngine(name='RTQuery',
+                log=self.log, on_connect=self.__observe_connect)
+        self.__lookups      = singleflight.SingleFlight(
+                on_coalesce=self.__observe_coalesce)
+        self.__breakers     = breaker.CircuitBreakers(
+                on_open=self.__observe_breaker_open)
+        self.__limiter      = ratelimit.RateLimiter()
+        self.__session      = None
+        self.__session_lock = threading.Lock()
+        self.__ticket_cache = cache.TTLCache(store=self.__open_store())
+        self.__hot_tickets  = cache.HotSet()
+        self.__prefetch_lock = threading.Lock()
+        schedule.addPeriodicEvent(self.__export_metrics,
+                                  self.registryValue('metricsInterval'),
+                                  name='RTQuery.metrics', now=False)
+        if self.registryValue('prefetchInterval') > 0:
+            schedule.addPeriodicEvent(self.__prefetch,
+                                      self.registryValue('prefetchInterval'),
+                                      name='RTQuery.prefetch', now=False)
+        self.__webhook = self.__start_webhook()
+        # replyTemplate is compiled when it's first needed, and again only
+        # after it or the URI changes.
+        self.__formatter    = None
+        self.__watches      = []
+        self.__watch(('replyTemplate', 'uri'), self.__forget_formatter)
+
+    def die(self):
+        for (value, callback) in self.__watches:
+            value.removeCallback(callback)
+        self.__settings.close()
+        for name in ('RTQuery.metrics', 'RTQuery.prefetch'):
+            try:
+                schedule.removePeriodicEvent(name)
+            except KeyError:
+                pass
+        if self.__webhook is not None:
+            self.__webhook.stop()
+        self.__engine.shutdown()
+        if self.__ticket_cache.store is not None:
+            self.__ticket_cache.store.close()
+        self.__parent.die()
+
+    def __watch(self, names, callback):
+        """
+        Call callback whenever any of the named settings changes, until
+        the plugin dies.
+        """
+        for name in names:
+            value = self.registryValue(name, value=False)
+            value.addCallback(callback)
+            self.__watches.append((value, callback))
+
+    def __start_webhook(self):
+        port = self.registryValue('webhookPort')
+        if not port:
+            return None
+        if not self.registryValue('webhookSecret'):
+            self.log.warning('Not listening for RT notifications because '
+                             'webhookSecret is not set')
+            return None
+        # Most bots don't listen for notifications, so only load the
+        # HTTP server when this one does.
+        from local import webhook
+        try:
+            return webhook.WebhookServer(self.registryValue('webhookAddress'),
+                    port, self.registryValue('webhookSecret'),
+                    self.__handle_webhook, log=self.log,
+                    name='RTQuery webhook').start()
+        except socket.error as e:
+            self.log.error('Failed to listen for RT notifications on port '
+                           '{0}: {1}'.format(port, e))
+            return None
+
+    def __handle_webhook(self, path, payload):
+        # This runs on one of the webhook listener's threads.
+        ticketno = ticket_id_from_webhook(payload)
+        if ticketno is not None:
+            self.__ticket_cache.invalidate_where(
+                    lambda key: key[1] == ticketno)
+
+    def __open_store(self):
+        """
+        Return a DiskCache for the ticket cache if diskCache is on, or None
+        """
+        if not self.registryValue('diskCache'):
+            return None
+        path = conf.supybot.directories.data.dirize('RTQuery.cache.sqlite')
+        return diskcache.DiskCache(path, self.registryValue('diskCacheSize'),
+                                   log=self.log)
+
+    def __observe_connect(self, host, seconds):
+        self.__metrics.observe('connect', 'ok', seconds)
+
+    def __observe_coalesce(self, key):
+        self.__metrics.increment('coalesced')
+
+    def __observe_breaker_open(self, base_uri, circuit):
+        self.log.warning(('Not sending requests to {0} for {1} seconds after '
+                          '{2} failures in a row').format(base_uri,
+                                  circuit.cooldown, circuit.failures))
+        self.__metrics.increment('breaker_opened')
+
+    def __export_metrics(self):
+        path = self.registryValue('metricsFile')
+        if not path:
+            return
+        try:
+            self.__metrics.write_prometheus(path)
+        except EnvironmentError as e:
+            self.log.warning('Failed to write metrics to {0}: {1}'.format(
+                    path, e))
+
+    def __get_session(self):
+        """
+        Return the RTSession for the currently-configured server and
+        credentials, replacing the old one if the configuration changed.
+        """
+        settings = self.__settings.get()
+        key = (settings.uri, settings.authType.lower(), settings.username,
+               settings.password)
+        with self.__session_lock:
+            session = self.__session
+            if session is None or key != (session.base_uri, session.auth_type,
+                                          session.username, session.password):
+                session = rtsession.RTSession(self.__engine.pool, *key,
+                                              metrics=self.__metrics)
+                self.__session = session
+            return session
+
+    def __rt_query(self, irc, endpoint, rest_uri, parse, stale_reply=None,
+                   lane=None):
+        """
+        Fetch a location relative to RT's base URI and parse it with the
+        given method on the request engine, timing it as endpoint.  If that
+        fails, reply with an error and return None.  Concurrent queries for
+        the same thing share one request and its result.  Queries in the
+        same lane (usually a channel) wait their turn behind each other, not
+        behind everyone else's.
+
+        If RT has been failing so much that we have stopped asking it for
+        now, reply with stale_reply, if given, or an error right away.
+        """
+        settings = self.__settings.get()
+        try:
+            session = self.__get_session()
+        except ValueError:
+            self.log.error('Unknown authType "{0}"'.format(settings.authType))
+            irc.errorInvalid('authType', settings.authType)
+            return None
+        self.__engine.pool.configure(settings.connectTimeout,
+                                     settings.readTimeout)
+        self.__breakers.configure(settings.breakerThreshold,
+                                  settings.breakerCooldown)
+        if not self.__breakers.available(session.base_uri):
+            self.__reply_unavailable(irc, stale_reply)
+            return None
+        self.__engine.configure(settings.maxQueuedPerChannel)
+        try:
+            future = self.__lookups.submit(
+                    (session.base_uri, endpoint, rest_uri),
+                    functools.partial(self.__engine.submit_for, lane),
+                    self.__fetch, session, endpoint, rest_uri, parse)
+        except engine.QueueFullError:
+            irc.error('Too many lookups from here are waiting for RT; try '
+                      'again in a moment.')
+            return None
+        try:
+            return future.result(settings.requestTimeout)
+        except breaker.CircuitOpenError:
+            self.__reply_unavailable(irc, stale_reply)
+        except ratelimit.RateLimitedError as e:
+            irc.error(e.reason)
+        except httppool.HTTPError as e:
+            self.log.error('GET on URI {uri} yielded HTTP {code} {msg}'.format(
+                    uri=e.geturl(), code=e.code, msg=e.msg))
+            irc.error('failed to retrieve ticket data')
+        except httppool.URLError as e:
+            self.log.error('GET on URI {uri} failed: {err}'.format(
+                    uri=rest_uri, err=e.reason))
+            irc.error('failed to retrieve ticket data')
+        except RTError as e:
+            irc.error(e.value)
+        return None
+
+    def __fetch(self, session, endpoint, rest_uri, parse):
+        # This runs on one of the request engine's threads.
+        with self.__metrics.timed(endpoint):
+            response = self.__get(session, rest_uri)
+            try:
+                return parse(response)
+            except (socket.error, httplib.HTTPException) as err:
+                # We read the body as we parse it, so RT can still time out
+                # or hang up on us after the breaker saw the request work.
+                self.__breakers.record_failure(session.base_uri)
+                raise httppool.URLError(err)
+            finally:
+                response.close()
+
+    def __get(self, session, rest_uri):
+        # RT doesn't usually limit how fast we go, but whatever sits in
+        # front of it might, and it would do that per account.
+        limit_key = (urlparse(session.base_uri).netloc, session.username)
+        settings  = self.__settings.get()
+        if self.__limiter.acquire(limit_key, settings.rateLimit,
+                                  settings.rateBurst,
+                                  settings.requestTimeout):
+            self.__metrics.increment('throttled')
+        try:
+            response = self.__breakers.call(session.base_uri, session.get,
+                                            rest_uri)
+        except httppool.HTTPError as err:
+            self.__limiter.observe(limit_key, err.code, err.info())
+            raise
+        self.__limiter.observe(limit_key, response.getcode(), response.info())
+        return response
+
+    def __reply_unavailable(self, irc, stale_reply):
+        if stale_reply is not None:
+            irc.reply(stale_reply + ' (cached; RT is not answering)')
+        else:
+            irc.error('RT is not answering right now; try again later.')
+
+    def __format_ticket(self, ticketno, tkt_attrs):
+        formatter = self.__formatter
+        if formatter is None:
+            # Rarely needed, and a snapshot could still have the old values.
+            template = self.registryValue('replyTemplate')
+            if isinstance(template, str):
+                template = template.decode('utf-8')
+            formatter = replyformat.compile_template(template,
+                    ticket_reply_fields(self.registryValue('uri')))
+            self.__formatter = formatter
+        return formatter(ticketno, tkt_attrs)
+
+    def __forget_formatter(self):
+        self.__formatter = None
 
     def getticket(self, irc, msg, args, ticketno):
         """<id>
@@ -54,91 +312,300 @@ class RTQuery(callbacks.Plugin):
         Display information about a ticket in RT along with a link to
         it on the web.
         """
-        channel = msg.args[0]
-        if not self.registryValue('enabled', channel):
+        settings = self.__settings.get(msg.args[0])
+        if not settings.enabled:
             return
-        base_uri = self.registryValue('uri')
-        rest_uri = urljoin(base_uri, "REST/1.0/ticket/{0}".format(ticketno))
-        if self.registryValue('authtype').lower() == 'basic':
-            auth_handler = urllib2.HTTPBasicAuthHandler()
-            auth_handler.add_password(self.registryValue('authRealm'),
-                                      self.registryValue('uri'),
-                                      self.registryValue('username'),
-                                      self.registryValue('password'))
-            opener = urllib2.build_opener(auth_handler)
-            login  = urllib2.Request(rest_uri)
-        elif self.registryValue('authtype').lower() == 'builtin':
-            cjar   = cookielib.CookieJar()
-            opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cjar))
-            ldata  = urllib.urlencode({'user': self.registryValue('username'),
-                                       'pass': self.registryValue('password')})
-            login  = urllib2.Request(rest_uri, ldata)
-        else:
-            self.log.error('Unknown authType "{0}"'.format(
-                    self.registryValue('authtype')))
-            irc.errorInvalid('authType', self.registryValue('authtype'))
+        self.__ticket_cache.configure(settings.cacheSize, settings.cacheTTL)
+        self.__hot_tickets.configure(settings.cacheSize)
+        cache_key = (settings.uri, ticketno)
+        rest_uri  = 'REST/1.0/ticket/{0}'.format(ticketno)
+        self.__hot_tickets.touch(cache_key)
+        (tkt_attrs, is_stale) = self.__ticket_cache.get_or_stale(cache_key,
+                self.__stale_grace())
+        if tkt_attrs is not None:
+            # Answer right away, even if it's a bit old, and catch up later.
+            irc.reply(self.__format_ticket(ticketno, tkt_attrs))
+            if is_stale:
+                self.__revalidate(irc, msg, cache_key, rest_uri, tkt_attrs)
+            return
+        stale = self.__ticket_cache.get_stale(cache_key)
+        if stale is not None:
+            stale = self.__format_ticket(ticketno, stale)
+        tkt_attrs = self.__rt_query(irc, 'ticket', rest_uri,
+                                    self.__parse_rt_response,
+                                    stale_reply=stale, lane=lane_for(msg))
+        if tkt_attrs is None:
             return
+        self.__ticket_cache.set(cache_key, tkt_attrs)
+        irc.reply(self.__format_ticket(ticketno, tkt_attrs))
+
+    getticket = wrap(getticket, ['positiveInt'])
+
+    def __stale_grace(self):
+        """
+        How long after a ticket's cacheTTL passes that we may still show it
+        while refreshing it
+        """
+        settings = self.__settings.get()
+        return max(settings.cacheHardTTL - settings.cacheTTL, 0)
+
+    def __revalidate(self, irc, msg, cache_key, rest_uri, old_attrs):
+        """
+        Refresh a ticket we just showed from the cache in the background,
+        and show it again if its status or subject changed.
+        """
+        def correct(future):
+            # This runs on one of the request engine's threads.
+            if future.exception() is not None:
+                self.log.info('Failed to refresh ticket {0}: {1}'.format(
+                        cache_key[1], future.exception()))
+                return
+            tkt_attrs = future.result()
+            self.__ticket_cache.set(cache_key, tkt_attrs)
+            if ((tkt_attrs.get('Status'), tkt_attrs.get('Subject')) !=
+                    (old_attrs.get('Status'), old_attrs.get('Subject')) and
+                    self.__settings.get(msg.args[0]).postCorrections):
+                irc.reply('Correction: ' +
+                          self.__format_ticket(cache_key[1], tkt_attrs))
         try:
-            response = opener.open(login)
-            tkt_attrs = self.__parse_rt_response(response)
-        except urllib2.HTTPError as e:
-            self.log.error('GET on URI {uri} yielded HTTP {code} {msg}'.format(
-                    uri=rest_uri, code=e.code, msg=e.msg))
-            irc.error('failed to retrieve ticket data')
+            session = self.__get_session()
+        except ValueError:
             return
-        except RTError as e:
-            irc.error(e.value)
+        if not self.__breakers.available(session.base_uri):
             return
+        future = self.__lookups.submit(
+                (session.base_uri, 'ticket', rest_uri),
+                self.__engine.submit, self.__fetch, session, 'ticket',
+                rest_uri, self.__parse_rt_response)
+        future.add_done_callback(correct)
 
-        # The "id" field for a ticket looks like "ticket/123"
-        real_tkt_id = tkt_attrs['id'].split('/')[1]
+    def gettickets(self, irc, msg, args, ticket_ranges):
+        """<id> [<id> ...]
 
-        msg_bits = ['Ticket']
-        tkt_flags = []
-        if str(ticketno) != real_tkt_id:
-            msg_bits.append('*' + real_tkt_id)
+        Display information about several tickets in RT, each along with
+        a link to it on the web.  Ranges of ids such as 100-110 are also
+        accepted.
+        """
+        settings = self.__settings.get(msg.args[0])
+        if not settings.enabled:
+            return
+        max_tickets = settings.maxTickets
+        ticketnos = []
+        for ticket_range in ticket_ranges:
+            try:
+                new_ticketnos = parse_ticket_range(ticket_range)
+            except ValueError:
+                irc.errorInvalid('ticket id or range', ticket_range)
+                return
+            if len(ticketnos) + len(new_ticketnos) > max_tickets:
+                irc.error('at most {0} tickets may be shown at once'.format(
+                        max_tickets))
+                return
+            ticketnos.extend(ticketno for ticketno in new_ticketnos
+                             if ticketno not in ticketnos)
+
+        # One request fetches every ticket.
+        records = self.__rt_query(irc, 'show',
+                'REST/1.0/show?id=ticket/{0}'.format(
+                ','.join(str(ticketno) for ticketno in ticketnos)),
+                lambda response: list(self.__parse_rt_responses(response)),
+                lane=lane_for(msg))
+        if records is None:
+            return
+        replies = []
+        if len(records) != len(ticketnos):
+            # We can't tell which record goes with which request, so we
+            # can't mark merged tickets.
+            self.log.warning('Asked RT for {0} tickets but got {1}'.format(
+                    len(ticketnos), len(records)))
+            ticketnos = [None] * len(records)
+        for (ticketno, record) in zip(ticketnos, records):
+            if isinstance(record, RTError):
+                replies.append(record.value)
+            elif not is_ticket(record):
+                replies.append('RT sent no ticket')
+            else:
+                if ticketno is None:
+                    ticketno = record['id'].split('/')[1]
+                replies.append(self.__format_ticket(ticketno, record))
+        irc.replies(replies)
+
+    gettickets = wrap(gettickets, [many('somethingWithoutSpaces')])
+
+    def __prefetch(self):
+        # This runs in the scheduler, so leave the real work to the engine.
+        self.__engine.submit(self.__refresh_hot_tickets)
+
+    def __refresh_hot_tickets(self):
+        """
+        Fetch the tickets people have been asking about lately with a single
+        request so they stay in the cache, up to prefetchBudget of them,
+        security tickets first.  Tickets nobody asked about in the last
+        prefetchWindow seconds are left to expire.
+        """
+        if not self.__prefetch_lock.acquire(False):
+            # The last round is still going.
+            return
+        try:
+            settings = self.__settings.get()
+            base_uri = settings.uri
+            hot = self.__hot_tickets.hot(settings.prefetchWindow,
+                                         priority=self.__is_important)
+            ticketnos = [ticketno for (uri, ticketno) in hot
+                         if uri == base_uri]
+            ticketnos = ticketnos[:settings.prefetchBudget]
+            if not ticketnos:
+                return
+            records = self.__fetch(self.__get_session(), 'prefetch',
+                    'REST/1.0/show?id=ticket/{0}'.format(
+                            ','.join(str(ticketno) for ticketno in ticketnos)),
+                    lambda response: list(self.__parse_rt_responses(response)))
+            if len(records) != len(ticketnos):
+                self.log.info('Asked RT for {0} tickets but got {1}'.format(
+                        len(ticketnos), len(records)))
+                return
+            self.__ticket_cache.configure(settings.cacheSize,
+                                          settings.cacheTTL)
+            for (ticketno, record) in zip(ticketnos, records):
+                if is_ticket(record):
+                    self.__ticket_cache.set((base_uri, ticketno), record)
+        except (httppool.URLError, RTError, ValueError) as e:
+            self.log.info('Failed to refresh hot tickets: {0}'.format(e))
+        finally:
+            self.__prefetch_lock.release()
+
+    def __is_important(self, cache_key):
+        tkt_attrs = self.__ticket_cache.get_stale(cache_key)
+        if tkt_attrs is None:
+            return False
+        return tkt_attrs.get('CF.{Security}', '').lower() == 'yes'
+
+    def stats(self, irc, msg, args):
+        """takes no arguments
+
+        Show how long requests to RT have been taking, by endpoint and
+        outcome, how many lookups shared another's request, and how often
+        we slowed down to stay under rateLimit.  Times are in seconds.
+        """
+        lines = self.__metrics.summary()
+        if lines:
+            irc.replies(lines, joiner='; ')
         else:
-            msg_bits.append(real_tkt_id)
-        if tkt_attrs.get('Status'):
-            tkt_flags.append(tkt_attrs['Status'])
-        if tkt_attrs.get('CF.{Security}', '').lower() == 'yes':
-            tkt_flags.append('security')
-        if tkt_attrs.get('CF.{Security Threat}'):
-            tkt_flags.append('threat=' + tkt_attrs['CF.{Security Threat}'])
-        if tkt_flags:
-            msg_bits.append('(' + ', '.join(tkt_flags) + ')')
-        msg_bits[-1] += ':'
-        msg_bits.append(tkt_attrs.get('Subject', '(no subject)'))
-        msg_bits.append('-')
-        msg_bits.append(urljoin(base_uri,
-                'Ticket/Display.html?id={0}'.format(real_tkt_id)))
-        irc.reply(' '.join(msg_bits))
+            irc.reply('No requests have been made to RT yet.')
 
-    getticket = wrap(getticket, ['positiveInt'])
+    stats = wrap(stats, ['owner'])
 
 
     def __parse_rt_response(self, response):
-        attrs = {}
-        for line in response.readlines():
-            if line.startswith('RT/'):
-                # RT puts its real response codes at the top of the response
-                # content like so:  "RT/3.8.8 200 Ok"
-                try:
-                    (svr, code, msg) = line.strip().split(None, 2)
-                    if code.startswith('4') or code.startswith('5'):
-                        raise urllib2.HTTPError(response.geturl(), code, msg,
-                                                None, None)
-                except ValueError:
-                    # Not enough elements; skip it
-                    pass
-            elif line.startswith('#'):
-                # RT's error messages appear after octothorpes like this:
-                # "# Ticket 0 does not exist."
-                raise RTError(line.strip().split('#', 1)[1].strip())
-            elif ':' in line:
-                # Key: value pair
-                (key, val) = line.split(':', 1)
-                attrs[key.strip()] = val.strip()
-        return attrs
+        """
+        Parse a response containing a single RT object and return its
+        attributes, raising RTError if RT reported an error instead.  We
+        stop reading as soon as we have everything we display.
+        """
+        for record in rtparse.parse_rt_stream(response.read, response.geturl(),
+                                              TICKET_FIELDS):
+            if isinstance(record, RTError):
+                raise record
+            if is_ticket(record):
+                return record
+            break
+        # Caching anything less would break lookups until it expired.
+        raise RTError('RT sent no ticket')
+
+    def __parse_rt_responses(self, response):
+        """
+        Parse a response that contains any number of RT objects separated
+        by "--" lines, yielding each object's attributes as soon as it is
+        complete.  Objects that RT reported errors for yield RTErrors.
+        """
+        return rtparse.parse_rt_stream(response.read, response.geturl(),
+                                       TICKET_FIELDS)
+
+
+def is_ticket(record):
+    """
+    Return whether something parse_rt_stream yielded is a ticket we can
+    show and cache, rather than an RTError or a fragment without an id
+    """
+    return not isinstance(record, RTError) and 'id' in record
+
+def ticket_flags(tkt_attrs):
+    """
+    The notable things about a ticket that replies show in parentheses
+    """
+    tkt_flags = []
+    if tkt_attrs.get('Status'):
+        tkt_flags.append(tkt_attrs['Status'])
+    if tkt_attrs.get('CF.{Security}', '').lower() == 'yes':
+        tkt_flags.append('security')
+    if tkt_attrs.get('CF.{Security Threat}'):
+        tkt_flags.append('threat=' + tkt_attrs['CF.{Security Threat}'])
+    return tkt_flags
+
+def ticket_reply_fields(base_uri):
+    """
+    The fields that replyTemplate may use, as functions of the ticket
+    number someone asked for and the ticket RT sent back.  Links to tickets
+    are made under base_uri, which is joined here once instead of for every
+    ticket.
+    """
+    display_uri = urljoin(base_uri, 'Ticket/Display.html?id=')
+    def real_id(ticketno, tkt_attrs):
+        # The "id" field for a ticket looks like "ticket/123"
+        return tkt_attrs['id'].split('/')[1]
+    def shown_id(ticketno, tkt_attrs):
+        real_tkt_id = real_id(ticketno, tkt_attrs)
+        if str(ticketno) != real_tkt_id:
+            return '*' + real_tkt_id
+        return real_tkt_id
+    # RT sends UTF-8, and the template is unicode.
+    def text(value):
+        return value.decode('utf-8', 'replace')
+    return {'id':      shown_id,
+            'flags':   lambda ticketno, tkt_attrs: text(
+                               replyformat.format_flags(
+                                       ticket_flags(tkt_attrs))),
+            'status':  lambda ticketno, tkt_attrs: text(
+                               tkt_attrs.get('Status', '')),
+            'subject': lambda ticketno, tkt_attrs: text(
+                               tkt_attrs.get('Subject', '(no subject)')),
+            'url':     lambda ticketno, tkt_attrs: display_uri + real_id(
+                               ticketno, tkt_attrs)}
+
+def ticket_id_from_webhook(payload):
+    """
+    Find the ticket number in a notification that an RT ticket changed,
+    which a scrip can send as a form or as JSON with a "ticket" (or "id")
+    field of either "123" or "ticket/123".  Returns None if there isn't
+    one.
+    """
+    ticket_id = payload.get('ticket', payload.get('id'))
+    try:
+        return int(str(ticket_id).rsplit('/', 1)[-1])
+    except ValueError:
+        return None
+
+
+def parse_ticket_range(ticket_range):
+    """
+    Turn "123" into xrange(123, 124) and "100-103" into xrange(100, 104),
+    raising ValueError for anything else, including ids that RT can't have
+    (and that xrange can't handle).
+    """
+    (first, sep, last) = ticket_range.partition('-')
+    first = int(first)
+    last  = int(last) if sep else first
+    if first < 1 or last < first or last > MAX_TICKET_ID:
+        raise ValueError(ticket_range)
+    return xrange(first, last + 1)
+
+def lane_for(msg):
+    """
+    The request engine lane for a message's lookups:  its channel, or in
+    private, the person who sent it
+    """
+    if ircutils.isChannel(msg.args[0]):
+        return msg.args[0]
+    return msg.nick
 
 Class = RTQuery
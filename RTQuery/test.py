@@ -25,9 +25,257 @@
 
 ###
 
+import BaseHTTPServer
+import os.path
+import re
+import shutil
+import socket
+import SocketServer
+import tempfile
+import threading
+import urlparse
+
 from supybot.test import *
 
+from local import metrics
+
 class RTQueryTestCase(PluginTestCase):
     plugins = ('RTQuery',)
 
+class MetricsTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        SupyTestCase.tearDown(self)
+
+    def testPrometheusFile(self):
+        stats = metrics.Metrics('RTQuery', buckets=(0.1, 1))
+        stats.observe('GET ticket', '200', 0.05)
+        stats.observe('GET ticket', '200', 0.5)
+        stats.observe('GET "odd"\nendpoint', 'timeout', 5)
+        stats.increment('cache hit', 2)
+        path = os.path.join(self.dir, 'rtquery.prom')
+        stats.write_prometheus(path)
+        self.assertEqual(os.listdir(self.dir), ['rtquery.prom'])
+        # Read it back the way node_exporter would.
+        types   = {}
+        samples = {}
+        with open(path) as f:
+            for line in f:
+                if line.startswith('# TYPE '):
+                    (name, kind) = line.split()[2:]
+                    types[name] = kind
+                elif not line.startswith('#'):
+                    match = re.match(r'(\w+)\{(.*)\} (\S+)$', line)
+                    labels = re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"',
+                                        match.group(2))
+                    samples[(match.group(1), tuple(labels))] = \
+                            float(match.group(3))
+        self.assertEqual(types, {
+                'supybot_tracker_request_seconds': 'histogram',
+                'supybot_tracker_events_total':    'counter'})
+        def sample(suffix, endpoint, outcome, *extra):
+            return samples[('supybot_tracker_request_seconds_' + suffix,
+                            (('plugin', 'RTQuery'), ('endpoint', endpoint),
+                             ('outcome', outcome)) + extra)]
+        self.assertEqual([sample('bucket', 'GET ticket', '200', ('le', le))
+                          for le in ('0.1', '1', '+Inf')], [1, 2, 2])
+        self.assertEqual(sample('count', 'GET ticket', '200'), 2)
+        self.assertAlmostEqual(sample('sum', 'GET ticket', '200'), 0.55)
+        self.assertEqual([sample('bucket', 'GET \\"odd\\"\\nendpoint',
+                                 'timeout', ('le', le))
+                          for le in ('0.1', '1', '+Inf')], [0, 0, 1])
+        self.assertEqual(samples[('supybot_tracker_events_total',
+                                  (('plugin', 'RTQuery'),
+                                   ('event', 'cache hit')))], 2)
+
+class _TicketHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Speaks enough of RT's REST 1.0 interface to show tickets 1 through 9,
+    logging in whoever POSTs the right credentials with a session cookie.
+    Each ticket also gets whatever extra fields the server's "extra" dict
+    holds for it.  While the server's "truncate" flag is set, it hangs up
+    partway through each response.  The server remembers the path of each
+    request and the client address of each connection.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.add(self.client_address)
+
+    # The client hangs up once it has what it needs.
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        form = urlparse.parse_qs(self.rfile.read(length))
+        if form == {'user': ['bot'], 'pass': ['secret']}:
+            self.server.logins += 1
+            self.server.session = 'session{0}'.format(self.server.logins)
+            self.show({'Set-Cookie': 'RT_SID_test.80={0}; path=/'.format(
+                    self.server.session)})
+        else:
+            self.send_body('RT/3.8.8 401 Credentials required\n')
+
+    def do_GET(self):
+        cookie = 'RT_SID_test.80={0}'.format(self.server.session)
+        if self.headers.getheader('Cookie') == cookie:
+            self.show()
+        else:
+            self.send_body('RT/3.8.8 401 Credentials required\n')
+
+    def show(self, headers=None):
+        parsed = urlparse.urlsplit(self.path)
+        self.server.paths.append(self.path)
+        if parsed.path.endswith('/show'):
+            obj_id = urlparse.parse_qs(parsed.query)['id'][0]
+            ticketnos = obj_id.split('/', 1)[1].split(',')
+        else:
+            ticketnos = [parsed.path.rsplit('/', 1)[1]]
+        records = []
+        for ticketno in ticketnos:
+            if 1 <= int(ticketno) <= 9:
+                records.append('id: ticket/{0}\nQueue: General\n'
+                               'Subject: Ticket number {0}\nStatus: open\n'
+                               '{1}'.format(ticketno,
+                                            self.server.extra.get(ticketno, '')))
+            else:
+                records.append('# Ticket {0} does not exist.\n'.format(
+                        ticketno))
+        self.send_body('RT/3.8.8 200 Ok\n\n' + '\n--\n\n'.join(records),
+                       headers)
+
+    def send_body(self, body, headers=None):
+        length = len(body)
+        if self.server.truncate:
+            body = body[:length // 2]
+            self.close_connection = 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(length))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class RTQueryServerTestCase(PluginTestCase):
+    plugins = ('RTQuery',)
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _TicketHandler)
+        self.server.connections = set()
+        self.server.logins = 0
+        self.server.session = None
+        self.server.paths = []
+        self.server.extra = {}
+        self.server.truncate = False
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.uri = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        conf.supybot.plugins.RTQuery.enabled.setValue(True)
+        conf.supybot.plugins.RTQuery.uri.setValue(self.uri)
+        conf.supybot.plugins.RTQuery.username.setValue('bot')
+        conf.supybot.plugins.RTQuery.password.setValue('secret')
+
+    def tearDown(self):
+        conf.supybot.plugins.RTQuery.enabled.setValue(False)
+        self.server.shutdown()
+        self.server.server_close()
+        PluginTestCase.tearDown(self)
+
+    def testSessionReuse(self):
+        self.assertRegexp('getticket 1', '^Ticket 1 .*Ticket number 1')
+        self.assertRegexp('getticket 2', '^Ticket 2 .*Ticket number 2')
+        self.assertRegexp('getticket 3', '^Ticket 3 .*Ticket number 3')
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(len(self.server.connections), 1)
+        # RT forgets the session, so the bot logs in again, just once.
+        self.server.session = 'expired'
+        self.assertRegexp('getticket 4', '^Ticket 4 .*Ticket number 4')
+        self.assertRegexp('getticket 5', '^Ticket 5 .*Ticket number 5')
+        self.assertEqual(self.server.logins, 2)
+
+    def testCache(self):
+        self.assertRegexp('getticket 1', '^Ticket 1 ')
+        self.assertRegexp('getticket 1', '^Ticket 1 ')
+        self.assertEqual(len(self.server.paths), 1)
+        self.assertRegexp('getticket 12', 'does not exist')
+        self.assertRegexp('getticket 12', 'does not exist')
+        self.assertEqual(len(self.server.paths), 3)
+
+    def testGettickets(self):
+        self.assertRegexp('gettickets 2-4 12 3',
+                          '^Ticket 2 .*Ticket 3 .*Ticket 4 .*'
+                          'Ticket 12 does not exist')
+        # That took one request, which asked for each ticket once.
+        self.assertEqual(self.server.paths,
+                         ['/REST/1.0/show?id=ticket/2,3,4,12'])
+        self.assertRegexp('gettickets 1-51', 'at most 50 tickets')
+        self.assertError('gettickets 4-2')
+        self.assertRegexp('gettickets 99999999999999999999', 'not a valid')
+        self.assertRegexp('gettickets 1-99999999999999999999', 'not a valid')
+        self.assertEqual(len(self.server.paths), 1)
+
+    def testReplyTemplate(self):
+        template = conf.supybot.plugins.RTQuery.replyTemplate
+        self.assertRaises(registry.InvalidRegistryValue, template.setValue,
+                          '{id}: {owner}')
+        self.assertRaises(registry.InvalidRegistryValue, template.setValue,
+                          '{id')
+        self.server.extra['3'] = 'CF.{Security Threat}: d\xc3\xa9j\xc3\xa0 vu\n'
+        try:
+            template.setValue('#{id}{flags} \xe2\x80\x94 {subject}')
+            self.assertResponse('getticket 3',
+                                '#3 (open, threat=d\xc3\xa9j\xc3\xa0 vu) '
+                                '\xe2\x80\x94 Ticket number 3')
+        finally:
+            template.setValue(template._default)
+
+    def testLongFieldAfterNeededOnes(self):
+        # The parser skips long fields it doesn't need without reading
+        # them into memory, but the ticket before one is still complete.
+        self.server.extra['7'] = ('CF.{Security}: no\n'
+                                  'CF.{Security Threat}: none\n'
+                                  'CF.{Core Dump}: ' + 'x' * 20000 + '\n')
+        self.assertRegexp('getticket 7', '^Ticket 7 .*Ticket number 7')
+        self.assertRegexp('getticket 7', '^Ticket 7 .*Ticket number 7')
+        self.assertEqual(len(self.server.paths), 1)
+        self.assertRegexp('gettickets 7 8',
+                          '^Ticket 7 .*Ticket number 7.*Ticket 8 ')
 
+    def testTruncatedResponse(self):
+        conf.supybot.plugins.RTQuery.breakerThreshold.setValue(1)
+        try:
+            self.assertRegexp('getticket 1', '^Ticket 1 ')
+            self.server.truncate = True
+            self.assertRegexp('getticket 2', 'failed to retrieve')
+            # That counts against RT, so now we don't even ask.
+            self.assertRegexp('getticket 3', 'not answering')
+            self.assertEqual(len(self.server.paths), 2)
+        finally:
+            conf.supybot.plugins.RTQuery.breakerThreshold.setValue(5)
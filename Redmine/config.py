@@ -29,8 +29,27 @@ import supybot.conf as conf
 import supybot.registry as registry
 from supybot.i18n import PluginInternationalization, internationalizeDocstring
 
+from local import replyformat
+
 _ = PluginInternationalization('Redmine')
 
+# The fields that replyTemplate may use
+REPLY_FIELDS = ('id', 'flags', 'status', 'project', 'subject', 'url')
+
+class ReplyTemplate(registry.String):
+    """Value must be a reply template that only uses the fields listed in
+    its help."""
+    __slots__ = ()
+    errormsg = ('Value must be a reply template that only uses the fields '
+                'listed in its help, not %r.')
+
+    def setValue(self, v):
+        try:
+            replyformat.check_template(v, REPLY_FIELDS)
+        except ValueError:
+            self.error(v)
+        registry.String.setValue(self, v)
+
 def configure(advanced):
     # This will be called by supybot to configure this module.  advanced is
     # a bool that specifies whether the user identified himself as an advanced
@@ -43,3 +62,48 @@ def configure(advanced):
 Redmine = conf.registerPlugin('Redmine')
 conf.registerChannelValue(Redmine, 'uri',
                           registry.String('', "Redmine's base URI"))
+conf.registerGlobalValue(Redmine, 'replyTemplate',
+        ReplyTemplate('Issue {id}{flags}: {subject} - {url}', "Template for the line shown for each issue.  It may use {id}, {flags} (such as \" (New)\", or nothing), {status}, {project}, {subject} and {url}.  Issues that are already cached keep their old line until they are fetched again"))
+conf.registerGlobalValue(Redmine, 'requestTimeout',
+        registry.PositiveInteger(30, "Number of seconds to wait for Redmine to answer before giving up"))
+conf.registerGlobalValue(Redmine, 'connectTimeout',
+        registry.PositiveFloat(5.0, "Number of seconds to wait for a connection to Redmine before giving up"))
+conf.registerGlobalValue(Redmine, 'readTimeout',
+        registry.PositiveFloat(15.0, "Number of seconds to wait for Redmine to send anything before giving up on a request"))
+conf.registerGlobalValue(Redmine, 'breakerThreshold',
+        registry.NonNegativeInteger(5, "Number of requests to Redmine in a row that must fail before the plugin stops sending more for a while and answers from the cache or with an error instead.  A value of 0 never stops sending requests"))
+conf.registerGlobalValue(Redmine, 'breakerCooldown',
+        registry.PositiveInteger(30, "Number of seconds to wait after Redmine stops answering before trying it again with a single request"))
+conf.registerGlobalValue(Redmine, 'rateLimit',
+        registry.Float(10.0, "Maximum number of requests per second to send to Redmine on average.  Redmine asking the bot to slow down with a Retry-After or X-RateLimit-* header slows it down further, but commands that would have to wait longer than requestTimeout fail right away, saying how long to wait.  A value of 0 means no limit"))
+conf.registerGlobalValue(Redmine, 'rateBurst',
+        registry.PositiveInteger(20, "Maximum number of requests to send to Redmine at once when the bot has not sent any for a while"))
+conf.registerGlobalValue(Redmine, 'maxQueuedPerChannel',
+        registry.NonNegativeInteger(10, "Maximum number of lookups from one channel, or one person in private, that may wait for Redmine at once.  Lookups beyond that are turned away with an error.  Channels take turns regardless.  A value of 0 means no limit"))
+conf.registerGlobalValue(Redmine, 'cacheTTL',
+        registry.NonNegativeInteger(300, "Number of seconds to trust a cached issue before asking Redmine whether it changed.  A value of 0 disables the issue cache."))
+conf.registerGlobalValue(Redmine, 'cacheSize',
+        registry.NonNegativeInteger(500, "Maximum number of issues to remember at once."))
+conf.registerGlobalValue(Redmine, 'cacheHardTTL',
+        registry.NonNegativeInteger(3600, "Number of seconds after an issue was fetched that it may still be shown from the cache once cacheTTL has passed, while Redmine is asked whether it changed in the background.  If this is no more than cacheTTL, the bot waits for Redmine instead."))
+conf.registerChannelValue(Redmine, 'postCorrections',
+        registry.Boolean(True, "Whether to show an issue again if refreshing it after showing it from the cache finds that its status or subject changed."))
+conf.registerGlobalValue(Redmine, 'diskCache',
+        registry.Boolean(False, "Whether to also keep cached issues in a database in the bot's data directory so that they survive restarts.  Takes effect when the plugin is reloaded."))
+conf.registerGlobalValue(Redmine, 'diskCacheSize',
+        registry.NonNegativeInteger(5000, "Maximum number of issues to keep in the database.  Takes effect when the plugin is reloaded."))
+conf.registerChannelValue(Redmine, 'snarfIssues',
+        registry.Boolean(False, "Look up and announce the issues that people mention in the channel as #1234 or with a link to Redmine"))
+conf.registerChannelValue(Redmine, 'snarfDedupWindow',
+        registry.NonNegativeInteger(300, "Number of seconds during which an issue that was already announced in the channel will not be announced again"))
+conf.registerGlobalValue(Redmine, 'metricsFile',
+        registry.String('', "File to write request timing metrics to in Prometheus text format, or nothing to not write them"))
+conf.registerGlobalValue(Redmine, 'metricsInterval',
+        registry.PositiveInteger(60, "Number of seconds between writes of the metrics file.  Takes effect when the plugin is reloaded"))
+conf.registerGlobalValue(Redmine, 'webhookPort',
+        registry.NonNegativeInteger(0, "Port to listen on for notifications that Redmine issues changed, which drop them from the cache right away.  Post them to http://<host>:<port>/ with webhookSecret in an X-Webhook-Secret header, or if the sender can't set headers, to http://<host>:<port>/?secret=<webhookSecret>, which web servers and proxies are more likely to log.  A value of 0 disables the listener.  Takes effect when the plugin is reloaded"))
+conf.registerGlobalValue(Redmine, 'webhookAddress',
+        registry.String('127.0.0.1', "Address to listen on for notifications.  Takes effect when the plugin is reloaded"))
+conf.registerGlobalValue(Redmine, 'webhookSecret',
+        registry.String('', "Secret that notifications must send, either in an X-Webhook-Secret header or in a secret query parameter.  The listener does not start without one",
+        private=True))
@@ -0,0 +1,196 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Circuit breakers that stop us from waiting on trackers that are down
+"""
+
+import httplib
+import socket
+import sys
+import threading
+import time
+import urllib2
+
+import httppool
+
+class CircuitOpenError(httppool.URLError):
+    '''
+    A request that we didn't even try because its tracker has been failing.
+    '''
+
+
+def is_failure(exc):
+    '''
+    Whether an exception means the tracker is unwell, as opposed to it
+    answering a request it didn't like.
+    '''
+    if isinstance(exc, (httppool.HTTPError, urllib2.HTTPError)):
+        return exc.code >= 500
+    return isinstance(exc, (httppool.URLError, urllib2.URLError,
+                            httplib.HTTPException, socket.error))
+
+
+class CircuitBreaker(object):
+    '''
+    Counts failures of requests to one tracker in a row.  After threshold
+    of them the breaker opens and turns requests away right away.  Once it
+    has been open for cooldown seconds it lets a single probe request
+    through:  if that works the breaker closes again, and if it fails the
+    breaker stays open for another cooldown.
+    '''
+    CLOSED    = 'closed'
+    OPEN      = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, cooldown, clock=time.time):
+        self.clock     = clock
+        self.state     = self.CLOSED
+        self.failures  = 0
+        self.opened_at = None
+        self.__probing = False
+        self.__lock    = threading.Lock()
+        self.configure(threshold, cooldown)
+
+    def configure(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown  = cooldown
+
+    def available(self):
+        '''
+        Whether a request would be allowed through right now, without
+        using up the probe if the breaker is ready for one.
+        '''
+        with self.__lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return self.clock() - self.opened_at >= self.cooldown
+            return not self.__probing
+
+    def allow(self):
+        '''
+        Whether to send a request.  When the breaker is ready for a probe
+        this returns True for only one caller until the probe finishes.
+        '''
+        with self.__lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and
+                    self.clock() - self.opened_at >= self.cooldown):
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self.__probing:
+                self.__probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.state     = self.CLOSED
+            self.failures  = 0
+            self.__probing = False
+
+    def record_failure(self):
+        '''
+        Count a failure, returning True if it opened the breaker.
+        '''
+        with self.__lock:
+            self.failures += 1
+            self.__probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                    self.threshold > 0 and self.failures >= self.threshold):
+                opened = self.state == self.CLOSED
+                self.state     = self.OPEN
+                self.opened_at = self.clock()
+                return opened
+            return False
+
+
+class CircuitBreakers(object):
+    '''
+    A CircuitBreaker for each of a set of keys, such as the trackers we
+    talk to.  If given, on_open is called with a key and its breaker each
+    time one opens.  A threshold of 0 never opens the breakers.
+    '''
+    def __init__(self, threshold=5, cooldown=30, clock=time.time,
+                 on_open=None):
+        self.clock      = clock
+        self.on_open    = on_open
+        self.__breakers = {}
+        self.__lock     = threading.Lock()
+        self.configure(threshold, cooldown)
+
+    def configure(self, threshold, cooldown):
+        with self.__lock:
+            self.threshold = threshold
+            self.cooldown  = cooldown
+            for breaker in self.__breakers.values():
+                breaker.configure(threshold, cooldown)
+
+    def get(self, key):
+        with self.__lock:
+            breaker = self.__breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(self.threshold, self.cooldown,
+                                         self.clock)
+                self.__breakers[key] = breaker
+            return breaker
+
+    def available(self, key):
+        return self.get(key).available()
+
+    def call(self, key, func, *args, **kwargs):
+        '''
+        Return func(*args, **kwargs) if key's breaker allows it, or raise
+        CircuitOpenError if not.  Exceptions that is_failure says are the
+        tracker's fault count against the breaker; anything else, including
+        a normal return, counts as the tracker being up.
+        '''
+        breaker = self.get(key)
+        if not breaker.allow():
+            raise CircuitOpenError('{0} is unavailable after {1} failures '
+                                   'in a row'.format(key, breaker.failures))
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            exc_info = sys.exc_info()
+            if not is_failure(exc_info[1]):
+                breaker.record_success()
+            elif breaker.record_failure() and self.on_open is not None:
+                self.on_open(key, breaker)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        breaker.record_success()
+        return result
+
+    def record_failure(self, key):
+        '''
+        Count a failure against key's breaker that call() couldn't see,
+        such as the tracker stalling partway through a response body that
+        is read after call() returned.
+        '''
+        breaker = self.get(key)
+        if breaker.record_failure() and self.on_open is not None:
+            self.on_open(key, breaker)
@@ -0,0 +1,207 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A persistent cache of issue tracker data in an SQLite database
+"""
+
+import json
+import threading
+import time
+
+# Bump this when rows change format; older tables are thrown away.
+SCHEMA_VERSION = 1
+
+class DiskCache(object):
+    '''
+    A bounded store of cache entries in an SQLite database, for use as a
+    TTLCache's store so that cached issues survive restarts.  Each row
+    holds an entry's key, its expiration time, when it was last used, and
+    its value.  Keys are tuples and values are plain dicts, and both are
+    stored as JSON, so str and unicode keys with the same text are the
+    same row.  When there are more than maxsize rows the least recently
+    used ones are deleted.
+
+    The database isn't opened until the first time it's needed, and any
+    number of threads may use it.  If it can't be used, such as because
+    the file is corrupt, errors are logged and the store acts empty.
+    '''
+    def __init__(self, path, maxsize=5000, clock=time.time, log=None):
+        self.path    = path
+        self.maxsize = maxsize
+        self.clock   = clock
+        self.log     = log
+        self.__db     = None
+        self.__broken = False
+        self.__lock   = threading.Lock()
+
+    def get(self, key):
+        '''
+        Return key's (expiry, value) entry, or None.
+        '''
+        with self.__lock:
+            db = self.__connect()
+            if db is None:
+                return None
+            try:
+                row = db.execute('SELECT expires, value FROM entries '
+                                 'WHERE key = ?', (_dump_key(key),)).fetchone()
+                if row is None:
+                    return None
+                db.execute('UPDATE entries SET used = ? WHERE key = ?',
+                           (self.clock(), _dump_key(key)))
+                db.commit()
+                return (row[0], json.loads(row[1]))
+            except Exception as err:
+                self.__fail('read from', err)
+                return None
+
+    def set(self, key, expiry, value):
+        try:
+            value = json.dumps(value)
+        except ValueError:
+            # Such as text that isn't UTF-8; that entry just stays in
+            # memory.
+            return
+        with self.__lock:
+            db = self.__connect()
+            if db is None:
+                return
+            try:
+                db.execute('INSERT OR REPLACE INTO entries '
+                           '(key, expires, used, value) VALUES (?, ?, ?, ?)',
+                           (_dump_key(key), expiry, self.clock(), value))
+                self.__shrink(db)
+                db.commit()
+            except Exception as err:
+                self.__fail('write to', err)
+
+    def invalidate(self, key):
+        self.__execute('DELETE FROM entries WHERE key = ?',
+                       (_dump_key(key),))
+
+    def invalidate_where(self, predicate):
+        '''
+        Delete every entry for which predicate(key) is true.
+        '''
+        with self.__lock:
+            db = self.__connect()
+            if db is None:
+                return
+            try:
+                keys = [key for (key,) in db.execute('SELECT key FROM entries')
+                        if predicate(_load_key(key))]
+                db.executemany('DELETE FROM entries WHERE key = ?',
+                               [(key,) for key in keys])
+                db.commit()
+            except Exception as err:
+                self.__fail('write to', err)
+
+    def clear(self):
+        self.__execute('DELETE FROM entries')
+
+    def configure(self, maxsize):
+        with self.__lock:
+            shrinking = maxsize < self.maxsize
+            self.maxsize = maxsize
+        if shrinking:
+            self.__execute(None)
+
+    def close(self):
+        with self.__lock:
+            if self.__db is not None:
+                self.__db.close()
+                self.__db = None
+
+    def __execute(self, sql, args=()):
+        # Run a statement that changes the database, then enforce maxsize.
+        with self.__lock:
+            db = self.__connect()
+            if db is None:
+                return
+            try:
+                if sql is not None:
+                    db.execute(sql, args)
+                self.__shrink(db)
+                db.commit()
+            except Exception as err:
+                self.__fail('write to', err)
+
+    def __shrink(self, db):
+        # Callers must hold self.__lock.
+        db.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries '
+                   'ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                   (max(self.maxsize, 0),))
+
+    def __connect(self):
+        # Callers must hold self.__lock.
+        if self.__db is None and not self.__broken:
+            # Importing sqlite3 takes a while, so wait until we need it.
+            import sqlite3
+            try:
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                # It's only a cache, so speed matters more than surviving
+                # a power failure.
+                db.execute('PRAGMA synchronous = OFF')
+                (version,) = db.execute('PRAGMA user_version').fetchone()
+                if version != SCHEMA_VERSION:
+                    db.execute('DROP TABLE IF EXISTS entries')
+                    db.execute('PRAGMA user_version = {0:d}'.format(
+                            SCHEMA_VERSION))
+                db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                           'key TEXT PRIMARY KEY, expires REAL NOT NULL, '
+                           'used REAL NOT NULL, value TEXT NOT NULL)')
+                db.execute('CREATE INDEX IF NOT EXISTS entries_used '
+                           'ON entries (used)')
+                db.commit()
+                self.__db = db
+            except Exception as err:
+                self.__fail('open', err)
+        return self.__db
+
+    def __fail(self, action, err):
+        # Callers must hold self.__lock.
+        if self.log is not None:
+            self.log.error('Failed to {0} cache database {1}; not using it '
+                           'any more: {2}'.format(action, self.path, err))
+        self.__broken = True
+        if self.__db is not None:
+            try:
+                self.__db.close()
+            except Exception:
+                pass
+            self.__db = None
+
+
+def _dump_key(key):
+    return json.dumps(key, separators=(',', ':'))
+
+
+def _load_key(text):
+    key = json.loads(text)
+    if isinstance(key, list):
+        return tuple(key)
+    return key
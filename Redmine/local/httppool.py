@@ -0,0 +1,407 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Thread-safe pools of persistent (keep-alive) HTTP connections
+"""
+
+import httplib
+import select
+import socket
+import threading
+import time
+import urlparse
+
+# Requests that do no more harm when sent twice than when sent once, so
+# one that may have reached a server that then hung up can be sent again
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'))
+
+class URLError(Exception):
+    '''
+    A request that failed before we got a response, such as when the
+    server could not be reached.  Like urllib2's, it has a "reason".
+    '''
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
+    def __str__(self):
+        return '<urlopen error {0}>'.format(self.reason)
+
+
+class HTTPError(URLError):
+    '''
+    An HTTP response with an error status.  This mimics the parts of
+    urllib2.HTTPError that plugins actually use.
+    '''
+    def __init__(self, url, code, msg, headers=None, body=''):
+        URLError.__init__(self, msg)
+        self.url     = url
+        self.code    = code
+        self.msg     = msg
+        self.headers = headers
+        self.body    = body
+
+    def read(self):
+        return self.body
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+    def __str__(self):
+        return 'HTTP Error {0}: {1}'.format(self.code, self.msg)
+
+
+class Response(object):
+    '''
+    A fully-read HTTP response.  Reading the whole body up front is what
+    lets us hand the connection back to its pool right away.
+    '''
+    def __init__(self, url, status, reason, msg, body):
+        self.url    = url
+        self.status = status
+        self.reason = reason
+        self.msg    = msg  # an httplib.HTTPMessage
+        self.body   = body
+
+    def read(self):
+        return self.body
+
+    def readlines(self):
+        return self.body.splitlines(True)
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.msg
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.msg.getheader(name, default)
+
+
+class StreamingResponse(object):
+    '''
+    An HTTP response whose body is read on demand.  Its connection goes
+    back to the pool when the response is closed, but only if the body was
+    read all the way through; otherwise the connection is simply closed.
+    '''
+    def __init__(self, pool, conn, url, response):
+        self.url        = url
+        self.status     = response.status
+        self.reason     = response.reason
+        self.msg        = response.msg
+        self.__pool     = pool
+        self.__conn     = conn
+        self.__response = response
+        self.__pushback = []
+
+    def read(self, amt=None):
+        if self.__pushback:
+            data = self.__pushback.pop()
+            if amt is None:
+                data += self.__response.read()
+            return data
+        if self.__conn is None:
+            return ''
+        data = self.__response.read(amt)
+        if not data and amt and self.__response.length:
+            # httplib quietly returns what it got when the server hangs up
+            # early, which we would otherwise take for the whole body.
+            raise httplib.IncompleteRead('', self.__response.length)
+        return data
+
+    def unread(self, data):
+        '''
+        Put data back at the front of the body so the next read returns
+        it again.
+        '''
+        if data:
+            self.__pushback.append(data)
+
+    def readlines(self):
+        return self.read().splitlines(True)
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.msg
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.msg.getheader(name, default)
+
+    def close(self):
+        conn = self.__conn
+        self.__conn = None
+        if conn is None:
+            return
+        if self.__response.isclosed() and not self.__response.will_close:
+            self.__pool._put_conn(conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool(object):
+    '''
+    A bounded set of idle keep-alive connections to a single host.  Any
+    number of threads may use the pool at once; connections beyond
+    maxsize are simply closed instead of being kept around.  If on_connect
+    is given, it gets called with the host and the number of seconds each
+    new connection took to set up, TLS and all.
+
+    Setting up a connection may take up to connect_timeout seconds, and
+    after that each read from it may take up to timeout seconds.  If
+    connect_timeout is None, timeout covers both.
+    '''
+    def __init__(self, scheme, host, port=None, maxsize=4, timeout=None,
+                 on_connect=None, connect_timeout=None):
+        self.scheme  = scheme
+        self.host    = host
+        self.port    = port
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.on_connect = on_connect
+        self.connections_opened = 0
+        self.__idle = []
+        self.__lock = threading.Lock()
+
+    def __new_conn(self):
+        if self.scheme == 'https':
+            conn_class = httplib.HTTPSConnection
+        else:
+            conn_class = httplib.HTTPConnection
+        if self.connect_timeout is not None:
+            conn = conn_class(self.host, self.port,
+                              timeout=self.connect_timeout)
+        elif self.timeout is not None:
+            conn = conn_class(self.host, self.port, timeout=self.timeout)
+        else:
+            conn = conn_class(self.host, self.port)
+        with self.__lock:
+            self.connections_opened += 1
+        return conn
+
+    def __connect(self, conn):
+        start = time.time()
+        conn.connect()
+        if self.on_connect is not None:
+            self.on_connect(self.host, time.time() - start)
+
+    def __prepare(self, conn, reused):
+        if not reused:
+            self.__connect(conn)
+        # The timeouts may have changed since the connection was made.
+        if conn.sock is not None and self.timeout is not None:
+            conn.sock.settimeout(self.timeout)
+
+    def __get_conn(self):
+        while True:
+            with self.__lock:
+                if not self.__idle:
+                    break
+                conn = self.__idle.pop()
+            if not is_dropped(conn):
+                return (conn, True)
+            conn.close()
+        return (self.__new_conn(), False)
+
+    def _put_conn(self, conn):
+        with self.__lock:
+            if len(self.__idle) < self.maxsize:
+                self.__idle.append(conn)
+                return
+        conn.close()
+
+    def urlopen(self, method, path, body=None, headers=None, stream=False,
+                idempotent=None):
+        '''
+        Send a request and return a fully-read Response, or if stream is
+        True, a StreamingResponse that must be closed after use.
+
+        A request that fails because the server closed its connection while
+        it sat idle gets retried once on a fresh connection, as long as it
+        never got sent or is idempotent.  Unless idempotent says otherwise,
+        requests are idempotent if their methods are in IDEMPOTENT_METHODS.
+        '''
+        headers = dict(headers or {})
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        (conn, reused) = self.__get_conn()
+        sent = False
+        try:
+            self.__prepare(conn, reused)
+            conn.request(method, path, body, headers)
+            sent = True
+            response = conn.getresponse()
+        except socket.timeout:
+            # That's the server being slow, not a dropped connection.
+            conn.close()
+            raise
+        except (httplib.BadStatusLine, httplib.CannotSendRequest,
+                socket.error):
+            conn.close()
+            if not reused or (sent and not idempotent):
+                # The server may have acted on it before hanging up.
+                raise
+            # The server dropped the idle connection; try a new one.
+            conn = self.__new_conn()
+            try:
+                self.__prepare(conn, False)
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            except:
+                conn.close()
+                raise
+        except:
+            conn.close()
+            raise
+        if stream:
+            return StreamingResponse(self, conn, path, response)
+        try:
+            data = response.read()
+        except:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._put_conn(conn)
+        return Response(path, response.status, response.reason,
+                        response.msg, data)
+
+    def close(self):
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = []
+        for conn in idle:
+            conn.close()
+
+
+def is_dropped(conn):
+    '''
+    Whether the server has closed an idle connection, or sent something
+    on it that we never asked for.  Either way it's no use to us.
+    '''
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class PoolManager(object):
+    '''
+    Hands out one ConnectionPool per scheme/host/port combination.
+    '''
+    def __init__(self, maxsize=4, timeout=None, on_connect=None,
+                 connect_timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.on_connect = on_connect
+        self.__pools = {}
+        self.__lock  = threading.Lock()
+
+    def configure(self, connect_timeout, timeout):
+        '''
+        Change the connect and read timeouts of this and every pool.
+        '''
+        with self.__lock:
+            self.connect_timeout = connect_timeout
+            self.timeout = timeout
+            for pool in self.__pools.values():
+                pool.connect_timeout = connect_timeout
+                pool.timeout = timeout
+
+    def pool_for(self, url):
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        with self.__lock:
+            if key not in self.__pools:
+                self.__pools[key] = ConnectionPool(
+                        parsed.scheme, parsed.hostname, parsed.port,
+                        maxsize=self.maxsize, timeout=self.timeout,
+                        on_connect=self.on_connect,
+                        connect_timeout=self.connect_timeout)
+            return self.__pools[key]
+
+    def request(self, method, url, body=None, headers=None, stream=False,
+                idempotent=None):
+        '''
+        Send a request to an absolute URL and return the Response (or a
+        StreamingResponse if stream is True).  Error statuses (4xx and 5xx)
+        raise HTTPError instead, and failures to talk to the server at all
+        raise URLError.  See ConnectionPool.urlopen for idempotent.
+        '''
+        parsed = urlparse.urlsplit(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        try:
+            response = self.pool_for(url).urlopen(method, path, body, headers,
+                                                  stream=stream,
+                                                  idempotent=idempotent)
+        except (httplib.HTTPException, socket.error) as err:
+            raise URLError(err)
+        response.url = url
+        if response.status >= 400:
+            error_body = response.read()
+            if stream:
+                response.close()
+            raise HTTPError(url, response.status, response.reason,
+                            response.msg, error_body)
+        return response
+
+    @property
+    def connections_opened(self):
+        with self.__lock:
+            pools = self.__pools.values()
+        return sum(pool.connections_opened for pool in pools)
+
+    def close(self):
+        with self.__lock:
+            pools = self.__pools.values()
+            self.__pools = {}
+        for pool in pools:
+            pool.close()
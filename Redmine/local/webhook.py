@@ -0,0 +1,146 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A small HTTP listener for issue tracker webhooks
+"""
+
+import BaseHTTPServer
+import SocketServer
+import hmac
+import json
+import re
+import threading
+import urlparse
+
+# Bigger bodies than this are refused.
+MAX_BODY_SIZE = 1024 * 1024
+
+# Query strings may carry the secret, so they never make it into the logs.
+_QUERY_STRING = re.compile(r'\?[^\s"\']*')
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        log = self.server.webhook.log
+        if log is not None:
+            log.debug('{0}: {1}'.format(self.server.webhook.name,
+                    _QUERY_STRING.sub('?<redacted>', format % args)))
+
+    def do_POST(self):
+        webhook = self.server.webhook
+        parsed  = urlparse.urlsplit(self.path)
+        secret  = (self.headers.getheader('X-Webhook-Secret') or
+                   urlparse.parse_qs(parsed.query).get('secret', [''])[0])
+        if not hmac.compare_digest(_to_bytes(secret),
+                                   _to_bytes(webhook.secret)):
+            self.__respond(403)
+            return
+        try:
+            length = int(self.headers.getheader('Content-Length') or 0)
+        except ValueError:
+            self.__respond(400)
+            return
+        if length > MAX_BODY_SIZE:
+            self.__respond(413)
+            return
+        body = self.rfile.read(length)
+        if body.lstrip().startswith('{'):
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.__respond(400)
+                return
+        else:
+            # A form, like RT scrips tend to send
+            payload = dict((key, values[-1]) for (key, values)
+                           in urlparse.parse_qs(body).iteritems())
+        try:
+            webhook.handler(parsed.path, payload)
+        except Exception:
+            if webhook.log is not None:
+                webhook.log.exception('Uncaught exception in {0}'.format(
+                        webhook.name))
+            self.__respond(500)
+            return
+        self.__respond(204)
+
+    def __respond(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def _to_bytes(text):
+    '''
+    compare_digest can't compare unicode with str, or unicode that isn't
+    ASCII at all, so everything it sees goes through here first.
+    '''
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return str(text)
+
+
+class WebhookServer(object):
+    '''
+    Listens for webhook POSTs on its own threads and passes the path and
+    decoded body (a JSON object or a form) of each one to handler.
+    Requests must carry the shared secret, preferably in an
+    X-Webhook-Secret header, or in a "secret" query parameter, since not
+    every tracker can send custom headers.
+    '''
+    def __init__(self, address, port, secret, handler, log=None,
+                 name='webhook'):
+        if not secret:
+            raise ValueError('a webhook listener needs a secret')
+        self.address = address
+        self.port    = port
+        self.secret  = secret
+        self.handler = handler
+        self.log     = log
+        self.name    = name
+        self.__httpd = None
+
+    def start(self):
+        self.__httpd = _Server((self.address, self.port), _Handler)
+        self.__httpd.webhook = self
+        # The real port, in case we were asked for any free one
+        self.port = self.__httpd.server_address[1]
+        thread = threading.Thread(target=self.__httpd.serve_forever,
+                                  name=self.name)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self.__httpd is not None:
+            self.__httpd.shutdown()
+            self.__httpd.server_close()
+            self.__httpd = None
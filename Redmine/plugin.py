@@ -26,15 +26,34 @@
 ###
 
 import supybot.utils as utils
+import supybot.conf as conf
 from supybot.commands import *
-import supybot.plugins as plugins
+import supybot.ircdb as ircdb
+import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
+import supybot.schedule as schedule
 from supybot.i18n import PluginInternationalization, internationalizeDocstring
 
+import collections
+import functools
 import json
-import urllib2
-from urlparse import urljoin
+import re
+import socket
+import threading
+import urllib
+from urlparse import urljoin, urlparse
+
+from local import breaker
+from local import cache
+from local import diskcache
+from local import engine
+from local import httppool
+from local import metrics
+from local import ratelimit
+from local import replyformat
+from local import singleflight
+from local.settings import Settings
 
 _ = PluginInternationalization('Redmine')
 
@@ -46,6 +65,257 @@ class Redmine(callbacks.Plugin):
 
     def __init__(self, irc):
         super(self.__class__, self).__init__(irc)
+        self.__settings = Settings(conf.supybot.plugins.get(self.name()))
+        self.__metrics = metrics.Metrics('Redmine')
+        self.__engine = engine.RequestEngine(name='Redmine', log=self.log,
+                                             on_connect=self.__observe_connect)
+        self.__lookups = singleflight.SingleFlight(
+                on_coalesce=self.__observe_coalesce)
+        self.__breakers = breaker.CircuitBreakers(
+                on_open=self.__observe_breaker_open)
+        self.__limiter = ratelimit.RateLimiter()
+        self.__issue_cache = cache.TTLCache(store=self.__open_store())
+        self.__announced = cache.RecentlySeen()
+        self.__counts = collections.Counter(fetched=0, not_modified=0)
+        self.__counts_lock = threading.Lock()
+        schedule.addPeriodicEvent(self.__export_metrics,
+                                  self.registryValue('metricsInterval'),
+                                  name='Redmine.metrics', now=False)
+        self.__webhook = self.__start_webhook()
+        # replyTemplate compiled for each base URI that channels use.  It's
+        # compiled when first needed, and again only after it changes.
+        self.__formatters = {}
+        self.__watches = []
+        self.__watch(('replyTemplate',), self.__forget_formatters)
+
+    def die(self):
+        for (value, callback) in self.__watches:
+            value.removeCallback(callback)
+        self.__settings.close()
+        try:
+            schedule.removePeriodicEvent('Redmine.metrics')
+        except KeyError:
+            pass
+        if self.__webhook is not None:
+            self.__webhook.stop()
+        self.__engine.shutdown()
+        if self.__issue_cache.store is not None:
+            self.__issue_cache.store.close()
+        super(self.__class__, self).die()
+
+    def __watch(self, names, callback):
+        """
+        Call callback whenever any of the named settings changes, until
+        the plugin dies.
+        """
+        for name in names:
+            value = self.registryValue(name, value=False)
+            value.addCallback(callback)
+            self.__watches.append((value, callback))
+
+    def __start_webhook(self):
+        port = self.registryValue('webhookPort')
+        if not port:
+            return None
+        if not self.registryValue('webhookSecret'):
+            self.log.warning('Not listening for Redmine notifications '
+                             'because webhookSecret is not set')
+            return None
+        # Most bots don't listen for notifications, so only load the
+        # HTTP server when this one does.
+        from local import webhook
+        try:
+            return webhook.WebhookServer(self.registryValue('webhookAddress'),
+                    port, self.registryValue('webhookSecret'),
+                    self.__handle_webhook, log=self.log,
+                    name='Redmine webhook').start()
+        except socket.error as e:
+            self.log.error('Failed to listen for Redmine notifications on '
+                           'port {0}: {1}'.format(port, e))
+            return None
+
+    def __handle_webhook(self, path, payload):
+        # This runs on one of the webhook listener's threads.  Each channel
+        # can use its own Redmine, so forget the issue for all of them.
+        issueno = issue_id_from_webhook(payload)
+        if issueno is not None:
+            self.__issue_cache.invalidate_where(lambda key: key[1] == issueno)
+
+    def __open_store(self):
+        """
+        Return a DiskCache for the issue cache if diskCache is on, or None
+        """
+        if not self.registryValue('diskCache'):
+            return None
+        path = conf.supybot.directories.data.dirize('Redmine.cache.sqlite')
+        return diskcache.DiskCache(path, self.registryValue('diskCacheSize'),
+                                   log=self.log)
+
+    def __observe_connect(self, host, seconds):
+        self.__metrics.observe('connect', 'ok', seconds)
+
+    def __observe_coalesce(self, key):
+        self.__metrics.increment('coalesced')
+
+    def __observe_breaker_open(self, base_uri, circuit):
+        self.log.warning(('Not sending requests to {0} for {1} seconds after '
+                          '{2} failures in a row').format(base_uri,
+                                  circuit.cooldown, circuit.failures))
+        self.__metrics.increment('breaker_opened')
+
+    def __export_metrics(self):
+        path = self.registryValue('metricsFile')
+        if not path:
+            return
+        try:
+            self.__metrics.write_prometheus(path)
+        except EnvironmentError as e:
+            self.log.warning('Failed to write metrics to {0}: {1}'.format(
+                    path, e))
+
+    def __fetch(self, base_uri, rest_uri, headers):
+        """
+        GET an issue and return a dict with its JSON and its ETag and
+        Last-Modified headers, or None if Redmine says our copy is still
+        good.  Since lookups for the same issue can share the result, the
+        response is read and decoded here rather than by the caller.
+        """
+        # This runs on one of the request engine's threads.
+        with self.__metrics.timed('GET issue') as timing:
+            response = self.__get(base_uri, rest_uri, headers)
+            timing.outcome = str(response.status)
+            if response.status == 304:
+                self.__count('not_modified')
+                return None
+            self.__count('fetched')
+            response_content = response.read()
+        try:
+            with self.__metrics.timed('decode'):
+                response_json = json.loads(response_content)
+        except ValueError:
+            self.log.error('Response from server is not JSON: ' +
+                           response_content)
+            raise
+        if 'issue' not in response_json:
+            self.log.error("Response lacks an 'issue' key: " +
+                           response_content)
+            raise ValueError("response lacks an 'issue' key")
+        return {'issue':         response_json['issue'],
+                'etag':          response.getheader('ETag'),
+                'last_modified': response.getheader('Last-Modified')}
+
+    def __get(self, base_uri, rest_uri, headers):
+        # We don't log in to Redmine, so everything we send counts against
+        # the same limit.
+        limit_key = (urlparse(base_uri).netloc, None)
+        settings  = self.__settings.get()
+        if self.__limiter.acquire(limit_key, settings.rateLimit,
+                                  settings.rateBurst,
+                                  settings.requestTimeout):
+            self.__metrics.increment('throttled')
+        try:
+            response = self.__breakers.call(base_uri,
+                    self.__engine.pool.request, 'GET', rest_uri,
+                    headers=headers)
+        except httppool.HTTPError as err:
+            self.__limiter.observe(limit_key, err.code, err.info())
+            raise
+        self.__limiter.observe(limit_key, response.getcode(), response.info())
+        return response
+
+    def doPrivmsg(self, irc, msg):
+        channel = msg.args[0]
+        if not ircutils.isChannel(channel):
+            return
+        if callbacks.addressed(irc.nick, msg):
+            # Commands are handled elsewhere.
+            return
+        if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
+            return
+        if ircdb.checkIgnored(msg.prefix, channel):
+            return
+        settings = self.__settings.get(channel)
+        if not settings.snarfIssues:
+            return
+        base_uri = settings.uri
+        if not base_uri:
+            return
+        text = msg.args[1]
+        if ircmsgs.isAction(msg):
+            text = ircmsgs.unAction(msg)
+        issuenos = find_issue_ids(text, base_uri)
+        issuenos = self.__announced.filter_new((irc.network, channel),
+                issuenos, settings.snarfDedupWindow)
+        if issuenos:
+            # Don't make the whole bot wait for Redmine.
+            self.__engine.configure(settings.maxQueuedPerChannel)
+            try:
+                self.__engine.submit_for(channel, self.__announce_issues, irc,
+                                         channel, base_uri, issuenos)
+            except engine.QueueFullError:
+                self.log.debug('Too many lookups waiting for {0}; not '
+                               'announcing {1}'.format(channel,
+                                       ', '.join(map(str, issuenos))))
+
+    def __announce_issues(self, irc, channel, base_uri, issuenos):
+        """
+        Say what each of a list of issues is, using the cache where we can
+        and asking Redmine for all of the rest with one request.
+        """
+        # This runs on one of the request engine's threads.
+        settings = self.__settings.get()
+        self.__issue_cache.configure(settings.cacheSize, settings.cacheTTL)
+        replies = {}
+        for issueno in issuenos:
+            cached = self.__issue_cache.get((base_uri, issueno))
+            if cached is not None:
+                replies[issueno] = cached['reply']
+        missing = [issueno for issueno in issuenos if issueno not in replies]
+        if missing and self.__breakers.available(base_uri):
+            try:
+                issues = self.__fetch_issues(base_uri, missing)
+            except (httppool.URLError, ValueError) as err:
+                self.log.info('Failed to look up snarfed issues {0}: '
+                              '{1}'.format(', '.join(map(str, missing)), err))
+                issues = {}
+            for (issueno, issue) in issues.iteritems():
+                replies[issueno] = self.__remember(base_uri, issueno,
+                        {'issue': issue, 'etag': None, 'last_modified': None},
+                        None)['reply']
+        for issueno in issuenos:
+            if issueno in replies:
+                irc.queueMsg(ircmsgs.privmsg(channel, replies[issueno]))
+        self.__announced.mark((irc.network, channel), replies.keys())
+
+    def __fetch_issues(self, base_uri, issuenos):
+        """
+        GET several issues at once and return a dict that maps each issue
+        number to its JSON.  Issues that don't exist, or that we may not
+        see, are left out.
+        """
+        # status_id=* includes closed issues, which Redmine leaves out
+        # otherwise.
+        query = urllib.urlencode({'issue_id':  ','.join(map(str, issuenos)),
+                                  'status_id': '*',
+                                  'limit':     len(issuenos)})
+        rest_uri = urljoin(base_uri, 'issues.json?' + query)
+        with self.__metrics.timed('GET issues') as timing:
+            response = self.__get(base_uri, rest_uri, {})
+            timing.outcome = str(response.status)
+            response_content = response.read()
+        try:
+            with self.__metrics.timed('decode'):
+                response_json = json.loads(response_content)
+        except ValueError:
+            self.log.error('Response from server is not JSON: ' +
+                           response_content)
+            raise
+        issues = dict((issue['id'], issue)
+                      for issue in response_json.get('issues', [])
+                      if issue.get('id') in issuenos)
+        for issue in issues:
+            self.__count('fetched')
+        return issues
 
     def getissue(self, irc, msg, args, issueno):
         """<id>
@@ -53,44 +323,271 @@ class Redmine(callbacks.Plugin):
         Display information about an issue in Redmind along with a link to
         it on the web.
         """
-        base_uri = self.registryValue('uri')
+        settings = self.__settings.get(msg.args[0])
+        base_uri = settings.uri
         rest_uri = urljoin(base_uri, 'issues/{0}.json'.format(issueno))
+        self.__issue_cache.configure(settings.cacheSize, settings.cacheTTL)
+        self.__engine.pool.configure(settings.connectTimeout,
+                                     settings.readTimeout)
+        self.__breakers.configure(settings.breakerThreshold,
+                                  settings.breakerCooldown)
+        cache_key = (base_uri, issueno)
+        (cached, is_stale) = self.__issue_cache.get_or_stale(cache_key,
+                self.__stale_grace())
+        if cached is not None:
+            # Answer right away, even if it's a bit old, and catch up later.
+            irc.reply(cached['reply'])
+            if is_stale:
+                self.__revalidate(irc, msg, base_uri, issueno, cached)
+            return
+
+        stale = self.__issue_cache.get_stale(cache_key)
+        if not self.__breakers.available(base_uri):
+            # Redmine has been failing, so don't make people wait on it.
+            self.__reply_unavailable(irc, stale)
+            return
+
+        self.__engine.configure(settings.maxQueuedPerChannel)
         try:
-            response = urllib2.urlopen(rest_uri)
-            response_content = response.read()
-            response_json = json.loads(response_content)
-        except urllib2.HTTPError as e:
-            if str(e.code).startswith('4'):
+            future = self.__submit_fetch(base_uri, rest_uri, stale,
+                                         lane=lane_for(msg))
+        except engine.QueueFullError:
+            irc.error('Too many lookups from here are waiting for Redmine; '
+                      'try again in a moment.')
+            return
+        try:
+            fetched = future.result(settings.requestTimeout)
+        except breaker.CircuitOpenError:
+            self.__reply_unavailable(irc, stale)
+            return
+        except ratelimit.RateLimitedError as e:
+            irc.error(e.reason)
+            return
+        except httppool.HTTPError as e:
+            wait = ratelimit.rate_limited_for(e)
+            if wait is not None:
+                # That says nothing about whether the issue exists.
+                irc.error(ratelimit.RateLimitedError(wait).reason)
+            elif str(e.code).startswith('4'):
+                self.__issue_cache.invalidate(cache_key)
                 irc.error('issue {0} does not exist.'.format(issueno))
             else:
                 self.log.error('GET on URI {uri} yielded HTTP {code} {msg}'
                                .format(uri=rest_uri, code=e.code, msg=e.msg))
                 irc.error('failed to retrieve issue data')
             return
-        except ValueError:
-            self.log.error('Response from server is not JSON: ' + response_content)
+        except httppool.URLError as e:
+            self.log.error('GET on URI {uri} failed: {err}'.format(
+                    uri=rest_uri, err=e.reason))
             irc.error('failed to retrieve issue data')
             return
-        if 'issue' in response_json:
-            issue = response_json['issue']
-        else:
-            self.log.error("Response lacks an 'issue' key: " + response_content)
+        except ValueError:
             irc.error('failed to retrieve issue data')
             return
-
-        msg_bits = ['Issue']
-        issue_flags = []
-        msg_bits.append(str(issueno))
-        if issue.get('status'):
-            issue_flags.append(issue['status']['name'])
-        if issue_flags:
-            msg_bits.append('(' + ', '.join(issue_flags) + ')')
-        msg_bits[-1] += ':'
-        msg_bits.append(issue.get('subject', '(no subject)'))
-        msg_bits.append('-')
-        msg_bits.append(urljoin(base_uri, 'issues/{0}'.format(issueno)))
-        irc.reply(' '.join(msg_bits))
+        irc.reply(self.__remember(base_uri, issueno, fetched, stale)['reply'])
 
     getissue = wrap(getissue, ['positiveInt'])
 
+    def __submit_fetch(self, base_uri, rest_uri, stale, lane=None):
+        """
+        Start fetching an issue on the request engine and return a Future
+        for __fetch's result.  Fetches in the same lane (usually a channel)
+        wait their turn behind each other, not behind everyone else's.
+        """
+        # If we have an expired copy, Redmine can tell us it's still good
+        # without sending the whole issue again.
+        headers = {}
+        if stale is not None:
+            if stale['etag']:
+                headers['If-None-Match'] = stale['etag']
+            if stale['last_modified']:
+                headers['If-Modified-Since'] = stale['last_modified']
+        # If someone else is already asking Redmine the same thing, wait for
+        # that answer instead of asking again.
+        return self.__lookups.submit(
+                (rest_uri, tuple(sorted(headers.items()))),
+                functools.partial(self.__engine.submit_for, lane),
+                self.__fetch, base_uri, rest_uri, headers)
+
+    def __remember(self, base_uri, issueno, fetched, stale):
+        """
+        Cache what __fetch returned, or the stale copy again if Redmine said
+        it hasn't changed, and return the cache entry, whose "reply" is the
+        reply to show for it.
+        """
+        cache_key = (base_uri, issueno)
+        if fetched is None:
+            self.__issue_cache.set(cache_key, stale)
+            return stale
+        issue = fetched['issue']
+        entry = {'reply':         self.__format_issue(base_uri, issueno,
+                                                      issue),
+                 'status':        (issue.get('status') or {}).get('name'),
+                 'subject':       issue.get('subject'),
+                 'etag':          fetched['etag'],
+                 'last_modified': fetched['last_modified']}
+        self.__issue_cache.set(cache_key, entry)
+        return entry
+
+    def __stale_grace(self):
+        """
+        How long after an issue's cacheTTL passes that we may still show it
+        while asking Redmine whether it changed
+        """
+        settings = self.__settings.get()
+        return max(settings.cacheHardTTL - settings.cacheTTL, 0)
+
+    def __revalidate(self, irc, msg, base_uri, issueno, stale):
+        """
+        Ask Redmine in the background whether an issue we just showed from
+        the cache changed, and show it again if it did.
+        """
+        def correct(future):
+            # This runs on one of the request engine's threads.
+            err = future.exception()
+            if (isinstance(err, httppool.HTTPError) and
+                    str(err.code).startswith('4') and
+                    ratelimit.rate_limited_for(err) is None):
+                self.__issue_cache.invalidate((base_uri, issueno))
+            if err is not None:
+                self.log.info('Failed to refresh issue {0}: {1}'.format(
+                        issueno, err))
+                return
+            entry = self.__remember(base_uri, issueno, future.result(), stale)
+            # Only changes people care about, not every field in the reply
+            if ((entry.get('status'), entry.get('subject')) !=
+                    (stale.get('status'), stale.get('subject')) and
+                    self.__settings.get(msg.args[0]).postCorrections):
+                irc.reply('Correction: ' + entry['reply'])
+        if not self.__breakers.available(base_uri):
+            return
+        rest_uri = urljoin(base_uri, 'issues/{0}.json'.format(issueno))
+        self.__submit_fetch(base_uri, rest_uri, stale).add_done_callback(
+                correct)
+
+    def __reply_unavailable(self, irc, stale):
+        if stale is not None:
+            irc.reply(stale['reply'] + ' (cached; Redmine is not answering)')
+        else:
+            irc.error('Redmine is not answering right now; try again later.')
+
+    def __format_issue(self, base_uri, issueno, issue):
+        formatter = self.__formatters.get(base_uri)
+        if formatter is None:
+            # Rarely needed, and a snapshot could still have the old values.
+            template = self.registryValue('replyTemplate')
+            if isinstance(template, str):
+                template = template.decode('utf-8')
+            formatter = replyformat.compile_template(template,
+                    issue_reply_fields(base_uri))
+            self.__formatters[base_uri] = formatter
+        return formatter(issueno, issue)
+
+    def __forget_formatters(self):
+        self.__formatters = {}
+
+    def __count(self, name):
+        with self.__counts_lock:
+            self.__counts[name] += 1
+
+    def cachestats(self, irc, msg, args):
+        """takes no arguments
+
+        Show how well the issue cache is working.
+        """
+        stats = self.__issue_cache.stats()
+        with self.__counts_lock:
+            stats.update(self.__counts)
+        irc.reply(('Issue cache: {size} of {maxsize} entries (TTL {ttl}s); '
+                   '{hits} hits, {stale_hits} stale hits, {misses} misses, '
+                   '{evictions} evictions, {expirations} expirations; '
+                   '{fetched} issues fetched, '
+                   '{not_modified} revalidated unchanged').format(**stats))
+
+    cachestats = wrap(cachestats, ['admin'])
+
+    def stats(self, irc, msg, args):
+        """takes no arguments
+
+        Show how long requests to Redmine have been taking, by endpoint and
+        outcome, how many lookups shared another's request, and how often
+        we slowed down to stay under rateLimit.  Times are in seconds.
+        """
+        lines = self.__metrics.summary()
+        if lines:
+            irc.replies(lines, joiner='; ')
+        else:
+            irc.reply('No requests have been made to Redmine yet.')
+
+    stats = wrap(stats, ['owner'])
+
+def issue_id_from_webhook(payload):
+    """
+    Find the issue number in a notification about a Redmine issue, such as
+    {"payload": {"action": "updated", "issue": {"id": 123, ...}}} from the
+    redmine_webhook plugin, or a form with an issue_id field.  Returns None
+    if there isn't one.
+    """
+    if isinstance(payload.get('payload'), dict):
+        payload = payload['payload']
+    issue = payload.get('issue')
+    if isinstance(issue, dict):
+        issueno = issue.get('id')
+    else:
+        issueno = payload.get('issue_id', payload.get('id'))
+    try:
+        return int(issueno)
+    except (TypeError, ValueError):
+        return None
+
+def issue_flags(issue):
+    """
+    The notable things about an issue that replies show in parentheses
+    """
+    if issue.get('status'):
+        return [issue['status']['name']]
+    return []
+
+def issue_reply_fields(base_uri):
+    """
+    The fields that replyTemplate may use, as functions of an issue number
+    and the issue's JSON.  Links to issues are made under base_uri, which
+    is joined here once instead of for every issue.
+    """
+    issues_uri = urljoin(base_uri, 'issues/')
+    return {'id':      lambda issueno, issue: str(issueno),
+            'flags':   lambda issueno, issue: replyformat.format_flags(
+                               issue_flags(issue)),
+            'status':  lambda issueno, issue: (issue.get('status') or
+                                               {}).get('name', ''),
+            'project': lambda issueno, issue: (issue.get('project') or
+                                               {}).get('name', ''),
+            'subject': lambda issueno, issue: issue.get('subject',
+                                                        '(no subject)'),
+            'url':     lambda issueno, issue: issues_uri + str(issueno)}
+
+def find_issue_ids(text, base_uri):
+    """
+    Return the distinct issue numbers mentioned in a chunk of text as #1234
+    or as links to issues under base_uri, in the order they appear.
+    """
+    pattern = r'(?:(?<![\w&#])#|{0}/issues/)([0-9]+)\b'.format(
+            re.escape(base_uri.rstrip('/')))
+    issuenos = []
+    for match in re.finditer(pattern, text):
+        issueno = int(match.group(1))
+        if issueno > 0 and issueno not in issuenos:
+            issuenos.append(issueno)
+    return issuenos
+
+def lane_for(msg):
+    """
+    The request engine lane for a message's lookups:  its channel, or in
+    private, the person who sent it
+    """
+    if ircutils.isChannel(msg.args[0]):
+        return msg.args[0]
+    return msg.nick
+
+
 Class = Redmine
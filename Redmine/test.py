@@ -25,7 +25,425 @@
 
 ###
 
+import BaseHTTPServer
+import json
+import os.path
+import socket
+import SocketServer
+import threading
+import time
+import urlparse
+
 from supybot.test import *
 
+from local import engine
+
+# Modules in local/ that are the same in every plugin in this repository.
+# Each plugin keeps its own copy so that it can be installed on its own,
+# so change them in all of them at once.
+SHARED_MODULES = ('breaker', 'cache', 'diskcache', 'engine', 'httppool',
+                  'metrics', 'ratelimit', 'replyformat', 'settings',
+                  'singleflight', 'webhook')
+
 class RedmineTestCase(PluginTestCase):
     plugins = ('Redmine',)
+
+
+class SharedModulesTestCase(SupyTestCase):
+    def testCopiesMatch(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in SHARED_MODULES:
+            with open(os.path.join(here, 'local', name + '.py')) as f:
+                ours = f.read()
+            for plugin in ('RTQuery', 'SimpleJira'):
+                path = os.path.join(os.path.dirname(here), plugin, 'local',
+                                    name + '.py')
+                if not os.path.exists(path):
+                    # That plugin isn't installed next to this one.
+                    continue
+                with open(path) as f:
+                    self.assertTrue(f.read() == ours,
+                                    '{0} differs from local/{1}.py'.format(
+                                            path, name))
+
+class FairQueueTestCase(SupyTestCase):
+    def testTakingTurns(self):
+        queue = engine.FairQueue(maxsize=2)
+        queue.put('#busy', 'busy 1')
+        queue.put('#busy', 'busy 2')
+        queue.put('#quiet', 'quiet 1')
+        # The None lane, for work that no channel asked for, has no limit.
+        for num in xrange(3):
+            queue.put(None, 'background')
+        self.assertEqual([queue.get() for num in xrange(4)],
+                         ['busy 1', 'quiet 1', 'background', 'busy 2'])
+        queue.close()
+        self.assertEqual([queue.get() for num in xrange(3)],
+                         ['background', 'background', None])
+
+    def testFullLane(self):
+        queue = engine.FairQueue(maxsize=2)
+        queue.put('#busy', 'busy 1')
+        queue.put('#busy', 'busy 2')
+        self.assertRaises(engine.QueueFullError, queue.put, '#busy', 'busy 3')
+        # Only the full channel is turned away.
+        queue.put('#quiet', 'quiet 1')
+        self.assertEqual(queue.get(), 'busy 1')
+        queue.put('#busy', 'busy 3')
+        self.assertEqual([queue.get() for num in xrange(3)],
+                         ['quiet 1', 'busy 2', 'busy 3'])
+
+class _IssueHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves issue 1, answering 304 to requests with a matching ETag and
+    counting 200 and 304 responses in the server.  While the server's
+    "retry_after" is set it answers 429 with it as Retry-After instead,
+    counting those in "limited".
+    '''
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if getattr(server, 'retry_after', None):
+            server.limited += 1
+            self.send_response(429)
+            self.send_header('Retry-After', server.retry_after)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"v{0}"'.format(server.version)
+        if self.headers.getheader('If-None-Match') == etag:
+            server.responses[304] += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        server.responses[200] += 1
+        body = json.dumps({'issue': {'id': 1, 'status': {'name': 'New'},
+                'project': {'name': getattr(server, 'project', 'Widgets')},
+                'subject': server.subject}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RedmineCacheTestCase(PluginTestCase):
+    plugins = ('Redmine',)
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                _IssueHandler)
+        self.server.responses = {200: 0, 304: 0}
+        self.server.version = 1
+        self.server.subject = 'Frobnicator is broken'
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        conf.supybot.plugins.Redmine.uri.setValue(
+                'http://127.0.0.1:{0}/'.format(self.server.server_port))
+        conf.supybot.plugins.Redmine.cacheTTL.setValue(1)
+        conf.supybot.plugins.Redmine.cacheHardTTL.setValue(0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        PluginTestCase.tearDown(self)
+
+    def testRevalidation(self):
+        self.assertRegexp('getissue 1', 'Frobnicator is broken')
+        self.assertRegexp('getissue 1', 'Frobnicator is broken')
+        self.assertEqual(self.server.responses, {200: 1, 304: 0})
+        time.sleep(1.1)
+        self.assertRegexp('getissue 1', 'Frobnicator is broken')
+        self.assertEqual(self.server.responses, {200: 1, 304: 1})
+        self.server.version = 2
+        self.server.subject = 'Frobnicator is fixed'
+        time.sleep(1.1)
+        self.assertRegexp('getissue 1', 'Frobnicator is fixed')
+        self.assertEqual(self.server.responses, {200: 2, 304: 1})
+
+    def testReplyTemplate(self):
+        template = conf.supybot.plugins.Redmine.replyTemplate
+        self.assertRaises(registry.InvalidRegistryValue, template.setValue,
+                          '{id}: {assignee}')
+        self.assertRaises(registry.InvalidRegistryValue, template.setValue,
+                          '{id')
+        self.server.subject = u'Caf\xe9 is closed'
+        try:
+            template.setValue('#{id} \xe2\x80\x94 {subject} '
+                              '[{project}/{status}]')
+            self.assertResponse('getissue 1', '#1 \xe2\x80\x94 '
+                                'Caf\xc3\xa9 is closed [Widgets/New]')
+        finally:
+            template.setValue(template._default)
+
+    def testRetryAfter(self):
+        self.server.retry_after = '3600'
+        self.server.limited = 0
+        # A 429 doesn't mean the issue doesn't exist.
+        self.assertRegexp('getissue 1', 'try again in 3600 s')
+        # Waiting an hour on a worker would be pointless, so the bot should
+        # give up right away and say when to try again.
+        start = time.time()
+        self.assertRegexp('getissue 1', 'try again in 3600 s')
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(self.server.limited, 1)
+
+
+class _HangingIssueHandler(_IssueHandler):
+    '''
+    Like _IssueHandler, but while the server's "hanging" flag is set it
+    accepts requests and doesn't answer them until the test releases them.
+    The server's "hung" event is set once one is waiting.
+    '''
+    def do_GET(self):
+        if self.server.hanging:
+            self.server.hung.set()
+            self.server.released.wait()
+            # Dropping the connection instead would make the client retry
+            # on a new one, which might get an answer.
+            self.send_error(503)
+            return
+        _IssueHandler.do_GET(self)
+
+    # The client may have stopped waiting by then.
+    def handle(self):
+        try:
+            _IssueHandler.handle(self)
+        except socket.error:
+            pass
+
+    def finish(self):
+        try:
+            _IssueHandler.finish(self)
+        except socket.error:
+            pass
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class RedmineBreakerTestCase(PluginTestCase):
+    plugins = ('Redmine',)
+
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0),
+                                           _HangingIssueHandler)
+        self.server.responses = {200: 0, 304: 0}
+        self.server.version = 1
+        self.server.subject = 'Frobnicator is broken'
+        self.server.hanging = False
+        self.server.released = threading.Event()
+        self.server.hung = threading.Event()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        conf.supybot.plugins.Redmine.uri.setValue(
+                'http://127.0.0.1:{0}/'.format(self.server.server_port))
+        conf.supybot.plugins.Redmine.cacheTTL.setValue(1)
+        conf.supybot.plugins.Redmine.cacheHardTTL.setValue(0)
+        conf.supybot.plugins.Redmine.readTimeout.setValue(0.5)
+        conf.supybot.plugins.Redmine.breakerThreshold.setValue(2)
+        conf.supybot.plugins.Redmine.breakerCooldown.setValue(1)
+
+    def tearDown(self):
+        self.server.released.set()
+        self.server.shutdown()
+        self.server.server_close()
+        PluginTestCase.tearDown(self)
+
+    def testHangingServer(self):
+        self.assertRegexp('getissue 1', 'Frobnicator is broken')
+        time.sleep(1.1)
+        self.server.hanging = True
+        self.assertError('getissue 1')
+        self.assertError('getissue 1')
+        # The breaker is open now, so we shouldn't wait on the server.
+        start = time.time()
+        self.assertRegexp('getissue 1', 'Frobnicator is broken.*cached')
+        self.assertRegexp('getissue 2', 'not answering')
+        self.assertTrue(time.time() - start < 0.5)
+        # After the cooldown one request gets through, and since it works
+        # the breaker closes again.
+        self.server.hanging = False
+        time.sleep(1.1)
+        self.assertNotRegexp('getissue 1', 'cached')
+        self.assertNotRegexp('getissue 2', 'cached')
+        self.assertEqual(self.server.responses, {200: 2, 304: 1})
+
+
+class RedmineStaleTestCase(ChannelPluginTestCase):
+    plugins = ('Redmine',)
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0),
+                                           _HangingIssueHandler)
+        self.server.responses = {200: 0, 304: 0}
+        self.server.version = 1
+        self.server.subject = 'Frobnicator is broken'
+        self.server.hanging = False
+        self.server.released = threading.Event()
+        self.server.hung = threading.Event()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        conf.supybot.plugins.Redmine.uri.setValue(
+                'http://127.0.0.1:{0}/'.format(self.server.server_port))
+        conf.supybot.plugins.Redmine.cacheTTL.setValue(1)
+        conf.supybot.plugins.Redmine.cacheHardTTL.setValue(60)
+
+    def tearDown(self):
+        template = conf.supybot.plugins.Redmine.replyTemplate
+        template.setValue(template._default)
+        self.server.released.set()
+        self.server.shutdown()
+        self.server.server_close()
+        ChannelPluginTestCase.tearDown(self)
+
+    def testStaleWhileRevalidate(self):
+        self.assertRegexp('getissue 1', 'Frobnicator is broken')
+        time.sleep(1.1)
+        # A slow server doesn't slow down replies for issues we've seen.
+        self.server.hanging = True
+        start = time.time()
+        self.assertRegexp('getissue 1', 'Frobnicator is broken')
+        self.assertTrue(time.time() - start < 0.5)
+        # Only let go once the refresh is stuck, or it could get through
+        # and see the change below.
+        self.assertTrue(self.server.hung.wait(5))
+        self.server.hanging = False
+        self.server.released.set()
+        self.server.version = 2
+        self.server.subject = 'Frobnicator is fixed'
+        time.sleep(1.1)
+        self.assertRegexp('getissue 1', 'Frobnicator is broken')
+        # The refresh finds that it changed and says so.
+        time.sleep(0.5)
+        correction = self.irc.takeMsg()
+        self.assertNotEqual(correction, None)
+        self.assertRegexpMatches(correction.args[1],
+                                 'Correction: .*Frobnicator is fixed')
+        self.assertRegexp('getissue 1', 'Frobnicator is fixed')
+
+    def testNoCorrectionForOtherFields(self):
+        conf.supybot.plugins.Redmine.replyTemplate.setValue(
+                'Issue {id} [{project}]: {subject}')
+        self.assertRegexp('getissue 1', r'\[Widgets\]')
+        time.sleep(1.1)
+        self.server.version = 2
+        self.server.project = 'Gadgets'
+        self.assertRegexp('getissue 1', r'\[Widgets\]')
+        # Neither the status nor the subject changed, so that's not worth
+        # a correction, but the next reply shows the new project.
+        time.sleep(0.5)
+        self.assertEqual(self.irc.takeMsg(), None)
+        self.assertRegexp('getissue 1', r'\[Gadgets\]')
+
+
+class _IssueListHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Lists whichever of issues 1 through 9 are asked for with issue_id,
+    remembering the query string of each request in the server.  While
+    the server's "fail" count is above zero, it answers that many requests
+    with a 500 instead.
+    '''
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse.urlsplit(self.path)
+        self.server.queries.append(urlparse.parse_qs(parsed.query))
+        if self.server.fail:
+            self.server.fail -= 1
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        issue_ids = urlparse.parse_qs(parsed.query)['issue_id'][0].split(',')
+        body = json.dumps({'issues': [
+                {'id': int(issue_id), 'status': {'name': 'New'},
+                 'subject': 'Issue number {0}'.format(issue_id)}
+                for issue_id in issue_ids if 1 <= int(issue_id) <= 9]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RedmineSnarferTestCase(ChannelPluginTestCase):
+    plugins = ('Redmine',)
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                _IssueListHandler)
+        self.server.queries = []
+        self.server.fail = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.uri = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        conf.supybot.plugins.Redmine.uri.setValue(self.uri)
+        conf.supybot.plugins.Redmine.snarfIssues.get(self.channel).setValue(
+                True)
+
+    def tearDown(self):
+        conf.supybot.plugins.Redmine.snarfIssues.get(self.channel).setValue(
+                False)
+        self.server.shutdown()
+        self.server.server_close()
+        ChannelPluginTestCase.tearDown(self)
+
+    def __snarf(self, text):
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, text,
+                                         prefix=self.prefix))
+        replies = []
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            msg = self.irc.takeMsg()
+            if msg is None:
+                time.sleep(0.05)
+            else:
+                replies.append(msg.args[1])
+        return replies
+
+    def testSnarfing(self):
+        replies = self.__snarf('#3 and {0}issues/2 and #3 again, not #12 or '
+                               'a&#4'.format(self.uri))
+        self.assertEqual(len(replies), 2)
+        self.assertRegexpMatches(replies[0], '^Issue 3 .*Issue number 3')
+        self.assertRegexpMatches(replies[1], '^Issue 2 .*Issue number 2')
+        self.assertEqual(len(self.server.queries), 1)
+        self.assertEqual(self.server.queries[0]['issue_id'], ['3,2,12'])
+        self.assertEqual(self.server.queries[0]['status_id'], ['*'])
+        # Issues that were just announced aren't announced again.
+        self.assertEqual(self.__snarf('what about #2?'), [])
+        self.assertEqual(len(self.server.queries), 1)
+
+    def testSnarfingAfterFailure(self):
+        self.server.fail = 1
+        self.assertEqual(self.__snarf('#5 is broken'), [])
+        # Nobody heard about it, so it's announced the next time.
+        replies = self.__snarf('what about #5?')
+        self.assertEqual(len(replies), 1)
+        self.assertRegexpMatches(replies[0], '^Issue 5 .*Issue number 5')
+        self.assertEqual(len(self.server.queries), 2)
+
+    def testTurningSnarfingOff(self):
+        self.assertEqual(len(self.__snarf('#5')), 1)
+        # This takes effect without reloading the plugin.
+        conf.supybot.plugins.Redmine.snarfIssues.get(self.channel).setValue(
+                False)
+        self.assertEqual(self.__snarf('#6'), [])
+        self.assertEqual(len(self.server.queries), 1)
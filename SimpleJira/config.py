@@ -28,6 +28,30 @@
 import supybot.conf as conf
 import supybot.registry as registry
 
+from local import jirasession
+from local import replyformat
+
+# The fields that replyTemplate may use
+REPLY_FIELDS = ('key', 'flags', 'status', 'resolution', 'priority', 'summary',
+                'url')
+
+class ReplyTemplate(registry.String):
+    """Value must be a reply template that only uses the fields listed in
+    its help."""
+    __slots__ = ()
+    errormsg = ('Value must be a reply template that only uses the fields '
+                'listed in its help, not %r.')
+
+    def setValue(self, v):
+        try:
+            replyformat.check_template(v, REPLY_FIELDS)
+        except ValueError:
+            self.error(v)
+        registry.String.setValue(self, v)
+
+class AuthType(registry.OnlySomeStrings):
+    validStrings = jirasession.AUTH_TYPES
+
 def configure(advanced):
     # This will be called by supybot to configure this module.  advanced is
     # a bool that specifies whether the user identified himself as an advanced
@@ -49,5 +73,71 @@ conf.registerGlobalValue(SimpleJira, 'username',
 conf.registerGlobalValue(SimpleJira, 'password',
         registry.String('', 'Password to use for authentication.  If unspecified, the bot will not attempt to log into JIRA.',
         private=True))
+conf.registerGlobalValue(SimpleJira, 'authType',
+        AuthType('basic', 'How to log into JIRA.  "basic" sends the username and password with every request, "token" sends the personal access token in the token setting instead, and "session" logs in with the username and password once and then uses the session cookie JIRA hands back.'))
+conf.registerGlobalValue(SimpleJira, 'token',
+        registry.String('', 'Personal access token to use for authentication when authType is "token".',
+        private=True))
 conf.registerGlobalValue(SimpleJira, 'securityFieldId',
         registry.NonNegativeInteger(0, "Custom field ID for security issues.  A value of 0 disables this feature."))
+conf.registerGlobalValue(SimpleJira, 'replyTemplate',
+        ReplyTemplate('{key}{flags}: {summary} - {url}', "Template for the line shown for each issue.  It may use {key}, {flags} (such as \" (Open, Blocker)\", or nothing), {status}, {resolution}, {priority}, {summary} and {url}."))
+conf.registerGlobalValue(SimpleJira, 'cacheTTL',
+        registry.NonNegativeInteger(300, "Number of seconds to remember an issue's details.  A value of 0 disables the issue cache."))
+conf.registerGlobalValue(SimpleJira, 'cacheSize',
+        registry.NonNegativeInteger(500, "Maximum number of issues to remember at once."))
+conf.registerGlobalValue(SimpleJira, 'cacheHardTTL',
+        registry.NonNegativeInteger(3600, "Number of seconds after an issue was fetched that it may still be shown from the cache once cacheTTL has passed, while it gets refreshed in the background.  If this is no more than cacheTTL, the bot waits for JIRA instead."))
+conf.registerChannelValue(SimpleJira, 'postCorrections',
+        registry.Boolean(True, "Whether to show an issue again if refreshing it after showing it from the cache finds that its status or summary changed."))
+conf.registerGlobalValue(SimpleJira, 'diskCache',
+        registry.Boolean(False, "Whether to also keep cached issues in a database in the bot's data directory so that they survive restarts.  Takes effect when the plugin is reloaded."))
+conf.registerGlobalValue(SimpleJira, 'diskCacheSize',
+        registry.NonNegativeInteger(5000, "Maximum number of issues to keep in the database.  Takes effect when the plugin is reloaded."))
+conf.registerChannelValue(SimpleJira, 'snarfIssueKeys',
+        registry.Boolean(False, "Look up and announce issue keys that people mention in the channel."))
+conf.registerChannelValue(SimpleJira, 'snarfDedupWindow',
+        registry.NonNegativeInteger(300, "Number of seconds during which an issue key that was already announced in the channel will not be announced again."))
+conf.registerGlobalValue(SimpleJira, 'requestTimeout',
+        registry.PositiveInteger(30, "Number of seconds to wait for JIRA to answer before giving up."))
+conf.registerGlobalValue(SimpleJira, 'connectTimeout',
+        registry.PositiveFloat(5.0, "Number of seconds to wait for a connection to JIRA before giving up."))
+conf.registerGlobalValue(SimpleJira, 'readTimeout',
+        registry.PositiveFloat(15.0, "Number of seconds to wait for JIRA to send anything before giving up on a request."))
+conf.registerGlobalValue(SimpleJira, 'breakerThreshold',
+        registry.NonNegativeInteger(5, "Number of requests to JIRA in a row that must fail before the plugin stops sending more for a while and answers from the cache or with an error instead.  A value of 0 never stops sending requests."))
+conf.registerGlobalValue(SimpleJira, 'breakerCooldown',
+        registry.PositiveInteger(30, "Number of seconds to wait after JIRA stops answering before trying it again with a single request."))
+conf.registerGlobalValue(SimpleJira, 'rateLimit',
+        registry.Float(10.0, "Maximum number of requests per second to send to JIRA on average.  JIRA asking the bot to slow down with a Retry-After or X-RateLimit-* header slows it down further, but commands that would have to wait longer than requestTimeout fail right away, saying how long to wait.  A value of 0 means no limit."))
+conf.registerGlobalValue(SimpleJira, 'rateBurst',
+        registry.PositiveInteger(20, "Maximum number of requests to send to JIRA at once when the bot has not sent any for a while."))
+conf.registerGlobalValue(SimpleJira, 'maxQueuedPerChannel',
+        registry.NonNegativeInteger(10, "Maximum number of lookups from one channel, or one person in private, that may wait for JIRA at once.  Lookups beyond that are turned away with an error.  Channels take turns regardless.  A value of 0 means no limit."))
+conf.registerGlobalValue(SimpleJira, 'searchPageSize',
+        registry.PositiveInteger(5, "Number of issues the search command asks JIRA for at a time.  Each page is shown as soon as it arrives, while the next one is fetched."))
+conf.registerGlobalValue(SimpleJira, 'searchMaxResults',
+        registry.PositiveInteger(15, "Maximum number of issues that one search or searchmore command shows.  The rest are left for searchmore, which fetches them from JIRA only when asked."))
+conf.registerGlobalValue(SimpleJira, 'bulkParallelism',
+        registry.PositiveInteger(4, "Maximum number of issues that bulk commands change at the same time."))
+conf.registerGlobalValue(SimpleJira, 'bulkRateLimit',
+        registry.NonNegativeInteger(5, "Maximum number of issues per second that bulk commands change on each JIRA server.  A value of 0 disables the limit."))
+conf.registerGlobalValue(SimpleJira, 'bulkMaxIssues',
+        registry.PositiveInteger(50, "Maximum number of issues that one bulk command may change."))
+conf.registerGlobalValue(SimpleJira, 'metricsFile',
+        registry.String('', "File to write request timing metrics to in Prometheus text format, or nothing to not write them."))
+conf.registerGlobalValue(SimpleJira, 'metricsInterval',
+        registry.PositiveInteger(60, "Number of seconds between writes of the metrics file.  Takes effect when the plugin is reloaded."))
+conf.registerGlobalValue(SimpleJira, 'prefetchInterval',
+        registry.NonNegativeInteger(0, "Number of seconds between background refreshes of issues that people have been asking about, which keeps them in the cache.  Keep this below cacheTTL.  A value of 0 disables prefetching.  Takes effect when the plugin is reloaded."))
+conf.registerGlobalValue(SimpleJira, 'prefetchWindow',
+        registry.PositiveInteger(1800, "Number of seconds after anyone last asked about an issue that it stops being refreshed in the background."))
+conf.registerGlobalValue(SimpleJira, 'prefetchBudget',
+        registry.PositiveInteger(20, "Maximum number of issues to refresh in the background each time."))
+conf.registerGlobalValue(SimpleJira, 'webhookPort',
+        registry.NonNegativeInteger(0, "Port to listen on for JIRA webhooks, which update cached issues as soon as they change.  Point a webhook for issue updates and deletions at http://<host>:<port>/ with webhookSecret in an X-Webhook-Secret header if it can send one, or else at http://<host>:<port>/?secret=<webhookSecret>, which web servers and proxies are more likely to log.  A value of 0 disables the listener.  Takes effect when the plugin is reloaded."))
+conf.registerGlobalValue(SimpleJira, 'webhookAddress',
+        registry.String('127.0.0.1', "Address to listen on for JIRA webhooks.  Takes effect when the plugin is reloaded."))
+conf.registerGlobalValue(SimpleJira, 'webhookSecret',
+        registry.String('', "Secret that JIRA webhooks must send, either in an X-Webhook-Secret header or in a secret query parameter.  The listener does not start without one.",
+        private=True))
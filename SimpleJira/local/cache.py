@@ -0,0 +1,293 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+In-memory caches for issue tracker data
+"""
+
+import collections
+import threading
+import time
+
+class TTLCache(object):
+    '''
+    A thread-safe mapping that holds at most maxsize entries, each for at
+    most ttl seconds.  When it is full the least recently used entry is
+    evicted to make room.  A ttl or maxsize of 0 disables caching.
+
+    Expired entries stay until they are evicted so get_stale and
+    get_or_stale can still return them.
+
+    If given, store is a larger, slower place to keep entries, such as a
+    diskcache.DiskCache.  Entries are written through to it, and looked
+    for there when they aren't in memory.
+    '''
+    def __init__(self, maxsize=500, ttl=300, clock=time.time, store=None):
+        self.maxsize     = maxsize
+        self.ttl         = ttl
+        self.clock       = clock
+        self.store       = store
+        self.hits        = 0
+        self.misses      = 0
+        self.stale_hits  = 0
+        self.evictions   = 0
+        self.expirations = 0
+        self.__entries   = collections.OrderedDict()  # key -> (expiry, value)
+        self.__lock      = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            return entry is not None and entry[0] > self.clock()
+
+    def get(self, key, default=None):
+        self.__load(key)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= self.clock():
+                # Keep it around for get_stale until it gets evicted.
+                self.expirations += 1
+                self.misses += 1
+                return default
+            # Re-inserting moves it to the most recently used end.
+            del self.__entries[key]
+            self.__entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def get_or_stale(self, key, grace, default=None):
+        '''
+        Like get, but also accept an entry that expired less than grace
+        seconds ago, such as to reply with it while it gets refreshed.
+        Returns a (value, stale) pair, where stale says whether the entry
+        has expired.  A miss returns (default, False).
+        '''
+        self.__load(key)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return (default, False)
+            now = self.clock()
+            if entry[0] + grace <= now:
+                self.expirations += 1
+                self.misses += 1
+                return (default, False)
+            del self.__entries[key]
+            self.__entries[key] = entry
+            if entry[0] <= now:
+                self.stale_hits += 1
+                return (entry[1], True)
+            self.hits += 1
+            return (entry[1], False)
+
+    def get_stale(self, key, default=None):
+        '''
+        Return an entry whether or not it has expired, such as to revalidate
+        it with the server it came from.  This doesn't count as a lookup.
+        '''
+        self.__load(key)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return default
+            return entry[1]
+
+    def set(self, key, value):
+        with self.__lock:
+            self.__entries.pop(key, None)
+            if self.maxsize <= 0 or self.ttl <= 0:
+                entry = None
+            else:
+                entry = (self.clock() + self.ttl, value)
+                self.__entries[key] = entry
+                self.__shrink(self.maxsize)
+        if self.store is not None:
+            if entry is None:
+                self.store.invalidate(key)
+            else:
+                self.store.set(key, *entry)
+
+    def invalidate(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+        if self.store is not None:
+            self.store.invalidate(key)
+
+    def invalidate_where(self, predicate):
+        '''
+        Drop every entry for which predicate(key) is true.
+        '''
+        with self.__lock:
+            for key in [key for key in self.__entries if predicate(key)]:
+                del self.__entries[key]
+        if self.store is not None:
+            self.store.invalidate_where(predicate)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def __load(self, key):
+        # Bring an entry that isn't in memory in from the store, if it's
+        # there.  Callers must not hold self.__lock.
+        if self.store is None:
+            return
+        with self.__lock:
+            if key in self.__entries or self.maxsize <= 0:
+                return
+        entry = self.store.get(key)
+        if entry is not None:
+            with self.__lock:
+                if key not in self.__entries:
+                    self.__entries[key] = entry
+                    self.__shrink(self.maxsize)
+
+    def configure(self, maxsize, ttl):
+        '''
+        Change the cache's limits, evicting entries if it shrank.  Entries
+        that are already cached keep their old expiration times.
+        '''
+        with self.__lock:
+            self.maxsize = maxsize
+            self.ttl     = ttl
+            self.__shrink(max(maxsize, 0))
+
+    def __shrink(self, maxsize):
+        # Callers must hold self.__lock.
+        while len(self.__entries) > maxsize:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self.__lock:
+            return {'size': len(self.__entries), 'maxsize': self.maxsize,
+                    'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'stale_hits': self.stale_hits, 'evictions': self.evictions,
+                    'expirations': self.expirations}
+
+
+class RecentlySeen(object):
+    '''
+    Remembers when keys were last announced in each scope (such as a
+    channel) so that repeats within a time window can be suppressed.
+    '''
+    def __init__(self, clock=time.time):
+        self.clock   = clock
+        self.__seen  = {}  # scope -> {key: time}
+        self.__lock  = threading.Lock()
+
+    def filter_new(self, scope, keys, window):
+        '''
+        Return the keys that were not seen in scope during the last window
+        seconds, in their original order.  Nothing is marked as seen until
+        mark is called, so a lookup that fails doesn't keep the next mention
+        of a key from being announced.
+        '''
+        now = self.clock()
+        with self.__lock:
+            seen = self.__seen.setdefault(scope, {})
+            for (key, when) in seen.items():
+                if when <= now - window:
+                    del seen[key]
+            return [key for key in keys if key not in seen]
+
+    def mark(self, scope, keys):
+        '''
+        Mark keys as seen in scope now, once they have been announced.
+        '''
+        now = self.clock()
+        with self.__lock:
+            seen = self.__seen.setdefault(scope, {})
+            for key in keys:
+                seen[key] = now
+
+
+class HotSet(object):
+    '''
+    Remembers which keys people have asked about recently and how often,
+    so they can be kept fresh in the background.  It holds at most maxsize
+    keys; when it is full the key asked about longest ago is forgotten.
+    '''
+    def __init__(self, maxsize=500, clock=time.time):
+        self.maxsize = maxsize
+        self.clock   = clock
+        # key -> [times asked, last time asked], least recently asked first
+        self.__keys  = collections.OrderedDict()
+        self.__lock  = threading.Lock()
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def configure(self, maxsize):
+        with self.__lock:
+            self.maxsize = maxsize
+            self.__shrink()
+
+    def touch(self, key):
+        with self.__lock:
+            # Re-inserting moves it to the most recently asked end.
+            entry = self.__keys.pop(key, [0, None])
+            entry[0] += 1
+            entry[1] = self.clock()
+            self.__keys[key] = entry
+            self.__shrink()
+
+    def __shrink(self):
+        # Callers must hold self.__lock.
+        while len(self.__keys) > max(self.maxsize, 0):
+            self.__keys.popitem(last=False)
+
+    def hot(self, window, limit=None, priority=None):
+        '''
+        Forget keys nobody has asked about in the last window seconds, then
+        return the rest, most asked-about first.  If given, priority(key)
+        returns something that sorts ahead of the number of times asked,
+        such as whether the issue is a blocker.  At most limit keys are
+        returned.
+        '''
+        now = self.clock()
+        with self.__lock:
+            for (key, (count, last)) in self.__keys.items():
+                if last <= now - window:
+                    del self.__keys[key]
+            entries = self.__keys.items()
+        if priority is None:
+            priority = lambda key: 0
+        entries.sort(key=lambda entry: (priority(entry[0]),) +
+                     tuple(entry[1]), reverse=True)
+        keys = [key for (key, _) in entries]
+        if limit is not None:
+            keys = keys[:limit]
+        return keys
@@ -0,0 +1,290 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A small, fixed set of worker threads for talking to issue trackers
+"""
+
+import collections
+import sys
+import threading
+
+import httppool
+
+class TimeoutError(httppool.URLError):
+    '''
+    We gave up waiting for a request to finish.
+    '''
+    pass
+
+
+class CancelledError(httppool.URLError):
+    '''
+    The work was cancelled before it started.
+    '''
+    pass
+
+
+class QueueFullError(Exception):
+    '''
+    Too much work is already waiting in a queue to add more to it.
+    '''
+    pass
+
+
+class FairQueue(object):
+    '''
+    A queue of work split into lanes, such as one per IRC channel, that
+    hands out work from each lane in turn so that one busy lane can't keep
+    the others waiting.  Each lane except the None lane holds at most
+    maxsize items at once (any number if maxsize is 0).  Once the queue is
+    closed, get returns None as soon as every lane is empty.
+    '''
+    def __init__(self, maxsize=0):
+        self.maxsize  = maxsize
+        self.__lanes  = collections.OrderedDict()  # lane -> deque of items
+        self.__closed = False
+        self.__cond   = threading.Condition(threading.Lock())
+
+    def put(self, lane, item):
+        with self.__cond:
+            queue = self.__lanes.get(lane)
+            if queue is None:
+                queue = collections.deque()
+                self.__lanes[lane] = queue
+            if (lane is not None and self.maxsize > 0 and
+                    len(queue) >= self.maxsize):
+                raise QueueFullError('{0} items are already waiting for '
+                                     '{1}'.format(len(queue), lane))
+            queue.append(item)
+            self.__cond.notify()
+
+    def get(self):
+        with self.__cond:
+            while not self.__lanes:
+                if self.__closed:
+                    return None
+                self.__cond.wait()
+            # Take from the lane at the front, then send it to the back.
+            (lane, queue) = self.__lanes.popitem(last=False)
+            item = queue.popleft()
+            if queue:
+                self.__lanes[lane] = queue
+            return item
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+
+class Future(object):
+    '''
+    The eventual result of some work submitted to a RequestEngine
+    '''
+    def __init__(self):
+        self.__done      = threading.Event()
+        self.__result    = None
+        self.__exc_info  = None
+        self.__callbacks = []
+        self.__running   = False
+        self.__cancelled = False
+        self.__lock      = threading.Lock()
+
+    def done(self):
+        return self.__done.is_set()
+
+    def cancel(self):
+        '''
+        Keep the work from running if it hasn't started yet, making result
+        raise CancelledError.  Returns whether it was cancelled.
+        '''
+        with self.__lock:
+            if self.__running or self.__done.is_set():
+                return False
+            self.__cancelled = True
+        self.set_exc_info((CancelledError, CancelledError('cancelled'), None))
+        return True
+
+    def start(self):
+        '''
+        Mark the work as started, unless it was cancelled.  Returns whether
+        it should run.
+        '''
+        with self.__lock:
+            if self.__cancelled:
+                return False
+            self.__running = True
+            return True
+
+    def result(self, timeout=None):
+        '''
+        Wait up to timeout seconds (forever if it is None) for the work to
+        finish, then return its result or raise its exception.
+        '''
+        if not self.__done.wait(timeout):
+            raise TimeoutError('timed out after {0} seconds'.format(timeout))
+        if self.__exc_info is not None:
+            raise self.__exc_info[0], self.__exc_info[1], self.__exc_info[2]
+        return self.__result
+
+    def exception(self):
+        '''
+        Return the exception the work raised, or None.  Only meaningful
+        once the work is done.
+        '''
+        if self.__exc_info is not None:
+            return self.__exc_info[1]
+        return None
+
+    def add_done_callback(self, callback):
+        '''
+        Arrange for callback(future) to be called when the work finishes,
+        or right away if it already has.
+        '''
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self.__result = result
+        self.__finish()
+
+    def set_exc_info(self, exc_info):
+        self.__exc_info = exc_info
+        self.__finish()
+
+    def __finish(self):
+        with self.__lock:
+            self.__done.set()
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class RequestEngine(object):
+    '''
+    Runs tracker requests on a fixed number of worker threads that share
+    a pool of keep-alive connections with at most max_connections idle
+    connections per host.  However many commands are waiting on it, the
+    engine never uses more than that many threads and sockets.  See
+    httppool.ConnectionPool for on_connect.
+
+    Work waits in a FairQueue, so work submitted for different lanes (see
+    submit_for) takes turns, and at most max_queued pieces of work may
+    wait in each lane.
+    '''
+    def __init__(self, workers=4, max_connections=4, timeout=None,
+                 name='RequestEngine', log=None, on_connect=None,
+                 max_queued=0):
+        self.pool      = httppool.PoolManager(maxsize=max_connections,
+                                              timeout=timeout,
+                                              on_connect=on_connect)
+        self.workers   = workers
+        self.name      = name
+        self.log       = log
+        self.__queue   = FairQueue(max_queued)
+        self.__threads = []
+        self.__lock    = threading.Lock()
+
+    def configure(self, max_queued):
+        self.__queue.maxsize = max_queued
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Run func(*args, **kwargs) on a worker thread and return a Future
+        for its result.
+        '''
+        return self.submit_for(None, func, *args, **kwargs)
+
+    def submit_for(self, lane, func, *args, **kwargs):
+        '''
+        Like submit, but queue the work in a lane, such as the channel that
+        asked for it.  Raises QueueFullError if that lane is full.
+        '''
+        future = Future()
+        self.__start().put(lane, (future, func, args, kwargs))
+        return future
+
+    def shutdown(self):
+        '''
+        Let the workers finish the work that is already queued and then
+        exit.  Work submitted after this gets new workers.
+        '''
+        with self.__lock:
+            queue = self.__queue
+            self.__queue = FairQueue(queue.maxsize)
+            self.__threads = []
+        queue.close()
+        self.pool.close()
+
+    def __start(self):
+        with self.__lock:
+            while len(self.__threads) < self.workers:
+                thread = threading.Thread(target=self.__work,
+                        args=(self.__queue,), name='{0} {1}'
+                        .format(self.name, len(self.__threads) + 1))
+                thread.daemon = True
+                thread.start()
+                self.__threads.append(thread)
+            return self.__queue
+
+    def __work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            (future, func, args, kwargs) = item
+            if not future.start():
+                del item, future, func, args, kwargs
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except:
+                exc_info = sys.exc_info()
+                if not isinstance(exc_info[1], httppool.URLError):
+                    self.__log_exception('Uncaught exception in {0}'.format(
+                            self.name))
+                self.__settle(future.set_exc_info, exc_info)
+            else:
+                self.__settle(future.set_result, result)
+            # Don't keep the last job's data alive while we wait.
+            del item, future, func, args, kwargs
+
+    def __settle(self, setter, value):
+        # This also runs the future's callbacks.
+        try:
+            setter(value)
+        except:
+            self.__log_exception('Uncaught exception in {0} callback'.format(
+                    self.name))
+
+    def __log_exception(self, msg):
+        if self.log is not None:
+            self.log.exception(msg)
@@ -0,0 +1,137 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""
+Long-lived, thread-safe sessions with JIRA's REST interface
+"""
+
+import base64
+import json
+import threading
+from urlparse import urljoin
+
+import httppool
+
+AUTH_TYPES = ('basic', 'token', 'session')
+
+class JiraSession(object):
+    '''
+    One set of JIRA credentials shared by every thread that talks to a
+    given JIRA server, over a PoolManager's keep-alive connections.
+
+    With "basic" auth the Authorization header is worked out once and sent
+    with every request, or left out if there is no username or password.
+    With "token" auth a personal access token is sent as a bearer token
+    instead.  With "session" auth we log in lazily with the username and
+    password and then send JIRA's session cookie until JIRA says that it
+    has expired.
+
+    Sessions never change their credentials; make a new one when they do.
+    If metrics (a metrics.Metrics) is given, logins are timed there.
+    '''
+    def __init__(self, pool_manager, base_uri, auth_type, username, password,
+                 token='', metrics=None):
+        self.pool      = pool_manager
+        self.metrics   = metrics
+        self.base_uri  = base_uri
+        self.auth_type = auth_type.lower()
+        self.username  = username
+        self.password  = password
+        self.token     = token
+        self.requests  = 0
+        self.logins    = 0
+        self.__cookie     = None
+        self.__generation = 0
+        self.__lock       = threading.Lock()
+        if self.auth_type not in AUTH_TYPES:
+            raise ValueError('unknown authType "{0}"'.format(auth_type))
+        if self.auth_type == 'basic' and username and password:
+            auth = base64.b64encode(username + ':' + password)
+            self.__headers = {'Authorization': 'Basic ' + auth}
+        elif self.auth_type == 'token' and token:
+            self.__headers = {'Authorization': 'Bearer ' + token}
+        else:
+            self.__headers = {}
+
+    def request(self, method, relative_uri, data=None, idempotent=None):
+        '''
+        Send a request to a location relative to JIRA's base URI and return
+        the httppool.Response.  data, if given, is sent as JSON.  Error
+        statuses raise httppool.HTTPError and failures to reach JIRA raise
+        httppool.URLError, as with PoolManager.request.  See
+        httppool.ConnectionPool.urlopen for idempotent.
+        '''
+        uri = urljoin(self.base_uri, relative_uri)
+        if self.auth_type != 'session':
+            return self.__send(method, uri, data, self.__headers, idempotent)
+
+        with self.__lock:
+            if self.__cookie is None:
+                self.__login()
+            (generation, cookie) = (self.__generation, self.__cookie)
+        try:
+            return self.__send(method, uri, data, cookie, idempotent)
+        except httppool.HTTPError as err:
+            if err.code != 401:
+                raise
+        # Our session expired.  Only one thread needs to log in again; the
+        # rest can simply retry with the new cookie.
+        with self.__lock:
+            if self.__generation == generation:
+                self.__login()
+            cookie = self.__cookie
+        return self.__send(method, uri, data, cookie, idempotent)
+
+    def __login(self):
+        # Callers must hold self.__lock.  The old cookie stays in place
+        # unless this works, since other threads may still be using it.
+        uri  = urljoin(self.base_uri, 'rest/auth/1/session')
+        data = {'username': self.username, 'password': self.password}
+        if self.metrics is None:
+            response = self.__send('POST', uri, data, {}, idempotent=True)
+        else:
+            with self.metrics.timed('login'):
+                response = self.__send('POST', uri, data, {},
+                                       idempotent=True)
+        self.logins += 1
+        try:
+            session = json.loads(response.read())['session']
+            cookie = '{0}={1}'.format(session['name'], session['value'])
+        except (KeyError, TypeError, ValueError):
+            raise httppool.URLError('JIRA sent no session cookie')
+        self.__cookie = {'Cookie': cookie}
+        self.__generation += 1
+
+    def __send(self, method, uri, data, headers, idempotent=None):
+        if data is not None:
+            headers = dict(headers)
+            headers['Content-Type'] = 'application/json'
+            data = json.dumps(data)
+        response = self.pool.request(method, uri, data, headers,
+                                     idempotent=idempotent)
+        self.requests += 1
+        return response
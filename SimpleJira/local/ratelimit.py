@@ -0,0 +1,245 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Rate limiting for requests to issue trackers
+"""
+
+import math
+import threading
+import time
+
+import httppool
+
+class RateLimitedError(httppool.URLError):
+    '''
+    A request that we didn't send because it would have had to wait longer
+    than we were willing to.  retry_after is the number of seconds until
+    it could go.
+    '''
+    def __init__(self, retry_after):
+        httppool.URLError.__init__(self, 'rate limited; try again in {0} '
+                                   's'.format(int(math.ceil(retry_after))))
+        self.retry_after = retry_after
+
+
+class TokenBucket(object):
+    '''
+    Allows rate events per second on average, with bursts of up to burst
+    events.  A rate of 0 means no limit.  No events at all are allowed
+    before resume_at, such as when a server asked us to back off.
+    '''
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.clock  = clock
+        self.sleep  = sleep
+        self.resume_at = 0
+        self.__lock = threading.Lock()
+        self.configure(rate, burst)
+        self.__tokens  = self.burst
+        self.__updated = self.clock()
+
+    def configure(self, rate, burst=None):
+        self.rate  = rate
+        self.burst = max(burst or rate, 1)
+
+    def acquire(self, max_wait=None):
+        '''
+        Wait until an event is allowed, then use it up.  Returns the number
+        of seconds spent waiting.  If that would take longer than max_wait
+        seconds, such as when a server asked us to stay away for an hour,
+        raise RateLimitedError right away instead.
+        '''
+        waited = 0
+        while True:
+            with self.__lock:
+                now = self.clock()
+                if now < self.resume_at:
+                    delay = self.resume_at - now
+                elif self.rate <= 0:
+                    return waited
+                else:
+                    self.__tokens = min(self.burst, self.__tokens +
+                                        (now - self.__updated) * self.rate)
+                    self.__updated = now
+                    if self.__tokens >= 1:
+                        self.__tokens -= 1
+                        return waited
+                    delay = (1 - self.__tokens) / float(self.rate)
+            if max_wait is not None and waited + delay > max_wait:
+                raise RateLimitedError(delay)
+            self.sleep(delay)
+            waited += delay
+
+    def pause_until(self, when):
+        with self.__lock:
+            self.resume_at = max(self.resume_at, when)
+
+
+class RateLimiter(object):
+    '''
+    A token bucket for each of a set of keys, such as the hosts we talk to.
+    Servers can slow a key down further with the headers that observe
+    understands.
+    '''
+    def __init__(self, clock=time.time, sleep=time.sleep):
+        self.clock     = clock
+        self.sleep     = sleep
+        self.__buckets = {}
+        self.__advertised = {}  # key -> (rate, burst) the server asked for
+        self.__lock    = threading.Lock()
+
+    def acquire(self, key, rate, burst=None, max_wait=None):
+        '''
+        Wait until key's bucket, at the lower of rate and any rate the
+        server asked for, allows an event.  Returns the number of seconds
+        spent waiting, or raises RateLimitedError if that would be more than
+        max_wait.
+        '''
+        with self.__lock:
+            if key in self.__advertised:
+                (rate, burst) = _slower((rate, burst),
+                                        self.__advertised[key])
+            bucket = self.__bucket(key, rate, burst)
+        return bucket.acquire(max_wait)
+
+    def observe(self, key, status, headers):
+        '''
+        Slow key down as a response's status and headers (an
+        httplib.HTTPMessage, or None) ask:  Retry-After on a 429 or 503
+        response, and the X-RateLimit-* headers that JIRA and others send.
+        '''
+        if headers is None:
+            return
+        (resume_at, advertised) = parse_rate_limit(status, headers,
+                                                   self.clock())
+        if resume_at is None and advertised is None:
+            return
+        with self.__lock:
+            if advertised is not None:
+                self.__advertised[key] = advertised
+            bucket = self.__bucket(key)
+        if resume_at is not None:
+            bucket.pause_until(resume_at)
+
+    def __bucket(self, key, rate=None, burst=None):
+        # Callers must hold self.__lock.
+        bucket = self.__buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate or 0, burst, self.clock, self.sleep)
+            self.__buckets[key] = bucket
+        elif rate is not None:
+            bucket.configure(rate, burst)
+        return bucket
+
+
+def _slower(limit, other):
+    # The stricter of two (rate, burst) limits, where a rate of 0 means
+    # no limit at all
+    if limit[0] <= 0:
+        return other
+    if other[0] <= 0:
+        return limit
+    return (min(limit[0], other[0]),
+            min(limit[1] or limit[0], other[1] or other[0]))
+
+
+def parse_rate_limit(status, headers, now):
+    '''
+    Work out what a response's headers say about how fast we may send
+    requests.  Returns a pair of the time before which we shouldn't send
+    any more (or None) and the (rate, burst) the server wants us to keep
+    to (or None).
+    '''
+    resume_at = None
+    retry_after = headers.get('Retry-After')
+    if status in (429, 503) and retry_after:
+        resume_at = _parse_time(retry_after.strip(), now)
+    if headers.get('X-RateLimit-Remaining', '').strip() == '0':
+        reset = headers.get('X-RateLimit-Reset')
+        interval = _parse_number(headers.get('X-RateLimit-Interval-Seconds'))
+        if reset:
+            reset_at = _parse_time(reset.strip(), now)
+        else:
+            reset_at = now + (interval or 1)
+        if reset_at is not None and (resume_at is None or
+                                     reset_at > resume_at):
+            resume_at = reset_at
+    advertised = None
+    fill_rate = _parse_number(headers.get('X-RateLimit-FillRate'))
+    interval  = _parse_number(headers.get('X-RateLimit-Interval-Seconds'))
+    if fill_rate and interval:
+        limit = _parse_number(headers.get('X-RateLimit-Limit'))
+        advertised = (fill_rate / interval, int(limit or 0) or None)
+    return (resume_at, advertised)
+
+
+def rate_limited_for(err, now=None):
+    '''
+    The number of seconds an httppool.HTTPError asks us to wait before
+    trying again, or None if it isn't about us sending too much:  a 429,
+    or a 503 with Retry-After.
+    '''
+    if err.code not in (429, 503):
+        return None
+    if now is None:
+        now = time.time()
+    (resume_at, advertised) = parse_rate_limit(err.code, err.info(), now)
+    if resume_at is not None:
+        return max(resume_at - now, 0)
+    if err.code == 429:
+        return 0
+    return None
+
+
+def _parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_time(value, now):
+    # A number of seconds from now, a Unix time, an HTTP date, or an ISO
+    # 8601 time in UTC such as JIRA Cloud's "2021-09-23T10:03Z"
+    number = _parse_number(value)
+    if number is not None:
+        if number > 1000000000:
+            return number
+        return now + max(number, 0)
+    # Dates are rare enough that they aren't worth loading the email
+    # package for every time the bot starts.
+    import calendar
+    import email.utils
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is not None:
+        return email.utils.mktime_tz(parsed)
+    for fmt in ('%Y-%m-%dT%H:%MZ', '%Y-%m-%dT%H:%M:%SZ',
+                '%Y-%m-%dT%H:%M:%S.%fZ'):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    return None
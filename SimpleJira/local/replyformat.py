@@ -0,0 +1,78 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Reply templates, compiled once into functions that fill them in
+"""
+
+import string
+
+def check_template(template, names):
+    '''
+    Make sure a reply template such as "{key}{flags}: {summary} - {url}" is
+    well-formed and only uses fields from names, raising ValueError if
+    not.  Returns the names of the fields it uses.
+    '''
+    used = []
+    for (literal, name, spec, conversion) in string.Formatter().parse(
+            template):
+        if name is None:
+            continue
+        if name not in names:
+            raise ValueError('unknown field {{{0}}}'.format(name))
+        if name not in used:
+            used.append(name)
+    # Catch bad conversions and format specs now rather than at reply time.
+    try:
+        template.format(**dict.fromkeys(used, ''))
+    except (IndexError, KeyError) as err:
+        raise ValueError('unknown field {0}'.format(err))
+    return used
+
+def compile_template(template, fields):
+    '''
+    Compile a reply template into a function that fills it in.  fields
+    maps each name the template may use to a function that works out that
+    field's value from whatever the compiled function is called with; only
+    the fields the template actually uses are worked out.  The template
+    should be unicode if any of the values might be.  Raises ValueError
+    like check_template.
+    '''
+    getters = tuple((name, fields[name])
+                    for name in check_template(template, fields))
+    fill = template.format
+    def format_reply(*args):
+        return fill(**dict([(name, get(*args)) for (name, get) in getters]))
+    return format_reply
+
+def format_flags(flags):
+    '''
+    Turn a list of flags into what a template's {flags} shows:  " (a, b)",
+    or nothing if there aren't any.
+    '''
+    if flags:
+        return ' (' + ', '.join(flags) + ')'
+    return ''
@@ -26,16 +26,50 @@
 ###
 
 import supybot.utils as utils
+import supybot.conf as conf
 from supybot.commands import *
-import supybot.plugins as plugins
+import supybot.ircdb as ircdb
+import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
+import supybot.schedule as schedule
 
-import base64
+import collections
+import functools
 import json
+import operator
 import re
-import urllib2
-from urlparse import urljoin
+import socket
+import threading
+import urllib
+from urlparse import urljoin, urlparse
+
+from local import breaker
+from local import cache
+from local import diskcache
+from local import engine
+from local import httppool
+from local import jirasession
+from local import metrics
+from local import ratelimit
+from local import replyformat
+from local import singleflight
+from local.settings import Settings
+
+def getIssueKeys(irc, msg, args, state):
+    '''
+    Converter for a comma-separated list of issue keys
+    '''
+    issuekeys = []
+    for issuekey in args[0].split(','):
+        if not check_issuekey(issuekey):
+            state.errorInvalid('issue key', issuekey)
+        issuekeys.append(issuekey.upper())
+    state.args.append(issuekeys)
+    del args[0]
+
+addConverter('jiraIssueKeys', getIssueKeys)
+
 
 class SimpleJira(callbacks.Plugin):
     """Add the help for "@plugin help SimpleJira" here
@@ -43,33 +77,228 @@ class SimpleJira(callbacks.Plugin):
     threaded = True
 
     def __init__(self, irc):
-        super(SimpleJira, self).__init__(irc)
+        self.__parent = super(SimpleJira, self)
+        self.__parent.__init__(irc)
+        self.__settings    = Settings(conf.supybot.plugins.get(self.name()))
+        self.__issue_cache = cache.TTLCache(store=self.__open_store())
+        self.__announced   = cache.RecentlySeen()
+        self.__hot_issues  = cache.HotSet()
+        self.__prefetch_lock = threading.Lock()
+        # (uri, kind) for __write_with_comment
+        self.__uncombinable = cache.TTLCache(maxsize=UNCOMBINABLE_KEPT,
+                                             ttl=UNCOMBINABLE_FOR)
+        # Where each person's last search stopped, for searchmore
+        self.__searches    = cache.TTLCache(maxsize=SEARCHES_KEPT,
+                                            ttl=SEARCH_KEPT_FOR)
+        self.__bulk_limiter = ratelimit.RateLimiter()
+        self.__limiter     = ratelimit.RateLimiter()
+        self.__metrics     = metrics.Metrics('SimpleJira')
+        self.__engine      = engine.RequestEngine(name='SimpleJira',
+                log=self.log, on_connect=self.__observe_connect)
+        self.__lookups     = singleflight.SingleFlight(
+                on_coalesce=self.__observe_coalesce)
+        self.__breakers    = breaker.CircuitBreakers(
+                on_open=self.__observe_breaker_open)
+        schedule.addPeriodicEvent(self.__export_metrics,
+                                  self.registryValue('metricsInterval'),
+                                  name='SimpleJira.metrics', now=False)
+        if self.registryValue('prefetchInterval') > 0:
+            schedule.addPeriodicEvent(self.__prefetch,
+                                      self.registryValue('prefetchInterval'),
+                                      name='SimpleJira.prefetch', now=False)
+        self.__webhook = self.__start_webhook()
+        # replyTemplate is compiled when it's first needed, and again only
+        # after it or the URI changes.
+        self.__formatter   = None
+        self.__watches     = []
+        self.__watch(('replyTemplate', 'uri'), self.__forget_formatter)
+        # Likewise the session, after the server or credentials change.
+        self.__session     = None
+        self.__session_lock = threading.Lock()
+        self.__watch(('uri', 'authType', 'username', 'password', 'token'),
+                     self.__forget_session)
+
+    def die(self):
+        for (value, callback) in self.__watches:
+            value.removeCallback(callback)
+        self.__settings.close()
+        for name in ('SimpleJira.metrics', 'SimpleJira.prefetch'):
+            try:
+                schedule.removePeriodicEvent(name)
+            except KeyError:
+                pass
+        if self.__webhook is not None:
+            self.__webhook.stop()
+        self.__engine.shutdown()
+        if self.__issue_cache.store is not None:
+            self.__issue_cache.store.close()
+        self.__parent.die()
 
-    def __send_request(self, relative_uri, data=None, method=None):
+    def __watch(self, names, callback):
         '''
-        Build a request for a location relative to JIRA's base URI, then send
-        it and return the response.
+        Call callback whenever any of the named settings changes, until
+        the plugin dies.
+        '''
+        for name in names:
+            value = self.registryValue(name, value=False)
+            value.addCallback(callback)
+            self.__watches.append((value, callback))
 
-        For now we assume data, if supplied, is always JSON.
+    def __start_webhook(self):
+        port = self.registryValue('webhookPort')
+        if not port:
+            return None
+        if not self.registryValue('webhookSecret'):
+            self.log.warning('Not listening for JIRA webhooks because '
+                             'webhookSecret is not set')
+            return None
+        # Most bots don't listen for notifications, so only load the
+        # HTTP server when this one does.
+        from local import webhook
+        try:
+            return webhook.WebhookServer(self.registryValue('webhookAddress'),
+                    port, self.registryValue('webhookSecret'),
+                    self.__handle_webhook, log=self.log,
+                    name='SimpleJira webhook').start()
+        except socket.error as err:
+            self.log.error('Failed to listen for JIRA webhooks on port '
+                           '{0}: {1}'.format(port, err))
+            return None
 
-        Don't forget to handle HTTPErrors.
+    def __handle_webhook(self, path, payload):
+        '''
+        Bring a cached issue up to date with what a JIRA webhook says about
+        it.  Issues that aren't cached are left alone so that webhooks don't
+        fill the cache with issues nobody asked about.
+        '''
+        # This runs on one of the webhook listener's threads.
+        issue = payload.get('issue')
+        if not isinstance(issue, dict) or 'key' not in issue:
+            return
+        settings  = self.__settings.get()
+        cache_key = (settings.uri, issue['key'])
+        if self.__issue_cache.get_stale(cache_key) is None:
+            return
+        if payload.get('webhookEvent') == 'jira:issue_deleted':
+            self.__issue_cache.invalidate(cache_key)
+            return
+        try:
+            self.__issue_cache.set(cache_key, parse_issue(issue,
+                    settings.securityFieldId))
+        except (KeyError, TypeError):
+            # It's missing fields we need; look it up next time instead.
+            self.__issue_cache.invalidate(cache_key)
+
+    def __open_store(self):
+        '''
+        Return a DiskCache for the issue cache if diskCache is on, or None
+        '''
+        if not self.registryValue('diskCache'):
+            return None
+        path = conf.supybot.directories.data.dirize('SimpleJira.cache.sqlite')
+        return diskcache.DiskCache(path, self.registryValue('diskCacheSize'),
+                                   log=self.log)
+
+    def __observe_connect(self, host, seconds):
+        self.__metrics.observe('connect', 'ok', seconds)
+
+    def __observe_coalesce(self, key):
+        self.__metrics.increment('coalesced')
+
+    def __observe_breaker_open(self, base_uri, circuit):
+        self.log.warning(('Not sending requests to {0} for {1} seconds after '
+                          '{2} failures in a row').format(base_uri,
+                                  circuit.cooldown, circuit.failures))
+        self.__metrics.increment('breaker_opened')
+
+    def __export_metrics(self):
+        path = self.registryValue('metricsFile')
+        if not path:
+            return
+        try:
+            self.__metrics.write_prometheus(path)
+        except EnvironmentError as err:
+            self.log.warning('Failed to write metrics to {0}: {1}'.format(
+                    path, err))
+
+    def __get_session(self):
+        '''
+        Return the JiraSession for the currently-configured server and
+        credentials.  A new one is made only after they change.
+        '''
+        session = self.__session
+        if session is None:
+            with self.__session_lock:
+                session = self.__session
+                if session is None:
+                    # Rarely needed, and a snapshot could still have the
+                    # old values.
+                    session = jirasession.JiraSession(self.__engine.pool,
+                            self.registryValue('uri'),
+                            self.registryValue('authType'),
+                            self.registryValue('username'),
+                            self.registryValue('password'),
+                            self.registryValue('token'),
+                            metrics=self.__metrics)
+                    self.__session = session
+        return session
+
+    def __forget_session(self):
+        with self.__session_lock:
+            self.__session = None
+
+    def __call_jira(self, func, *args, **kwargs):
+        '''
+        Call func(*args, **kwargs) to send a request to JIRA, unless JIRA
+        has been failing so much that its circuit breaker is open, in which
+        case raise breaker.CircuitOpenError instead.  This waits as long as
+        rateLimit, and anything JIRA said about how fast to go, requires.
         '''
+        settings = self.__settings.get()
+        self.__engine.pool.configure(settings.connectTimeout,
+                                     settings.readTimeout)
+        self.__breakers.configure(settings.breakerThreshold,
+                                  settings.breakerCooldown)
+        uri = settings.uri
+        # JIRA limits requests per account, so that's what we limit too.
+        limit_key = (urlparse(uri).netloc, settings.username)
+        if self.__limiter.acquire(limit_key, settings.rateLimit,
+                                  settings.rateBurst,
+                                  settings.requestTimeout):
+            self.__metrics.increment('throttled')
+        try:
+            response = self.__breakers.call(uri, func, *args, **kwargs)
+        except httppool.HTTPError as err:
+            self.__limiter.observe(limit_key, err.code, err.info())
+            raise
+        self.__limiter.observe(limit_key, response.getcode(), response.info())
+        return response
 
-        headers = {'Content-Type': 'application/json'}
-        if self.registryValue('username') and self.registryValue('password'):
-            auth = base64.encodestring(self.registryValue('username') + ':' +
-                                       self.registryValue('password'))
-            auth = auth.strip('\n')
-            headers['Authorization'] = 'Basic ' + auth
-        uri     = urljoin(self.registryValue('uri'), relative_uri)
-        request = urllib2.Request(uri, data=data, headers=headers)
+    def __send_request(self, method, relative_uri, data=None,
+                       idempotent=None):
+        '''
+        Send a request to a location relative to JIRA's base URI over the
+        request engine's connection pool and return the response.  data, if
+        given, is sent as JSON.  See httppool.ConnectionPool.urlopen for
+        idempotent.
 
-        if method is not None:
-            # HACK
-            request.get_method = lambda: method
-        return urllib2.urlopen(request)
+        Don't forget to handle HTTPErrors and URLErrors.
+        '''
+        with self.__metrics.timed(endpoint_for(method,
+                                               relative_uri)) as timing:
+            response = self.__call_jira(self.__get_session().request, method,
+                                        relative_uri, data, idempotent)
+            timing.outcome = str(response.status)
+        return response
 
     def __handle_http_error(self, irc, err, errmsg):
+        irc.error(self.__describe_http_error(err, errmsg))
+
+    def __describe_http_error(self, err, errmsg):
+        '''
+        Return the error text JIRA sent along with an HTTPError, or errmsg
+        if it didn't send any.
+        '''
         err_content = err.read()
         try:
             err_dict = json.loads(err_content)
@@ -78,8 +307,7 @@ class SimpleJira(callbacks.Plugin):
             self.log.error(('JSON parsing failed for HTTP {0} response to '
                             'URI {1}, which was {2}').format(err.code,
                                     repr(err.geturl()), repr(err_content)))
-            irc.error(errmsg)
-            return
+            return errmsg
         err_bits = []
         for err_msg in err_dict.get('errorMessages', []):
             if err_msg.lower() != 'login required':
@@ -88,9 +316,231 @@ class SimpleJira(callbacks.Plugin):
         for err_key, err_val in err_dict.get('errors', {}).iteritems():
             err_bits.append('{0}: {1}'.format(err_key, err_val))
         if len(err_bits) > 0:
-            irc.error('  '.join(err_bits))
+            return '  '.join(err_bits)
         else:
-            irc.error(errmsg)
+            return errmsg
+
+    def __get_json(self, relative_uri):
+        '''
+        GET a location relative to JIRA's base URI over the request engine's
+        connection pool and return the decoded JSON response.  This does
+        not wait on the engine, so it is safe to call from the engine's own
+        threads.
+
+        Don't forget to handle HTTPErrors and URLErrors.
+        '''
+        response = self.__send_request('GET', relative_uri)
+        try:
+            with self.__metrics.timed('decode'):
+                return json.loads(response.read())
+        except ValueError:
+            self.log.error(('JSON parsing failed for response to '
+                            'URI {0}').format(repr(response.geturl())))
+            raise
+
+    def __fetch_issue(self, issuekey):
+        '''
+        Fetch the fields we display for an issue from JIRA and cache them.
+
+        Don't forget to handle HTTPErrors and URLErrors.
+        '''
+        query = urllib.urlencode({'fields': ','.join(self.__issue_fields())})
+        settings = self.__settings.get()
+        issue = parse_issue(self.__get_json(
+                'rest/api/2/issue/{0}?{1}'.format(issuekey, query)),
+                settings.securityFieldId)
+        self.__issue_cache.set((settings.uri, issuekey), issue)
+        return issue
+
+    def __stale_grace(self):
+        '''
+        How long after an issue's cacheTTL passes that we may still show it
+        while refreshing it
+        '''
+        settings = self.__settings.get()
+        return max(settings.cacheHardTTL - settings.cacheTTL, 0)
+
+    def __revalidate(self, irc, msg, cache_key, old_issue):
+        '''
+        Refresh an issue we just showed from the cache in the background,
+        and show it again if its status or summary changed.
+        '''
+        def correct(future):
+            # This runs on one of the request engine's threads.
+            if future.exception() is not None:
+                self.log.info('Failed to refresh issue {0}: {1}'.format(
+                        cache_key[1], future.exception()))
+                return
+            issue = future.result()
+            if ((issue['status'], issue['summary']) !=
+                    (old_issue['status'], old_issue['summary']) and
+                    self.__settings.get(msg.args[0]).postCorrections):
+                irc.reply('Correction: ' + self.__format_issue(issue))
+        if not self.__breakers.available(cache_key[0]):
+            return
+        future = self.__lookups.submit(cache_key, self.__engine.submit,
+                                       self.__fetch_issue, cache_key[1])
+        future.add_done_callback(correct)
+
+    def __get_issues(self, issuekeys, refresh=False):
+        '''
+        Return the displayed fields for a list of issues, fetching all of
+        the ones that aren't cached with a single search.  Issues that do
+        not exist are left out.  With refresh, fetch all of them, and don't
+        count this as anyone asking about them.
+
+        Don't forget to handle HTTPErrors and URLErrors.
+        '''
+        settings = self.__settings.get()
+        self.__issue_cache.configure(settings.cacheSize, settings.cacheTTL)
+        self.__hot_issues.configure(settings.cacheSize)
+        base_uri = settings.uri
+        issues = {}
+        if not refresh:
+            for issuekey in issuekeys:
+                self.__hot_issues.touch((base_uri, issuekey))
+                issue = self.__issue_cache.get((base_uri, issuekey))
+                if issue is not None:
+                    issues[issuekey] = issue
+        missing = [key for key in issuekeys if key not in issues]
+        if missing:
+            query = urllib.urlencode({
+                    'jql':           'key in ({0})'.format(','.join(missing)),
+                    'fields':        ','.join(self.__issue_fields()),
+                    'maxResults':    len(missing),
+                    'validateQuery': 'false'})
+            results = self.__get_json('rest/api/2/search?' + query)
+            security_field_id = settings.securityFieldId
+            for result in results.get('issues', []):
+                issue = parse_issue(result, security_field_id)
+                issues[issue['key']] = issue
+                self.__issue_cache.set((base_uri, issue['key']), issue)
+        # Issues that moved to another project come back with new keys.
+        return ([issues.pop(key) for key in issuekeys if key in issues] +
+                sorted(issues.values(), key=lambda issue: issue['key']))
+
+    def __prefetch(self):
+        # This runs in the scheduler, so leave the real work to the engine.
+        self.__engine.submit(self.__refresh_hot_issues)
+
+    def __refresh_hot_issues(self):
+        '''
+        Fetch the issues people have been asking about lately so they stay
+        in the cache, up to prefetchBudget of them, blockers and security
+        issues first.  Issues nobody asked about in the last prefetchWindow
+        seconds are left to expire.
+        '''
+        if not self.__prefetch_lock.acquire(False):
+            # The last round is still going.
+            return
+        try:
+            settings = self.__settings.get()
+            base_uri = settings.uri
+            hot = self.__hot_issues.hot(settings.prefetchWindow,
+                                        priority=self.__is_important)
+            issuekeys = [issuekey for (uri, issuekey) in hot
+                         if uri == base_uri]
+            issuekeys = issuekeys[:settings.prefetchBudget]
+            if issuekeys:
+                self.__get_issues(issuekeys, refresh=True)
+        except (httppool.URLError, ValueError) as err:
+            self.log.info('Failed to refresh hot issues: {0}'.format(err))
+        finally:
+            self.__prefetch_lock.release()
+
+    def __is_important(self, cache_key):
+        issue = self.__issue_cache.get_stale(cache_key)
+        if issue is None:
+            return False
+        return (issue['priority'] == 'Blocker' or
+                (issue['security'] or '').lower() == 'yes')
+
+    def __issue_fields(self):
+        '''
+        Return the names of the issue fields we need from JIRA.  Asking for
+        only these keeps JIRA from sending us entire issues, which can be
+        hundreds of kilobytes apiece.
+        '''
+        fields = list(ISSUE_FIELDS)
+        security_field_id = self.__settings.get().securityFieldId
+        if security_field_id > 0:
+            fields.append('customfield_' + str(security_field_id))
+        return fields
+
+    def __forget_issue(self, issuekey):
+        '''
+        Drop an issue from the cache after we change it in JIRA so the next
+        lookup sees the change.
+        '''
+        self.__issue_cache.invalidate((self.__settings.get().uri,
+                                       issuekey.upper()))
+
+    def __format_issue(self, issue):
+        formatter = self.__formatter
+        if formatter is None:
+            # Rarely needed, and a snapshot could still have the old values.
+            template = self.registryValue('replyTemplate')
+            if isinstance(template, str):
+                template = template.decode('utf-8')
+            formatter = replyformat.compile_template(template,
+                    issue_reply_fields(self.registryValue('uri')))
+            self.__formatter = formatter
+        return formatter(issue)
+
+    def __forget_formatter(self):
+        self.__formatter = None
+
+    def doPrivmsg(self, irc, msg):
+        channel = msg.args[0]
+        if not ircutils.isChannel(channel):
+            return
+        if callbacks.addressed(irc.nick, msg):
+            # Commands are handled elsewhere.
+            return
+        if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
+            return
+        if ircdb.checkIgnored(msg.prefix, channel):
+            return
+        settings = self.__settings.get(channel)
+        if not (settings.enabled and settings.snarfIssueKeys):
+            return
+        text = msg.args[1]
+        if ircmsgs.isAction(msg):
+            text = ircmsgs.unAction(msg)
+        issuekeys = find_issuekeys(text)
+        issuekeys = self.__announced.filter_new((irc.network, channel),
+                issuekeys, settings.snarfDedupWindow)
+        if issuekeys:
+            # Don't make the whole bot wait for JIRA.
+            self.__engine.configure(settings.maxQueuedPerChannel)
+            try:
+                self.__engine.submit_for(channel, self.__announce_issues, irc,
+                                         channel, issuekeys)
+            except engine.QueueFullError:
+                self.log.debug('Too many lookups waiting for {0}; not '
+                               'announcing {1}'.format(channel,
+                                       ', '.join(issuekeys)))
+
+    def __announce_issues(self, irc, channel, issuekeys):
+        # This runs on one of the request engine's threads.
+        try:
+            issues = self.__get_issues(issuekeys)
+        except (httppool.URLError, ValueError) as err:
+            self.log.info('Failed to look up snarfed issues {0}: {1}'.format(
+                    ', '.join(issuekeys), err))
+            return
+        # One line for the lot unless that would be too long for IRC
+        lines = []
+        for issue in issues:
+            text = self.__format_issue(issue)
+            if lines and len(lines[-1]) + len(text) < 400:
+                lines[-1] += ' | ' + text
+            else:
+                lines.append(text)
+        for line in lines:
+            irc.queueMsg(ircmsgs.privmsg(channel, line))
+        self.__announced.mark((irc.network, channel),
+                              [issue['key'] for issue in issues])
 
     def getissue(self, irc, msg, args, issuekey):
         '''<issue>
@@ -98,68 +548,269 @@ class SimpleJira(callbacks.Plugin):
         Display information about an issue in JIRA along with a link to
         it on the web.
         '''
-        channel = msg.args[0]
-        if not self.registryValue('enabled', channel):
+        settings = self.__settings.get(msg.args[0])
+        if not settings.enabled:
             self.log.debug('SimpleJira is disabled in this channel; skipping')
             return
         if not check_issuekey(issuekey):
             irc.errorInvalid('issue key', issuekey)
             return
 
+        self.__issue_cache.configure(settings.cacheSize, settings.cacheTTL)
+        self.__hot_issues.configure(settings.cacheSize)
+        issuekey  = issuekey.upper()
+        cache_key = (settings.uri, issuekey)
+        self.__hot_issues.touch(cache_key)
+        (issue, stale) = self.__issue_cache.get_or_stale(cache_key,
+                                                         self.__stale_grace())
+        if issue is not None:
+            # Answer right away, even if it's a bit old, and catch up later.
+            irc.reply(self.__format_issue(issue))
+            if stale:
+                self.__revalidate(irc, msg, cache_key, issue)
+            return
+        if not self.__breakers.available(cache_key[0]):
+            # JIRA has been failing, so don't make people wait on it.
+            self.__reply_unavailable(irc, cache_key)
+            return
+        # If someone else is already looking this issue up, wait for that
+        # instead of asking JIRA again.
+        self.__engine.configure(settings.maxQueuedPerChannel)
         try:
-            response = self.__send_request('rest/api/2/issue/{0}'.format(
-                    issuekey.upper()))
-        except urllib2.HTTPError as err:
-            self.__handle_http_error(irc, err, 'Failed to retrieve issue data')
+            future = self.__lookups.submit(cache_key, functools.partial(
+                    self.__engine.submit_for, lane_for(msg)),
+                    self.__fetch_issue, issuekey)
+        except engine.QueueFullError:
+            irc.error('Too many lookups from here are waiting for JIRA; '
+                      'try again in a moment.')
             return
         try:
-            issue = json.load(response)
+            issue = future.result(settings.requestTimeout)
+        except breaker.CircuitOpenError:
+            self.__reply_unavailable(irc, cache_key)
+            return
+        except ratelimit.RateLimitedError as err:
+            irc.error(err.reason)
+            return
+        except httppool.HTTPError as err:
+            self.__handle_http_error(irc, err, 'Failed to retrieve issue data')
+            return
+        except httppool.URLError as err:
+            self.log.error('Failed to retrieve issue {0}: {1}'.format(
+                    issuekey, err.reason))
+            irc.error('Failed to retrieve issue data')
+            return
         except ValueError:
-            self.log.error(('JSON parsing failed for HTTP {0} response to '
-                            'URI {1}').format(err.code, repr(rest_uri)))
+            irc.error('Failed to retrieve issue data')
+            return
+        irc.reply(self.__format_issue(issue))
 
-        # Now create the output
-        msg_bits = [issue['key']]
-        issue_flags = []
+    getissue = wrap(getissue, ['somethingWithoutSpaces'])
 
-        # status
-        status     = issue['fields']['status']['name']
-        resolution = issue['fields']['resolution']
-        if resolution and status in ('Release Pending', 'Resolved', 'Closed'):
-            issue_flags.append('{0} ({1})'.format(status, resolution['name']))
+    def __reply_unavailable(self, irc, cache_key=None):
+        '''
+        Reply with a cached copy of an issue marked as such, or if we don't
+        have one, with an error saying JIRA isn't answering.
+        '''
+        issue = None
+        if cache_key is not None:
+            issue = self.__issue_cache.get_stale(cache_key)
+        if issue is not None:
+            irc.reply(self.__format_issue(issue) +
+                      ' (cached; JIRA is not answering)')
         else:
-            issue_flags.append(status)
+            irc.error('JIRA is not answering right now; try again later.')
 
-        # 'blocker' priority
-        if issue['fields']['priority']['name'] == 'Blocker':
-            issue_flags.append('Blocker')
+    def __search_page(self, jql, start_at, max_results):
+        '''
+        Fetch one page of the issues that match a JQL query, cache them,
+        and return them along with the number of issues that match in all.
 
-        # 'security' boolean custom field
-        security_field_id = self.registryValue('securityFieldId')
-        if security_field_id > 0:
-            cf_name = 'customfield_' + str(security_field_id)
-            cf_info = issue['fields'].get(cf_name)
-            if (isinstance(cf_info, dict) and
-                cf_info.get('value', '').lower() == 'yes'):
-                # (This space for rent)
-                issue_flags.append('Security')
+        Don't forget to handle HTTPErrors and URLErrors.
+        '''
+        query = urllib.urlencode({'jql':        jql,
+                                  'fields':     ','.join(self.__issue_fields()),
+                                  'startAt':    start_at,
+                                  'maxResults': max_results})
+        results = self.__get_json('rest/api/2/search?' + query)
+        settings = self.__settings.get()
+        base_uri = settings.uri
+        security_field_id = settings.securityFieldId
+        issues = [parse_issue(result, security_field_id)
+                  for result in results.get('issues', [])]
+        for issue in issues:
+            self.__issue_cache.set((base_uri, issue['key']), issue)
+        return (issues, results.get('total', 0))
 
-        # That's it for issue flags
-        if issue_flags:
-            msg_bits.append('(' + ', '.join(issue_flags) + ')')
-        msg_bits[-1] += ':'
+    def __show_search(self, irc, msg, jql, start_at):
+        '''
+        Reply with up to searchMaxResults of the issues that match a JQL
+        query, starting with the start_at-th, a page at a time.  Each page
+        is shown as soon as it arrives while the next one is fetched, so at
+        most two pages are ever held at once.  Where we stop is remembered
+        for searchmore.
+        '''
+        search_key = (irc.network, msg.args[0], msg.nick)
+        self.__searches.invalidate(search_key)
+        settings = self.__settings.get()
+        if not self.__breakers.available(settings.uri):
+            self.__reply_unavailable(irc)
+            return
+        self.__issue_cache.configure(settings.cacheSize, settings.cacheTTL)
+        self.__engine.configure(settings.maxQueuedPerChannel)
+        page_size = settings.searchPageSize
+        stop_at   = start_at + settings.searchMaxResults
+        lane      = lane_for(msg)
+        position  = start_at
+        try:
+            future = self.__engine.submit_for(lane, self.__search_page, jql,
+                                              position, page_size)
+            while future is not None:
+                (issues, total) = future.result(settings.requestTimeout)
+                next_at = position + len(issues)
+                future = None
+                if issues and next_at < min(total, stop_at):
+                    future = self.__engine.submit_for(lane,
+                            self.__search_page, jql, next_at,
+                            min(page_size, stop_at - next_at))
+                for issue in issues:
+                    irc.reply(self.__format_issue(issue), prefixNick=False)
+                position = next_at
+                if issues and position < total:
+                    self.__searches.set(search_key, (jql, position))
+        except engine.QueueFullError:
+            irc.error('Too many lookups from here are waiting for JIRA; '
+                      'try again in a moment.')
+            return
+        except breaker.CircuitOpenError:
+            self.__reply_unavailable(irc)
+            return
+        except ratelimit.RateLimitedError as err:
+            irc.error(err.reason)
+            return
+        except httppool.HTTPError as err:
+            self.__handle_http_error(irc, err, 'Failed to search for issues')
+            return
+        except httppool.URLError as err:
+            self.log.error('Failed to search for issues: {0}'.format(
+                    err.reason))
+            irc.error('Failed to search for issues')
+            return
+        except ValueError:
+            irc.error('Failed to search for issues')
+            return
+        if position == start_at == 0:
+            irc.reply('No issues match that query.')
+        elif position == start_at:
+            irc.reply('No more issues match that query.')
+        elif position < total:
+            irc.reply('{0} more of {1}; use searchmore to see them.'.format(
+                    total - position, total))
+        else:
+            self.__searches.invalidate(search_key)
 
-        # Summary
-        msg_bits.append(issue['fields']['summary'] or '(no summary)')
+    def search(self, irc, msg, args, jql):
+        '''<query>
 
-        # Web URL
-        msg_bits.append('-')
-        msg_bits.append(urljoin(self.registryValue('uri'),
-                                                   'browse/' + issue['key']))
+        Display the JIRA issues that match a JQL query, such as
+        "project = PROJ AND priority = Blocker AND resolution = Unresolved".
+        Use searchmore to see more of them.
+        '''
+        channel = msg.args[0]
+        if not self.__settings.get(channel).enabled:
+            self.log.debug('SimpleJira is disabled in this channel; skipping')
+            return
+        self.__show_search(irc, msg, jql, 0)
 
-        irc.reply(' '.join(msg_bits))
+    search = wrap(search, ['text'])
 
-    getissue = wrap(getissue, ['somethingWithoutSpaces'])
+    def searchmore(self, irc, msg, args):
+        '''takes no arguments
+
+        Display more of the issues that match your last search here.
+        '''
+        channel = msg.args[0]
+        if not self.__settings.get(channel).enabled:
+            self.log.debug('SimpleJira is disabled in this channel; skipping')
+            return
+        last = self.__searches.get((irc.network, channel, msg.nick))
+        if last is None:
+            irc.error('You have no search here to continue.')
+            return
+        (jql, position) = last
+        self.__show_search(irc, msg, jql, position)
+
+    searchmore = wrap(searchmore)
+
+    def __assign(self, issuekey, assignee, body):
+        # Setting the assignee through an edit lets us add the comment in the
+        # same request, but that only works if the assignee field is on the
+        # project's edit screen.
+        self.__write_with_comment(issuekey, 'assign',
+                'rest/api/2/issue/{0}'.format(issuekey), 'PUT',
+                {'fields': {'assignee': {'name': assignee}}}, body,
+                fallback=('rest/api/2/issue/{0}/assignee'.format(issuekey),
+                          'PUT', {'name': assignee}))
+
+    def __transition(self, issuekey, transid, resolution, body):
+        data = {'transition': {'id': transid}}
+        if resolution:
+            # Note that JIRA will complain if the transition doesn't actually
+            # take a resolution.
+            data['fields'] = {'resolution': {'name': resolution}}
+        self.__write_with_comment(issuekey, 'transition',
+                'rest/api/2/issue/{0}/transitions'.format(issuekey), 'POST',
+                data, body)
+
+    def __setfield(self, issuekey, field, value, body):
+        self.__write_with_comment(issuekey, 'setfield',
+                'rest/api/2/issue/{0}'.format(issuekey), 'PUT',
+                {'fields': {field: value}}, body)
+
+    def __write_with_comment(self, issuekey, kind, path, method, data, body,
+                             fallback=None):
+        '''
+        Change an issue and leave a comment saying who did it.  Normally
+        this takes one request, with the comment in the request's "update"
+        block.  If JIRA rejects that, we make the change on its own (with
+        the (path, method, data) in fallback, if given) and then post the
+        comment separately.  If both of those work, it was combining them
+        that JIRA didn't like, so we stop trying to combine that kind of
+        change for the next UNCOMBINABLE_FOR seconds.
+
+        Don't forget to handle HTTPErrors.
+        '''
+        combine_key = (self.__settings.get().uri, kind)
+        rejected = False
+        if combine_key not in self.__uncombinable:
+            combined = dict(data)
+            combined['update'] = {'comment': [{'add': {'body': body}}]}
+            try:
+                # Even a PUT adds a second comment if JIRA sees it twice.
+                self.__send_request(method, path, combined, idempotent=False)
+            except httppool.HTTPError as err:
+                if err.code != 400:
+                    raise
+                self.log.debug(('JIRA rejected a {0} with a comment; trying '
+                                'again without one: {1}').format(kind,
+                                        err.read()))
+                rejected = True
+            else:
+                self.__forget_issue(issuekey)
+                return
+        if fallback is not None:
+            (path, method, data) = fallback
+        self.__send_request(method, path, data)
+        self.__forget_issue(issuekey)
+        self.__comment(issuekey, body)
+        if rejected:
+            self.__uncombinable.set(combine_key, True)
+
+    def __comment(self, issuekey, body):
+        self.__send_request('POST',
+                            'rest/api/2/issue/{0}/comment'.format(issuekey),
+                            {'body': body}, idempotent=False)
+        self.__forget_issue(issuekey)
 
     def assign(self, irc, msg, args, issuekey, assignee, actor, comment):
         '''<issue> to <assignee> [comment ...]
@@ -167,35 +818,28 @@ class SimpleJira(callbacks.Plugin):
         Assign a JIRA issue to someone.  Use that person's JIRA account name.
         '''
         channel = msg.args[0]
-        if not self.registryValue('enabled', channel):
+        if not self.__settings.get(channel).enabled:
             self.log.debug('SimpleJira is disabled in this channel; skipping')
             return
         if not check_issuekey(issuekey):
             irc.errorInvalid('issue key', issuekey)
             return
 
-        # Assign the issue...
-        path = 'rest/api/2/issue/{0}/assignee'.format(issuekey.upper())
-        data = {'name': assignee}
-        try:
-            response = self.__send_request(path, json.dumps(data),
-                                           method='PUT')
-        except urllib2.HTTPError as err:
-            self.__handle_http_error(irc, err, 'Failed to set issue assignee')
-            return
-        response.read()  # empty the buffer
-
-        # ...then log who did it.
-        path = 'rest/api/2/issue/{0}/comment'.format(issuekey.upper())
-        data = {'body': 'Assigned to {0} by {1}'.format(assignee, actor.name)}
+        body = 'Assigned to {0} by {1}'.format(assignee, actor.name)
         if comment is not None:
-            data['body'] += '\n\n' + comment
+            body += '\n\n' + comment
         try:
-            response = self.__send_request(path, json.dumps(data))
-        except urllib2.HTTPError as err:
+            self.__assign(issuekey.upper(), assignee, body)
+        except httppool.HTTPError as err:
             self.__handle_http_error(irc, err, 'Failed to set issue assignee')
             return
-        response.read()  # empty the buffer
+        except ratelimit.RateLimitedError as err:
+            irc.error(err.reason)
+            return
+        except (breaker.CircuitOpenError, httppool.URLError) as err:
+            self.log.error('Failed to reach JIRA: {0}'.format(err.reason))
+            self.__reply_unavailable(irc)
+            return
 
         irc.replySuccess()
 
@@ -213,39 +857,29 @@ class SimpleJira(callbacks.Plugin):
         Perform a transition on a JIRA issue.
         '''
         channel = msg.args[0]
-        if not self.registryValue('enabled', channel):
+        if not self.__settings.get(channel).enabled:
             self.log.debug('SimpleJira is disabled in this channel; skipping')
             return
         if not check_issuekey(issuekey):
             irc.errorInvalid('issue key', issuekey)
             return
 
-        # Perform the transition...
-        path = 'rest/api/2/issue/{0}/transitions'.format(issuekey.upper())
-        data = {'transition': {'id': transid}}
-        resolution = dict(opts).get('resolution')
-        if resolution:
-            # Note that JIRA will complain if the transition doesn't actually
-            # take a resolution.
-            data['fields'] = {'resolution': {'name': resolution}}
-        try:
-            response = self.__send_request(path, json.dumps(data))
-        except urllib2.HTTPError as err:
-            self.__handle_http_error(irc, err, 'Failed to transition issue')
-            return
-        response.read()  # empty the buffer
-
-        # ...then log who did it.
-        path = 'rest/api/2/issue/{0}/comment'.format(issuekey.upper())
-        data = {'body': 'Status updated by {0}'.format(actor.name)}
+        body = 'Status updated by {0}'.format(actor.name)
         if comment is not None:
-            data['body'] += '\n\n' + comment
+            body += '\n\n' + comment
         try:
-            response = self.__send_request(path, json.dumps(data))
-        except urllib2.HTTPError as err:
+            self.__transition(issuekey.upper(), transid,
+                              dict(opts).get('resolution'), body)
+        except httppool.HTTPError as err:
             self.__handle_http_error(irc, err, 'Failed to transition issue')
             return
-        response.read()  # empty the buffer
+        except ratelimit.RateLimitedError as err:
+            irc.error(err.reason)
+            return
+        except (breaker.CircuitOpenError, httppool.URLError) as err:
+            self.log.error('Failed to reach JIRA: {0}'.format(err.reason))
+            self.__reply_unavailable(irc)
+            return
 
         irc.replySuccess()
 
@@ -263,21 +897,26 @@ class SimpleJira(callbacks.Plugin):
         Add a comment to a JIRA issue.
         '''
         channel = msg.args[0]
-        if not self.registryValue('enabled', channel):
+        if not self.__settings.get(channel).enabled:
             self.log.debug('SimpleJira is disabled in this channel; skipping')
             return
         if not check_issuekey(issuekey):
             irc.errorInvalid('issue key', issuekey)
             return
 
-        path = 'rest/api/2/issue/{0}/comment'.format(issuekey.upper())
-        data = {'body': 'Comment from {0}:\n\n{1}'.format(actor.name, comment)}
+        body = 'Comment from {0}:\n\n{1}'.format(actor.name, comment)
         try:
-            response = self.__send_request(path, json.dumps(data))
-        except urllib2.HTTPError as err:
+            self.__comment(issuekey.upper(), body)
+        except httppool.HTTPError as err:
             self.__handle_http_error(irc, err, 'Failed to comment on issue')
             return
-        response.read()  # empty the buffer
+        except ratelimit.RateLimitedError as err:
+            irc.error(err.reason)
+            return
+        except (breaker.CircuitOpenError, httppool.URLError) as err:
+            self.log.error('Failed to reach JIRA: {0}'.format(err.reason))
+            self.__reply_unavailable(irc)
+            return
 
         irc.replySuccess()
 
@@ -295,38 +934,31 @@ class SimpleJira(callbacks.Plugin):
         # We actually make a ton of assumptions here (most notably that we need
         # to use 'name' as the key for each field value.
         channel = msg.args[0]
-        if not self.registryValue('enabled', channel):
+        if not self.__settings.get(channel).enabled:
             self.log.debug('SimpleJira is disabled in this channel; skipping')
             return
         if not check_issuekey(issuekey):
             irc.errorInvalid('issue key', issuekey)
             return
 
-        # Set the field...
-        path = 'rest/api/2/issue/{0}'.format(issuekey.upper())
         if raw_value.startswith('(') and raw_value.endswith(')'):
             values = raw_value.strip('()').split(',')
-            values_dict = [{'name': value.strip()} for value in values]
-            data = {'fields': {field: values_dict}}
+            value = [{'name': value.strip()} for value in values]
         else:
-            data = {'fields': {field: {'name': raw_value}}}
+            value = {'name': raw_value}
+        body = 'Field updated by {0}'.format(actor.name)
         try:
-            response = self.__send_request(path, json.dumps(data),
-                                           method='PUT')
-        except urllib2.HTTPError as err:
+            self.__setfield(issuekey.upper(), field, value, body)
+        except httppool.HTTPError as err:
             self.__handle_http_error(irc, err, 'Failed to update issue')
             return
-        response.read()  # empty the buffer
-
-        # ...then log who did it.
-        path = 'rest/api/2/issue/{0}/comment'.format(issuekey.upper())
-        data = {'body': 'Field updated by {0}'.format(actor.name)}
-        try:
-            response = self.__send_request(path, json.dumps(data))
-        except urllib2.HTTPError as err:
-            self.__handle_http_error(irc, err, 'Failed to update issue')
+        except ratelimit.RateLimitedError as err:
+            irc.error(err.reason)
+            return
+        except (breaker.CircuitOpenError, httppool.URLError) as err:
+            self.log.error('Failed to reach JIRA: {0}'.format(err.reason))
+            self.__reply_unavailable(irc)
             return
-        response.read()  # empty the buffer
 
         irc.replySuccess()
 
@@ -336,6 +968,318 @@ class SimpleJira(callbacks.Plugin):
                                'text',                    # value
                                ('checkCapability', 'jirawrite')])
 
+    def __search_issuekeys(self, jql, limit):
+        '''
+        Return the keys of up to limit issues that match a JQL query, along
+        with the number of issues that match in all.
+
+        Don't forget to handle HTTPErrors and URLErrors.
+        '''
+        query = urllib.urlencode({'jql':        jql,
+                                  'fields':     'key',
+                                  'maxResults': limit})
+        results = self.__get_json('rest/api/2/search?' + query)
+        return ([issue['key'] for issue in results.get('issues', [])],
+                results.get('total', 0))
+
+    def __bulk_issuekeys(self, irc, opts, issuekeys):
+        '''
+        Work out which issues a bulk command should change, either from the
+        list of keys it was given or by running its --jql query.  If that
+        fails, reply with an error and return None.
+        '''
+        jql = dict(opts).get('jql')
+        if (jql is None) == (issuekeys is None):
+            irc.error('Give either a list of issues or --jql, but not both.')
+            return None
+        settings = self.__settings.get()
+        limit    = settings.bulkMaxIssues
+        if jql is None:
+            issuekeys = list(collections.OrderedDict.fromkeys(issuekeys))
+            total = len(issuekeys)
+        else:
+            future = self.__engine.submit(self.__search_issuekeys, jql, limit)
+            try:
+                (issuekeys, total) = future.result(settings.requestTimeout)
+            except httppool.HTTPError as err:
+                self.__handle_http_error(irc, err,
+                                         'Failed to search for issues')
+                return None
+            except ratelimit.RateLimitedError as err:
+                irc.error(err.reason)
+                return None
+            except httppool.URLError as err:
+                self.log.error('Failed to search for issues: {0}'.format(
+                        err.reason))
+                irc.error('Failed to search for issues')
+                return None
+            except ValueError:
+                irc.error('Failed to search for issues')
+                return None
+            if not issuekeys:
+                irc.error('No issues match that query.')
+                return None
+        if total > limit:
+            irc.error(('That would change {0} issues, but bulk commands may '
+                       'change at most {1}.').format(total, limit))
+            return None
+        return issuekeys
+
+    def __change_issues(self, irc, issuekeys, change, errmsg):
+        '''
+        Call change(issuekey) for each issue on the request engine, at most
+        bulkParallelism at a time and no faster than bulkRateLimit allows,
+        then reply with how many worked, which ones JIRA was still working
+        on when we stopped waiting, and why the rest didn't work.
+        '''
+        settings    = self.__settings.get()
+        host        = urlparse(settings.uri).netloc
+        rate        = settings.bulkRateLimit
+        parallelism = settings.bulkParallelism
+        pending     = []
+        unfinished  = []
+        failures    = []
+        for issuekey in issuekeys:
+            if len(pending) >= parallelism:
+                self.__finish_change(pending.pop(0), errmsg, unfinished,
+                                     failures)
+            self.__bulk_limiter.acquire(host, rate)
+            pending.append((issuekey, self.__engine.submit(change, issuekey)))
+        for job in pending:
+            self.__finish_change(job, errmsg, unfinished, failures)
+
+        reply = 'Changed {0} of {1} issues.'.format(
+                len(issuekeys) - len(unfinished) - len(failures),
+                len(issuekeys))
+        if unfinished:
+            reply += '  Still in progress: ' + ', '.join(unfinished)
+        if failures:
+            reply += '  Failed: ' + '; '.join('{0} ({1})'.format(*failure)
+                                              for failure in failures)
+        irc.reply(reply)
+
+    def __finish_change(self, job, errmsg, unfinished, failures):
+        (issuekey, future) = job
+        try:
+            future.result(self.__settings.get().requestTimeout)
+        except httppool.HTTPError as err:
+            failures.append((issuekey, self.__describe_http_error(err, errmsg)))
+        except engine.TimeoutError:
+            # A change that hasn't been sent yet never will be, but one
+            # that has may still go through.
+            if future.cancel():
+                failures.append((issuekey, 'timed out'))
+            else:
+                unfinished.append(issuekey)
+        except breaker.CircuitOpenError:
+            failures.append((issuekey, 'JIRA is not answering'))
+        except ratelimit.RateLimitedError as err:
+            failures.append((issuekey, err.reason))
+        except httppool.URLError as err:
+            self.log.error('{0} {1}: {2}'.format(errmsg, issuekey, err.reason))
+            failures.append((issuekey, errmsg))
+
+    def bulkassign(self, irc, msg, args, actor, opts, issuekeys, assignee,
+                   comment):
+        '''[--jql <query>] [<issue>,...] to <assignee> [comment ...]
+
+        Assign several JIRA issues to someone at once.  Name the issues with
+        either a comma-separated list or a JQL query.
+        '''
+        channel = msg.args[0]
+        if not self.__settings.get(channel).enabled:
+            self.log.debug('SimpleJira is disabled in this channel; skipping')
+            return
+        issuekeys = self.__bulk_issuekeys(irc, opts, issuekeys)
+        if issuekeys is None:
+            return
+
+        body = 'Assigned to {0} by {1}'.format(assignee, actor.name)
+        if comment is not None:
+            body += '\n\n' + comment
+        self.__change_issues(irc, issuekeys,
+                lambda issuekey: self.__assign(issuekey, assignee, body),
+                'Failed to set issue assignee')
+
+    bulkassign = wrap(bulkassign, ['user',  # caller must be registered
+                                   getopts({'jql': 'something'}),
+                                   optional('jiraIssueKeys'),
+                                   'to',
+                                   'somethingWithoutSpaces',  # assignee
+                                   ('checkCapability', 'jirawrite'),
+                                   optional('text')])
+
+    def bulktransition(self, irc, msg, args, actor, opts, issuekeys, transid,
+                       comment):
+        '''[--jql <query>] [--resolution <resolution>] [<issue>,...] <trans_id> [comment ...]
+
+        Perform a transition on several JIRA issues at once.  Name the issues
+        with either a comma-separated list or a JQL query.
+        '''
+        channel = msg.args[0]
+        if not self.__settings.get(channel).enabled:
+            self.log.debug('SimpleJira is disabled in this channel; skipping')
+            return
+        issuekeys = self.__bulk_issuekeys(irc, opts, issuekeys)
+        if issuekeys is None:
+            return
+
+        resolution = dict(opts).get('resolution')
+        body = 'Status updated by {0}'.format(actor.name)
+        if comment is not None:
+            body += '\n\n' + comment
+        self.__change_issues(irc, issuekeys,
+                lambda issuekey: self.__transition(issuekey, transid,
+                                                   resolution, body),
+                'Failed to transition issue')
+
+    bulktransition = wrap(bulktransition,
+                          ['user',  # caller must be registered with the bot
+                           getopts({'jql':        'something',
+                                    'resolution': 'something'}),
+                           optional('jiraIssueKeys'),
+                           'positiveInt',  # transition ID
+                           ('checkCapability', 'jirawrite'),
+                           optional('text')])
+
+    def bulkcomment(self, irc, msg, args, actor, opts, issuekeys, comment):
+        '''[--jql <query>] [<issue>,...] <comment>
+
+        Add the same comment to several JIRA issues at once.  Name the issues
+        with either a comma-separated list or a JQL query.
+        '''
+        channel = msg.args[0]
+        if not self.__settings.get(channel).enabled:
+            self.log.debug('SimpleJira is disabled in this channel; skipping')
+            return
+        issuekeys = self.__bulk_issuekeys(irc, opts, issuekeys)
+        if issuekeys is None:
+            return
+
+        body = 'Comment from {0}:\n\n{1}'.format(actor.name, comment)
+        self.__change_issues(irc, issuekeys,
+                lambda issuekey: self.__comment(issuekey, body),
+                'Failed to comment on issue')
+
+    bulkcomment = wrap(bulkcomment, ['user',  # caller must be registered
+                                     getopts({'jql': 'something'}),
+                                     optional('jiraIssueKeys'),
+                                     ('checkCapability', 'jirawrite'),
+                                     'text'])
+
+    def cachestats(self, irc, msg, args):
+        '''takes no arguments
+
+        Show how well the issue cache is working.
+        '''
+        stats = self.__issue_cache.stats()
+        irc.reply(('Issue cache: {size} of {maxsize} entries (TTL {ttl}s); '
+                   '{hits} hits, {stale_hits} stale hits, {misses} misses, '
+                   '{evictions} evictions, {expirations} expirations')
+                  .format(**stats))
+
+    cachestats = wrap(cachestats, ['admin'])
+
+    def stats(self, irc, msg, args):
+        '''takes no arguments
+
+        Show how long requests to JIRA have been taking, by endpoint and
+        outcome, how many lookups shared another's request, and how often
+        we slowed down to stay under rateLimit.  Times are in seconds.
+        '''
+        lines = self.__metrics.summary()
+        if lines:
+            irc.replies(lines, joiner='; ')
+        else:
+            irc.reply('No requests have been made to JIRA yet.')
+
+    stats = wrap(stats, ['owner'])
+
+
+
+# The issue fields parse_issue needs, besides any custom fields
+ISSUE_FIELDS = ('status', 'resolution', 'priority', 'summary')
+
+# How many unfinished searches searchmore remembers, and for how long
+SEARCHES_KEPT   = 100
+SEARCH_KEPT_FOR = 600
+
+# How many kinds of writes we remember JIRA won't take comments with, and
+# for how long, so that adding the comment field to a screen takes effect
+UNCOMBINABLE_KEPT = 100
+UNCOMBINABLE_FOR  = 3600
+
+
+def parse_issue(issue, security_field_id=0):
+    '''
+    Boil a JIRA issue document down to the fields we actually display.
+    '''
+    fields = issue['fields']
+    security = None
+    if security_field_id > 0:
+        cf_info = fields.get('customfield_' + str(security_field_id))
+        if isinstance(cf_info, dict):
+            security = cf_info.get('value')
+    return {'key':        issue['key'],
+            'status':     fields['status']['name'],
+            'resolution': (fields['resolution'] or {}).get('name'),
+            'priority':   fields['priority']['name'],
+            'summary':    fields['summary'],
+            'security':   security}
+
+
+def issue_flags(issue):
+    '''
+    The notable things about an issue that replies show in parentheses
+    '''
+    issue_flags = []
+
+    # status
+    status     = issue['status']
+    resolution = issue['resolution']
+    if resolution and status in ('Release Pending', 'Resolved', 'Closed'):
+        issue_flags.append('{0} ({1})'.format(status, resolution))
+    else:
+        issue_flags.append(status)
+
+    # 'blocker' priority
+    if issue['priority'] == 'Blocker':
+        issue_flags.append('Blocker')
+
+    # 'security' boolean custom field
+    if (issue['security'] or '').lower() == 'yes':
+        # (This space for rent)
+        issue_flags.append('Security')
+    return issue_flags
+
+
+def issue_reply_fields(base_uri):
+    '''
+    The fields that replyTemplate may use, as functions of an issue.  Links
+    to issues are made under base_uri, which is joined here once instead of
+    for every issue.
+    '''
+    browse_uri = urljoin(base_uri, 'browse/')
+    return {'key':        operator.itemgetter('key'),
+            'flags':      lambda issue: replyformat.format_flags(
+                                  issue_flags(issue)),
+            'status':     operator.itemgetter('status'),
+            'resolution': lambda issue: issue['resolution'] or '',
+            'priority':   operator.itemgetter('priority'),
+            'summary':    lambda issue: issue['summary'] or '(no summary)',
+            'url':        lambda issue: browse_uri + issue['key']}
+
+
+def find_issuekeys(text):
+    '''
+    Return the distinct issue keys mentioned in a chunk of text in the order
+    they appear.  Only upper-case keys count so things like "utf-8" don't.
+    '''
+    issuekeys = []
+    for issuekey in re.findall(r'\b[A-Z]{2,}-[0-9]+\b', text):
+        if issuekey not in issuekeys:
+            issuekeys.append(issuekey)
+    return issuekeys
 
 
 def check_issuekey(issuekey):
@@ -345,4 +1289,26 @@ def check_issuekey(issuekey):
         return False
 
 
+def endpoint_for(method, relative_uri):
+    '''
+    Name a request for metrics, e.g. "POST issue/transitions".  The API
+    prefix, issue keys and ids are left out so that requests for different
+    issues add up.
+    '''
+    path = re.sub('^/?rest/api/[0-9]+/', '', urlparse(relative_uri).path)
+    segments = [segment for segment in path.split('/')
+                if segment and not segment.isdigit() and
+                not check_issuekey(segment)]
+    return '{0} {1}'.format(method, '/'.join(segments))
+
+def lane_for(msg):
+    '''
+    The request engine lane for a message's lookups:  its channel, or in
+    private, the person who sent it
+    '''
+    if ircutils.isChannel(msg.args[0]):
+        return msg.args[0]
+    return msg.nick
+
+
 Class = SimpleJira
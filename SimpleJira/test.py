@@ -25,9 +25,549 @@
 
 ###
 
+import BaseHTTPServer
+import httplib
+import json
+import os.path
+import re
+import shutil
+import socket
+import SocketServer
+import tempfile
+import threading
+import time
+import urlparse
+
 from supybot.test import *
+import supybot.schedule as schedule
+
+from local import diskcache
+from local import webhook
+
+class SimpleJiraTestCase(PluginTestCase):
+    plugins = ('SimpleJira',)
+
+class DiskCacheTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.dir  = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        SupyTestCase.tearDown(self)
+
+    def testReopen(self):
+        # Webhooks and searches give us unicode keys, but getissue uses str.
+        store = diskcache.DiskCache(self.path)
+        store.set(('http://jira/', u'ABC-1'), 100, {'summary': u'Broken'})
+        store.set(('http://jira/', u'ABC-2'), 100, {'summary': u'Fine'})
+        store.close()
+        store = diskcache.DiskCache(self.path)
+        self.assertEqual(store.get(('http://jira/', 'ABC-1')),
+                         (100, {'summary': 'Broken'}))
+        store.invalidate(('http://jira/', 'ABC-1'))
+        self.assertEqual(store.get(('http://jira/', u'ABC-1')), None)
+        store.invalidate_where(lambda key: key == ('http://jira/', 'ABC-2'))
+        store.close()
+        store = diskcache.DiskCache(self.path)
+        self.assertEqual(store.get(('http://jira/', 'ABC-2')), None)
+        store.close()
+
+
+class _Log(object):
+    def __init__(self):
+        self.lines = []
+
+    def debug(self, msg):
+        self.lines.append(msg)
+
+    exception = debug
+
+
+def post(port, path, body, headers={}):
+    '''
+    POST body to a local port and return the response's status.
+    '''
+    conn = httplib.HTTPConnection('127.0.0.1', port)
+    try:
+        conn.request('POST', path, body, headers)
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class WebhookTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.payloads = []
+        self.log = _Log()
+        self.server = webhook.WebhookServer('127.0.0.1', 0, 'hush',
+                lambda path, payload: self.payloads.append(payload),
+                log=self.log).start()
+
+    def tearDown(self):
+        self.server.stop()
+        SupyTestCase.tearDown(self)
+
+    def testSecret(self):
+        body = json.dumps({'issue': {'key': 'ABC-1'}})
+        self.assertEqual(post(self.server.port, '/', body), 403)
+        self.assertEqual(post(self.server.port, '/?secret=wrong', body), 403)
+        self.assertEqual(post(self.server.port, '/', body,
+                              {'X-Webhook-Secret': 'wrong'}), 403)
+        self.assertEqual(self.payloads, [])
+        self.assertEqual(post(self.server.port, '/', body,
+                              {'X-Webhook-Secret': 'hush'}), 204)
+        self.assertEqual(post(self.server.port, '/?secret=hush', body), 204)
+        self.assertEqual(self.payloads, [{'issue': {'key': 'ABC-1'}}] * 2)
+
+    def testLogging(self):
+        post(self.server.port, '/?secret=hush', '{}')
+        post(self.server.port, '/?secret=hushed', '{}')
+        self.assertEqual(len(self.log.lines), 2)
+        for line in self.log.lines:
+            self.assertTrue('POST /?<redacted> ' in line, line)
+            self.assertFalse('hush' in line, line)
+
+
+class _JiraHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Speaks enough of JIRA's REST API for SimpleJira.  Issues ABC-1 through
+    ABC-99 exist, and searches other than "key in (...)" match ABC-1
+    through ABC-<the server's "total">.  The server remembers each request
+    as a (method, path, query, JSON body) tuple and the client address of
+    each connection.
+
+    While the server's "sessions" flag is set, requests need the cookie
+    that POSTing the right credentials to rest/auth/1/session hands out.
+    While its "combine" flag is cleared, writes that carry a comment in an
+    "update" block get a 400, as on JIRAs whose screens lack the comment
+    field.  Assigning issues to "nobody" always gets a 400.  Writes to the
+    issues in its "slow" set take two seconds.  While its "drop" count is
+    above zero, it hangs up on that many writes after reading them, and
+    while its "fail" count is, it answers that many searches with a 500.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.add(self.client_address)
+
+    # The client may hang up on a keep-alive connection at any time.
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            pass
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+    def do_GET(self):
+        self.answer('GET')
+
+    def do_POST(self):
+        self.answer('POST')
+
+    def do_PUT(self):
+        self.answer('PUT')
+
+    def answer(self, method):
+        server = self.server
+        parsed = urlparse.urlsplit(self.path)
+        path   = parsed.path.strip('/')
+        query  = urlparse.parse_qs(parsed.query)
+        length = int(self.headers.getheader('Content-Length', 0))
+        data   = json.loads(self.rfile.read(length)) if length else None
+        if path == 'rest/auth/1/session':
+            if data != {'username': 'bot', 'password': 'secret'}:
+                self.send_json(401, {'errorMessages': ['Login failed']})
+                return
+            server.logins += 1
+            session = 'session{0}'.format(server.logins)
+            server.cookie = 'JSESSIONID=' + session
+            self.send_json(200, {'session': {'name':  'JSESSIONID',
+                                             'value': session}})
+            return
+        server.requests.append((method, path, query, data))
+        if method != 'GET' and server.drop:
+            server.drop -= 1
+            self.close_connection = 1
+            return
+        if (server.sessions and
+                self.headers.getheader('Cookie') != server.cookie):
+            self.send_json(401, {'errorMessages': ['Login Required']})
+        elif path == 'rest/api/2/search' and server.fail:
+            server.fail -= 1
+            self.send_json(500, {'errorMessages': ['Internal server error']})
+        elif path == 'rest/api/2/search':
+            self.search(query)
+        elif not exists(path.split('/')[4]):
+            self.send_json(404, {'errorMessages': ['Issue Does Not Exist'],
+                                 'errors': {}})
+        elif method == 'GET':
+            self.send_json(200, self.issue(path.split('/')[4],
+                                           query.get('fields', [''])[0]))
+        elif path.split('/')[4] in server.slow:
+            time.sleep(2)
+            self.send_json(201, {'id': '10001'})
+        elif 'nobody' in json.dumps(data.get('fields', data)):
+            self.send_json(400, {'errorMessages': [], 'errors': {
+                    'assignee': "User 'nobody' does not exist."}})
+        elif 'update' in data and not server.combine:
+            self.send_json(400, {'errorMessages': [], 'errors': {
+                    'comment': "Field 'comment' cannot be set. It is not on "
+                               "the appropriate screen, or unknown."}})
+        elif path.endswith('/comment'):
+            self.send_json(201, {'id': '10001'})
+        else:
+            self.send_json(204)
+
+    def search(self, query):
+        jql = query['jql'][0]
+        match = re.match(r'key in \(([^)]*)\)$', jql)
+        if match:
+            keys = [key for key in match.group(1).split(',') if exists(key)]
+        else:
+            keys = ['ABC-{0}'.format(num)
+                    for num in xrange(1, self.server.total + 1)]
+        start = int(query.get('startAt', ['0'])[0])
+        page  = keys[start:start + int(query['maxResults'][0])]
+        fields = query['fields'][0]
+        self.send_json(200, {'startAt': start, 'total': len(keys),
+                             'issues': [self.issue(key, fields)
+                                        for key in page]})
+
+    def issue(self, key, fields):
+        all_fields = {'status':            {'name': 'Open'},
+                      'resolution':        None,
+                      'priority':          {'name': 'Major'},
+                      'summary':           'Issue number ' + key.split('-')[1],
+                      'customfield_10000': {'value': 'Yes'},
+                      'description':       'x' * 1000}
+        if fields:
+            all_fields = dict((name, value) for (name, value)
+                              in all_fields.items()
+                              if name in fields.split(','))
+        return {'key': key, 'fields': all_fields}
+
+    def send_json(self, code, obj=None):
+        body = json.dumps(obj) if obj is not None else ''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def exists(issuekey):
+    return re.match('ABC-[1-9][0-9]?$', issuekey) is not None
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_server(handler, **attrs):
+    '''
+    Serve handler on a free local port from a background thread, with attrs
+    set on the server for the handler to use.
+    '''
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    for (name, value) in attrs.iteritems():
+        setattr(server, name, value)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class SimpleJiraServerTestCase(ChannelPluginTestCase):
+    plugins = ('SimpleJira', 'User')
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.server = start_server(_JiraHandler, connections=set(),
+                                   requests=[], total=20, sessions=False,
+                                   cookie=None, logins=0, combine=True,
+                                   slow=set(), drop=0, fail=0)
+        self.uri = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        self.__saved = []
+        self.__set('enabled', True)
+        self.__set('uri', self.uri)
+        self.__set('username', 'bot')
+        self.__set('password', 'secret')
+        self.assertNotError('register tester moo', private=True)
+
+    def tearDown(self):
+        for (setting, value) in reversed(self.__saved):
+            setting.setValue(value)
+        self.server.shutdown()
+        self.server.server_close()
+        ChannelPluginTestCase.tearDown(self)
+
+    def __set(self, name, value, channel=None):
+        '''
+        Change one of the plugin's settings, or its value for a channel,
+        until the test is over.
+        '''
+        setting = conf.supybot.plugins.SimpleJira.get(name)
+        if channel is not None:
+            setting = setting.get(channel)
+        self.__saved.append((setting, setting()))
+        setting.setValue(value)
+
+    def __replies(self, query=None, text=None):
+        '''
+        Send a command, or text to the channel, and return everything the
+        bot says until it goes quiet.
+        '''
+        if query is not None:
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel,
+                    conf.supybot.reply.whenAddressedBy.chars()[0] + query,
+                    prefix=self.prefix))
+        else:
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, text,
+                                             prefix=self.prefix))
+        replies = []
+        quiet_since = time.time()
+        while time.time() - quiet_since < 1:
+            msg = self.irc.takeMsg()
+            if msg is None:
+                time.sleep(0.05)
+            else:
+                replies.append(msg.args[1])
+                quiet_since = time.time()
+        return replies
+
+    def __writes(self):
+        return [(method, path, data)
+                for (method, path, query, data) in self.server.requests
+                if method != 'GET']
+
+    def testSessionReuse(self):
+        for num in (1, 2, 3):
+            self.assertRegexp('simplejira getissue ABC-{0}'.format(num),
+                              'Issue number {0}'.format(num))
+        self.assertEqual(len(self.server.connections), 1)
+
+    def testSessionLogin(self):
+        self.__set('authType', 'session')
+        self.server.sessions = True
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        self.assertRegexp('simplejira getissue ABC-2', 'Issue number 2')
+        self.assertEqual(self.server.logins, 1)
+        # JIRA forgets the session, so the bot logs in again, just once.
+        self.server.cookie = 'expired'
+        self.assertRegexp('simplejira getissue ABC-3', 'Issue number 3')
+        self.assertRegexp('simplejira getissue ABC-4', 'Issue number 4')
+        self.assertEqual(self.server.logins, 2)
+
+    def testIssueCache(self):
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        self.assertRegexp('simplejira getissue abc-1', 'Issue number 1')
+        self.assertEqual(len(self.server.requests), 1)
+        # Changing an issue drops it from the cache.
+        self.assertNotError('simplejira comment ABC-1 hello')
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertRegexp('simplejira getissue ABC-100', 'Does Not Exist')
+
+    def testReplyTemplate(self):
+        template = conf.supybot.plugins.SimpleJira.replyTemplate
+        self.assertRaises(registry.InvalidRegistryValue, template.setValue,
+                          '{key}: {assignee}')
+        self.assertRaises(registry.InvalidRegistryValue, template.setValue,
+                          '{key')
+        self.__set('replyTemplate',
+                   '{key} \xe2\x80\x94 {summary} [{status}/{priority}]')
+        self.assertResponse('simplejira getissue ABC-7',
+                            'ABC-7 \xe2\x80\x94 Issue number 7 [Open/Major]')
+
+    def testPrefetch(self):
+        self.__set('cacheTTL', 2)
+        self.__set('prefetchInterval', 1)
+        self.assertNotError('reload SimpleJira')
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        # Wait out the TTL while the refresher runs.
+        deadline = time.time() + 3
+        while time.time() < deadline:
+            schedule.run()
+            time.sleep(0.1)
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        # The issue was only ever fetched by itself once; after that it
+        # was kept fresh by searches for it.
+        self.assertEqual([path for (method, path, query, data)
+                          in self.server.requests
+                          if path != 'rest/api/2/search'],
+                         ['rest/api/2/issue/ABC-1'])
+        self.assertTrue(len(self.server.requests) > 1)
+        self.assertEqual(self.server.requests[1][2]['jql'],
+                         ['key in (ABC-1)'])
+
+    def testWebhook(self):
+        port = free_port()
+        self.__set('webhookPort', port)
+        self.__set('webhookSecret', 'hush')
+        self.assertNotError('reload SimpleJira')
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        issue = {'key': 'ABC-1',
+                 'fields': {'status':     {'name': 'Resolved'},
+                            'resolution': {'name': 'Fixed'},
+                            'priority':   {'name': 'Major'},
+                            'summary':    'Fixed by a webhook'}}
+        update = json.dumps({'webhookEvent': 'jira:issue_updated',
+                             'issue': issue})
+        self.assertEqual(post(port, '/', update, {'X-Webhook-Secret': 'no'}),
+                         403)
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        self.assertEqual(post(port, '/', update,
+                              {'X-Webhook-Secret': 'hush'}), 204)
+        self.assertRegexp('simplejira getissue ABC-1', 'Fixed by a webhook')
+        self.assertEqual(len(self.server.requests), 1)
+        # Once JIRA says the issue is gone, the bot asks about it again.
+        self.assertEqual(post(port, '/', json.dumps(
+                {'webhookEvent': 'jira:issue_deleted', 'issue': issue}),
+                {'X-Webhook-Secret': 'hush'}), 204)
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def testFieldProjection(self):
+        self.assertNotRegexp('simplejira getissue ABC-1', 'Security')
+        self.assertEqual(self.server.requests[-1][2]['fields'],
+                         ['status,resolution,priority,summary'])
+        self.__set('securityFieldId', 10000)
+        self.assertRegexp('simplejira getissue ABC-2', 'Security')
+        self.assertEqual(self.server.requests[-1][2]['fields'],
+                         ['status,resolution,priority,summary,'
+                          'customfield_10000'])
+
+    def testSnarfing(self):
+        self.__set('snarfIssueKeys', True, self.channel)
+        replies = self.__replies(text='ABC-3 and ABC-2, not ABC-100 or '
+                                      'abc-4, and ABC-3 again')
+        self.assertEqual(len(replies), 1)
+        self.assertRegexpMatches(replies[0], r'^ABC-3 .*Issue number 3 .* \| '
+                                             r'ABC-2 .*Issue number 2 ')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.server.requests[0][2]['jql'],
+                         ['key in (ABC-3,ABC-2,ABC-100)'])
+        # Issues that were just announced aren't announced again.
+        self.assertEqual(self.__replies(text='what about ABC-2?'), [])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def testSnarfingAfterFailure(self):
+        self.__set('snarfIssueKeys', True, self.channel)
+        self.server.fail = 1
+        self.assertEqual(self.__replies(text='ABC-5 is broken'), [])
+        # Nobody heard about it, so it's announced the next time.
+        replies = self.__replies(text='what about ABC-5?')
+        self.assertEqual(len(replies), 1)
+        self.assertRegexpMatches(replies[0], r'^ABC-5 .*Issue number 5 ')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def testCombinedWrites(self):
+        self.assertNotError('simplejira assign ABC-1 to bob please')
+        self.assertEqual(self.__writes(), [
+                ('PUT', 'rest/api/2/issue/ABC-1',
+                 {'fields': {'assignee': {'name': 'bob'}},
+                  'update': {'comment': [{'add': {
+                          'body': 'Assigned to bob by tester\n\nplease'}}]}})])
+
+    def testDroppedWrite(self):
+        # JIRA may have added the comment before it hung up, so the bot
+        # mustn't send it again, even though it was a PUT on a connection
+        # that had already been used.
+        self.assertRegexp('simplejira getissue ABC-1', 'Issue number 1')
+        self.server.drop = 1
+        self.assertRegexp('simplejira assign ABC-1 to bob', 'not answering')
+        self.assertEqual(len(self.__writes()), 1)
+
+    def testInvalidWrites(self):
+        self.assertRegexp('simplejira assign ABC-1 to nobody',
+                          "User 'nobody' does not exist")
+        # That wasn't about the comment, so the next one still has one.
+        del self.server.requests[:]
+        self.assertNotError('simplejira assign ABC-2 to bob')
+        self.assertEqual([(method, path) for (method, path, data)
+                          in self.__writes()],
+                         [('PUT', 'rest/api/2/issue/ABC-2')])
+
+    def testUncombinableWrites(self):
+        self.server.combine = False
+        self.assertNotError('simplejira assign ABC-1 to bob')
+        self.assertEqual([(method, path) for (method, path, data)
+                          in self.__writes()],
+                         [('PUT', 'rest/api/2/issue/ABC-1'),
+                          ('PUT', 'rest/api/2/issue/ABC-1/assignee'),
+                          ('POST', 'rest/api/2/issue/ABC-1/comment')])
+        # The bot remembers that the comment can't go along.
+        del self.server.requests[:]
+        self.assertNotError('simplejira assign ABC-2 to bob')
+        self.assertEqual([(method, path) for (method, path, data)
+                          in self.__writes()],
+                         [('PUT', 'rest/api/2/issue/ABC-2/assignee'),
+                          ('POST', 'rest/api/2/issue/ABC-2/comment')])
+
+    def testBulkCommands(self):
+        self.assertRegexp('simplejira bulkcomment ABC-1,ABC-2,ABC-100 hi',
+                          r'Changed 2 of 3 issues\.  Failed: ABC-100 '
+                          r'\(Issue Does Not Exist\)')
+        self.assertEqual(sorted(path for (method, path, data)
+                                in self.__writes()),
+                         ['rest/api/2/issue/ABC-1/comment',
+                          'rest/api/2/issue/ABC-100/comment',
+                          'rest/api/2/issue/ABC-2/comment'])
+        self.server.total = 3
+        del self.server.requests[:]
+        self.assertRegexp('simplejira bulkassign --jql "project = ABC" to '
+                          'bob', r'Changed 3 of 3 issues\.$')
+        self.assertEqual(len(self.__writes()), 3)
+        self.__set('bulkMaxIssues', 2)
+        self.assertRegexp('simplejira bulktransition --jql "project = ABC" 5',
+                          'at most 2')
+        self.assertEqual(len(self.__writes()), 3)
+        self.assertError('simplejira bulkcomment --jql "project = ABC" '
+                         'ABC-1 hi')
+        # A change JIRA is still working on when we stop waiting may yet
+        # work, so it isn't a failure.
+        self.__set('requestTimeout', 1)
+        self.server.slow.add('ABC-2')
+        self.assertRegexp('simplejira bulkcomment ABC-1,ABC-2 hi',
+                          r'Changed 1 of 2 issues\.  Still in progress: '
+                          r'ABC-2$')
 
-class RTQueryTestCase(PluginTestCase):
-    plugins = ('RTQuery',)
+    def testSearch(self):
+        replies = self.__replies('simplejira search project = ABC')
+        self.assertEqual(len(replies), 16)
+        self.assertRegexpMatches(replies[0], '^ABC-1 ')
+        self.assertRegexpMatches(replies[14], '^ABC-15 ')
+        self.assertRegexpMatches(replies[15], '5 more of 20')
+        # Pages of 5 were asked for one at a time.
+        self.assertEqual([query['startAt'] for (method, path, query, data)
+                          in self.server.requests], [['0'], ['5'], ['10']])
+        replies = self.__replies('simplejira searchmore')
+        self.assertEqual(len(replies), 5)
+        self.assertRegexpMatches(replies[-1], '^ABC-20 ')
+        self.assertRegexp('simplejira searchmore', 'no search')
+        self.server.total = 0
+        self.assertRegexp('simplejira search project = XYZ', 'No issues')
 
 
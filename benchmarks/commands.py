@@ -0,0 +1,228 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Run the plugins' real lookup commands (RTQuery's getticket and the other
+two plugins' getissue) at a chosen concurrency against the fake trackers
+in fakeservers.py, and report latency percentiles, throughput, and how
+many requests reached the tracker.  Unlike transport.py, everything the
+commands do is included:  settings snapshots, caching, coalescing,
+circuit breakers, rate limits and the request engine.  Each command runs
+the way supybot runs a threaded plugin's commands, on its own thread,
+with replies collected instead of sent to IRC.  Like config_reads.py,
+this one needs supybot, and runs in a scratch directory so supybot's
+files don't end up in the repository.
+
+Usage: python benchmarks/commands.py [options] <plugin> ...
+       python benchmarks/commands.py --help
+"""
+
+import atexit
+import collections
+import optparse
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import fakeservers
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Each plugin's fake tracker, the settings that point the plugin at it,
+# and its command, as a function of the issue number
+PLUGINS = {
+    'RTQuery': (fakeservers.FakeRT,
+                {'uri': '{uri}', 'username': 'bot', 'password': 'secret',
+                 'enabled': 'True'},
+                lambda num: ('getticket', [str(num)])),
+    'Redmine': (fakeservers.FakeRedmine,
+                {'uri': '{uri}'},
+                lambda num: ('getissue', [str(num)])),
+    'SimpleJira': (fakeservers.FakeJira,
+                   {'uri': '{uri}', 'username': 'bot', 'password': 'secret',
+                    'enabled': 'True'},
+                   lambda num: ('getissue', ['FAKE-{0}'.format(num)]))}
+
+
+class BenchIrc(object):
+    '''
+    Just enough of an Irc for the plugins' commands to reply to.  It counts
+    replies, and errors by their text, instead of sending them anywhere.
+    '''
+    nick    = 'bench'
+    network = 'bench'
+    nested  = 0
+
+    def __init__(self):
+        self.answers = 0
+        self.errors  = collections.Counter()
+        self.lock    = threading.Lock()
+
+    def reply(self, text, *args, **kwargs):
+        with self.lock:
+            self.answers += 1
+
+    def replies(self, texts, *args, **kwargs):
+        self.reply(None)
+
+    def replySuccess(self, *args, **kwargs):
+        self.reply(None)
+
+    def error(self, text='', *args, **kwargs):
+        with self.lock:
+            self.errors[text] += 1
+
+    def errorInvalid(self, *args, **kwargs):
+        self.error()
+
+    def queueMsg(self, msg):
+        pass
+
+    sendMsg = queueMsg
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def configure(plugin, values):
+    import supybot.conf as conf
+    group = conf.supybot.plugins.get(plugin)
+    for (name, value) in values.iteritems():
+        # Channel values like enabled start out the same in every channel.
+        group.get(name).set(value)
+
+def run(plugin, opts, overrides):
+    import supybot.ircmsgs as ircmsgs
+    (server_class, settings, command_for) = PLUGINS[plugin]
+    server = server_class(latency=opts.latency, error_rate=opts.error_rate,
+                          payload_size=opts.payload_kb * 1024).start()
+    values = dict((name, value.format(uri=server.uri))
+                  for (name, value) in settings.iteritems())
+    values.update(overrides)
+    configure(plugin, values)
+    irc = BenchIrc()
+    cb  = sys.modules[plugin].Class(irc)
+    counter   = iter(xrange(opts.commands))
+    latencies = []
+    lock      = threading.Lock()
+
+    def worker():
+        mine = []
+        for num in counter:
+            (name, args) = command_for(num % opts.issues + 1)
+            channel = '#bench{0}'.format(num % opts.channels)
+            msg = ircmsgs.privmsg(channel, ' '.join([name] + args),
+                                  prefix='tester!tester@bench.example')
+            start = time.time()
+            getattr(cb, name)(irc, msg, list(args))
+            mine.append(time.time() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker)
+               for _ in xrange(opts.concurrency)]
+    start = time.time()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        elapsed = time.time() - start
+        cb.die()
+        server.stop()
+
+    latencies.sort()
+    print '{0}: {1} commands, concurrency {2}, {3} errors'.format(
+            plugin, len(latencies), opts.concurrency,
+            sum(irc.errors.values()))
+    print '  latency ms: p50 {0:.2f}  p95 {1:.2f}  p99 {2:.2f}  ' \
+          'max {3:.2f}'.format(*[1000 * value for value in
+                (percentile(latencies, 50), percentile(latencies, 95),
+                 percentile(latencies, 99), latencies[-1] if latencies else 0)])
+    print '  throughput: {0:.1f} commands/s'.format(len(latencies) / elapsed)
+    print '  tracker:    {0}'.format(', '.join('{0} {1}'.format(value, name)
+            for (name, value) in sorted(server.counters.iteritems())))
+    for (text, count) in irc.errors.most_common(3):
+        print '  {0} x {1}'.format(count, text)
+
+def main():
+    parser = optparse.OptionParser(
+            usage='%prog [options] <plugin> ...',
+            description='Plugins: ' + ', '.join(sorted(PLUGINS)) +
+                        ', or "all"')
+    parser.add_option('-n', '--commands', type='int', default=1000,
+                      help='commands to run per plugin (default: 1000)')
+    parser.add_option('-c', '--concurrency', type='int', default=4,
+                      help='commands to run at once (default: 4)')
+    parser.add_option('-C', '--channels', type='int', default=1,
+                      help='channels to spread the commands across, each '
+                           'with its own queue (default: 1)')
+    parser.add_option('-i', '--issues', type='int', default=100,
+                      help='distinct issues to cycle through (default: 100)')
+    parser.add_option('-l', '--latency', type='float', default=0.0,
+                      help='seconds the server waits before each response')
+    parser.add_option('-e', '--error-rate', type='float', default=0.0,
+                      help='fraction of requests the server fails')
+    parser.add_option('-s', '--payload-kb', type='int', default=0,
+                      help='extra KB of data in each issue the server sends')
+    parser.add_option('-o', '--set', action='append', default=[],
+                      metavar='NAME=VALUE',
+                      help='change a plugin setting, such as cacheTTL=0 to '
+                           'turn the cache off (may be repeated)')
+    (opts, args) = parser.parse_args()
+    if args == ['all']:
+        args = sorted(PLUGINS)
+    if not args or any(name not in PLUGINS for name in args):
+        parser.error('choose one or more plugins')
+    try:
+        overrides = dict(setting.split('=', 1) for setting in opts.set)
+    except ValueError:
+        parser.error('settings look like NAME=VALUE')
+    sys.path.insert(0, REPO)
+    # supybot writes its files when Python exits, so stay in the scratch
+    # directory until then, and remove it after supybot is done.
+    workdir = tempfile.mkdtemp(prefix='commands.')
+    atexit.register(shutil.rmtree, workdir, True)
+    os.chdir(workdir)
+    # supybot logs to stdout, which is where our report goes.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    for plugin in args:
+        __import__(plugin)
+    sys.stdout = stdout
+    for plugin in args:
+        run(plugin, opts, overrides)
+
+if __name__ == '__main__':
+    main()
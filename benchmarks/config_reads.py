@@ -0,0 +1,164 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+
+"""
+Measure how long each plugin's busiest command spends reading its settings,
+once with registryValue as the plugins used to, and once through the
+snapshots in local/settings.py.  Each command's reads are the ones it makes
+when the issue isn't cached, so it has to ask the tracker.  Like
+import_time.py, this one needs supybot.  It runs in a scratch directory so
+supybot's files don't end up in the repository.
+
+Usage: python benchmarks/config_reads.py [options] [<plugin> ...]
+       python benchmarks/config_reads.py --help
+"""
+
+import atexit
+import optparse
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CHANNEL = '#test'
+
+# The settings each command reads, in order, and whether it reads them for
+# the channel the command came from
+COMMANDS = {
+    'RTQuery': ('getticket', (
+        ('enabled', True), ('cacheSize', False), ('cacheTTL', False),
+        ('uri', False), ('cacheHardTTL', False), ('cacheTTL', False),
+        ('uri', False), ('authType', False), ('username', False),
+        ('password', False), ('connectTimeout', False),
+        ('readTimeout', False), ('breakerThreshold', False),
+        ('breakerCooldown', False), ('maxQueuedPerChannel', False),
+        ('rateLimit', False), ('rateBurst', False),
+        ('requestTimeout', False))),
+    'Redmine': ('getissue', (
+        ('uri', True), ('cacheSize', False), ('cacheTTL', False),
+        ('connectTimeout', False), ('readTimeout', False),
+        ('breakerThreshold', False), ('breakerCooldown', False),
+        ('cacheHardTTL', False), ('cacheTTL', False),
+        ('maxQueuedPerChannel', False), ('rateLimit', False),
+        ('rateBurst', False), ('requestTimeout', False))),
+    'SimpleJira': ('getissue', (
+        ('enabled', True), ('cacheSize', False), ('cacheTTL', False),
+        ('uri', False), ('cacheHardTTL', False), ('cacheTTL', False),
+        ('maxQueuedPerChannel', False), ('securityFieldId', False),
+        ('uri', False), ('username', False), ('password', False),
+        ('username', False), ('password', False), ('connectTimeout', False),
+        ('readTimeout', False), ('breakerThreshold', False),
+        ('breakerCooldown', False), ('uri', False), ('username', False),
+        ('rateLimit', False), ('rateBurst', False),
+        ('securityFieldId', False), ('uri', False),
+        ('requestTimeout', False)))}
+
+
+def with_registry_value(plugin, reads):
+    import supybot.callbacks as callbacks
+
+    class Plugin(object):
+        registryValue = callbacks.PluginMixin.registryValue.im_func
+        def name(self):
+            return plugin
+
+    registry_value = Plugin().registryValue
+    reads = [(name, CHANNEL if in_channel else None)
+             for (name, in_channel) in reads]
+    def command():
+        for (name, channel) in reads:
+            registry_value(name, channel)
+    return command
+
+def with_settings(plugin, reads):
+    import supybot.conf as conf
+    settings = sys.modules[plugin + '.local.settings'].Settings(
+            conf.supybot.plugins.get(plugin))
+    reads = [(name, CHANNEL if in_channel else None)
+             for (name, in_channel) in reads]
+    def command():
+        # Looking the snapshot up for every read makes this a little slower
+        # than the plugins, which mostly look it up once per command.
+        for (name, channel) in reads:
+            getattr(settings.get(channel), name)
+    return command
+
+def best_rate(command, count, repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for _ in xrange(count):
+            command()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return count / best
+
+def main():
+    parser = optparse.OptionParser(
+            usage='%prog [options] [<plugin> ...]',
+            description='Plugins: ' + ', '.join(sorted(COMMANDS)) +
+                        ' (default: all)')
+    parser.add_option('-n', '--commands', type='int', default=20000,
+                      help='commands to time per run (default: 20000)')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='runs to take the best of (default: 3)')
+    (opts, args) = parser.parse_args()
+    if not args:
+        args = sorted(COMMANDS)
+    if any(name not in COMMANDS for name in args):
+        parser.error('choose one or more of ' + ', '.join(sorted(COMMANDS)))
+    sys.path.insert(0, REPO)
+    # supybot writes its files when Python exits, so stay in the scratch
+    # directory until then, and remove it after supybot is done.
+    workdir = tempfile.mkdtemp(prefix='config_reads.')
+    atexit.register(shutil.rmtree, workdir, True)
+    os.chdir(workdir)
+    # supybot logs to stdout, which is where our report goes.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    for plugin in args:
+        __import__(plugin)
+    sys.stdout = stdout
+    for plugin in args:
+        (command, reads) = COMMANDS[plugin]
+        before = best_rate(with_registry_value(plugin, reads),
+                           opts.commands, opts.repeat)
+        after  = best_rate(with_settings(plugin, reads),
+                           opts.commands, opts.repeat)
+        print '{0} {1}: {2} settings read per command'.format(
+                plugin, command, len(reads))
+        print '  registryValue: {0:8.2f} us per command'.format(
+                1000000 / before)
+        print '  snapshots:     {0:8.2f} us per command ' \
+              '({1:.1f}x faster)'.format(1000000 / after, after / before)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+In-process fake issue tracker servers for benchmarking the plugins without
+a network or a real tracker
+"""
+
+import BaseHTTPServer
+import Cookie
+import SocketServer
+import collections
+import json
+import random
+import re
+import socket
+import threading
+import time
+import urlparse
+import uuid
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    wbufsize = -1  # send each response in as few packets as possible
+
+    def setup(self):
+        # Don't let Nagle hold back the tail of large responses.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.fake.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.fake.serve(self, 'GET')
+
+    def do_POST(self):
+        self.server.fake.serve(self, 'POST')
+
+    def do_PUT(self):
+        self.server.fake.serve(self, 'PUT')
+
+    def read_body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def send(self, code, body, headers=None):
+        self.send_response(code)
+        for (name, value) in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeServer(object):
+    '''
+    Base class for fake servers.  Each one listens on an ephemeral port on
+    the loopback interface and keeps simple request counters.  Every
+    response is delayed by latency seconds, and a random error_rate
+    fraction of requests fail the way the real tracker fails.
+    '''
+    def __init__(self, latency=0, error_rate=0, seed=None):
+        self.latency    = latency
+        self.error_rate = error_rate
+        self.random     = random.Random(seed)
+        self.counters = {}
+        self.lock     = threading.Lock()
+        self.httpd    = _ThreadingHTTPServer(('127.0.0.1', 0), _FakeHandler)
+        self.httpd.fake = self
+        self.thread   = None
+
+    @property
+    def uri(self):
+        return 'http://127.0.0.1:{0}/'.format(self.httpd.server_address[1])
+
+    def count(self, name):
+        self.add(name, 1)
+
+    def add(self, name, amount):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve(self, handler, method):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.count('injected_errors')
+            if method in ('POST', 'PUT'):
+                handler.read_body()
+            self.inject_error(handler)
+        else:
+            self.handle(handler, method)
+
+    def handle(self, handler, method):
+        raise NotImplementedError()
+
+    def inject_error(self, handler):
+        handler.send(500, 'Internal Server Error\n')
+
+
+class FakeRT(FakeServer):
+    '''
+    Speaks the parts of RT's REST 1.0 interface that RTQuery uses, including
+    the "RT/x.y.z 200 Ok" preamble, "# ..." error lines, and cookie-based
+    logins.  A session expires after session_requests requests if that is
+    set.  Tickets carry about payload_size bytes of extra fields.
+    '''
+    def __init__(self, username='bot', password='secret',
+                 session_requests=None, payload_size=0, **options):
+        FakeServer.__init__(self, **options)
+        self.username = username
+        self.password = password
+        self.session_requests = session_requests
+        self.payload_size = payload_size
+        self.sessions = {}
+
+    def handle(self, handler, method):
+        self.count('requests')
+        parsed = urlparse.urlsplit(handler.path)
+        body = handler.read_body() if method == 'POST' else ''
+        headers = {}
+        if body:
+            form = urlparse.parse_qs(body)
+            if (form.get('user') == [self.username] and
+                form.get('pass') == [self.password]):
+                self.count('logins')
+                sid = uuid.uuid4().hex
+                self.sessions[sid] = 0
+                headers['Set-Cookie'] = 'RT_SID_fake.80={0}; path=/'.format(sid)
+                authenticated = True
+            else:
+                authenticated = False
+        else:
+            cookie = Cookie.SimpleCookie(handler.headers.getheader('Cookie'))
+            sid = cookie['RT_SID_fake.80'].value \
+                    if 'RT_SID_fake.80' in cookie else None
+            authenticated = sid in self.sessions
+        if authenticated:
+            self.sessions[sid] += 1
+            if (self.session_requests and
+                self.sessions[sid] > self.session_requests):
+                del self.sessions[sid]
+                authenticated = False
+        if not authenticated:
+            handler.send(200, 'RT/3.8.8 401 Credentials required\n', headers)
+            return
+        if parsed.path.endswith('/show'):
+            # REST/1.0/show?id=ticket/1,2,3
+            obj_id = urlparse.parse_qs(parsed.query).get('id', [''])[0]
+            ticketnos = obj_id.split('/', 1)[-1].split(',')
+        else:
+            # REST/1.0/ticket/1
+            ticketnos = [parsed.path.rstrip('/').rsplit('/', 1)[-1]]
+        records = [self.render(ticketno) for ticketno in ticketnos]
+        handler.send(200, 'RT/3.8.8 200 Ok\n\n' + '\n--\n\n'.join(records),
+                     headers)
+
+    def render(self, ticketno):
+        if not ticketno.isdigit() or int(ticketno) == 0:
+            return '# Ticket {0} does not exist.\n'.format(ticketno)
+        filler = ''.join('CF.{{Filler {0}}}: {1}\n'.format(num, 'x' * 64)
+                         for num in xrange(self.payload_size // 80))
+        return ('id: ticket/{0}\n'
+                'Queue: General\n'
+                'Subject: Fake ticket {0}\n'
+                'Status: open\n'
+                'CF.{{Security}}: no\n'.format(ticketno) + filler)
+
+    def inject_error(self, handler):
+        handler.send(200, 'RT/3.8.8 200 Ok\n\n# Something went wrong.\n')
+
+
+class FakeJira(FakeServer):
+    '''
+    Speaks the parts of JIRA's REST v2 API that SimpleJira uses.  Every
+    well-formed issue key exists except ones numbered 0.  Issues carry
+    payload_size bytes of description, comments and rendered fields, like
+    busy issues on a real JIRA do, unless the client asks only for
+    specific fields.  Searches other than "key in (...)" match
+    search_total issues.  Writes are recorded in self.writes.  Set
+    combined_writes to False to reject writes with an "update" block, as
+    JIRAs whose screens lack the comment field do.
+    '''
+    def __init__(self, payload_size=0, security_field_id=10000,
+                 search_total=120, combined_writes=True, **options):
+        FakeServer.__init__(self, **options)
+        self.combined_writes = combined_writes
+        self.payload_size = payload_size
+        self.security_field_id = security_field_id
+        self.search_total = search_total
+        self.writes = []
+
+    def handle(self, handler, method):
+        self.count('requests')
+        parsed = urlparse.urlsplit(handler.path)
+        query  = urlparse.parse_qs(parsed.query)
+        path   = parsed.path.strip('/').split('/')
+        body   = handler.read_body() if method in ('POST', 'PUT') else ''
+        if path[:3] != ['rest', 'api', '2'] or len(path) < 4:
+            self.send_json(handler, 404, {'errorMessages': ['Not found']})
+        elif path[3] == 'search' and method == 'GET':
+            self.search(handler, query)
+        elif path[3] == 'issue' and len(path) >= 5:
+            key = path[4].upper()
+            if not re.match('[A-Z]{2,}-[1-9][0-9]*$', key):
+                self.send_json(handler, 404,
+                        {'errorMessages': ['Issue Does Not Exist'],
+                         'errors': {}})
+            elif len(path) == 5 and method == 'GET':
+                self.send_json(handler, 200,
+                        self.issue(key, query.get('fields', [None])[0]))
+            elif method in ('POST', 'PUT'):
+                data = json.loads(body or '{}')
+                if 'update' in data and not self.combined_writes:
+                    self.send_json(handler, 400, {'errorMessages': [],
+                            'errors': {'comment': 'Field \'comment\' cannot '
+                                       'be set. It is not on the appropriate '
+                                       'screen, or unknown.'}})
+                    return
+                self.writes.append((method, '/'.join(path[4:]), data))
+                if path[-1] == 'comment':
+                    self.send_json(handler, 201, {'id': '10001'})
+                else:
+                    handler.send(204, '')
+            else:
+                self.send_json(handler, 405, {'errorMessages': ['Nope']})
+        else:
+            self.send_json(handler, 404, {'errorMessages': ['Not found']})
+
+    def inject_error(self, handler):
+        self.send_json(handler, 500, {'errorMessages': ['Something went '
+                                                        'wrong'], 'errors': {}})
+
+    def send_json(self, handler, code, obj):
+        body = json.dumps(obj)
+        self.add('bytes', len(body))
+        handler.send(code, body, {'Content-Type': 'application/json'})
+
+    def issue(self, key, fields=None):
+        filler = 'x' * (self.payload_size // 4)
+        all_fields = {
+            'status':     {'name': 'Open', 'id': '1'},
+            'resolution': None,
+            'priority':   {'name': 'Major', 'id': '3'},
+            'summary':    'Fake issue ' + key,
+            'customfield_{0}'.format(self.security_field_id):
+                          {'value': 'No', 'id': '10100'},
+            'description': filler,
+            'comment':    {'comments': [{'body': filler}], 'total': 1},
+            'customfield_19999': filler}
+        issue = {'key': key, 'id': key.split('-')[1],
+                 'self': self.uri + 'rest/api/2/issue/' + key}
+        if fields and fields != '*all':
+            wanted = fields.split(',')
+            issue['fields'] = dict((name, value) for (name, value)
+                                   in all_fields.iteritems()
+                                   if name in wanted)
+        else:
+            issue['fields'] = all_fields
+            issue['renderedFields'] = {'description': filler}
+        return issue
+
+    def search(self, handler, query):
+        jql     = query.get('jql', [''])[0]
+        fields  = query.get('fields', [None])[0]
+        start   = int(query.get('startAt', ['0'])[0])
+        maximum = int(query.get('maxResults', ['50'])[0])
+        match   = re.search(r'key\s+in\s*\(([^)]*)\)', jql, re.I)
+        if match:
+            keys = [key.strip().upper() for key in match.group(1).split(',')]
+            keys = [key for key in keys
+                    if re.match('[A-Z]{2,}-[1-9][0-9]*$', key)]
+        else:
+            # Anything else matches FAKE-1 through FAKE-<search_total>.
+            keys = ['FAKE-{0}'.format(num) for num in
+                    xrange(1, self.search_total + 1)]
+        page = keys[start:start + maximum]
+        self.send_json(handler, 200,
+                {'startAt': start, 'maxResults': maximum,
+                 'total': len(keys),
+                 'issues': [self.issue(key, fields) for key in page]})
+
+
+class FakeRedmine(FakeServer):
+    '''
+    Speaks the parts of Redmine's JSON API that the Redmine plugin uses.
+    Every issue exists except number 0, and issues.json can list several
+    by issue_id.  Issues carry ETags, so requests
+    with a matching If-None-Match get a 304; call touch(issueno) to make
+    an issue change.  Issues carry payload_size bytes of description.
+    '''
+    def __init__(self, payload_size=0, **options):
+        FakeServer.__init__(self, **options)
+        self.payload_size = payload_size
+        self.versions = collections.defaultdict(int)
+
+    def touch(self, issueno):
+        with self.lock:
+            self.versions[issueno] += 1
+
+    def handle(self, handler, method):
+        self.count('requests')
+        parsed = urlparse.urlsplit(handler.path)
+        if parsed.path == '/issues.json':
+            self.list_issues(handler, urlparse.parse_qs(parsed.query))
+            return
+        match = re.match(r'/issues/([0-9]+)\.json$', parsed.path)
+        if match is None or int(match.group(1)) == 0:
+            handler.send(404, '')
+            return
+        issueno = int(match.group(1))
+        etag = '"{0}-{1}"'.format(issueno, self.versions[issueno])
+        if handler.headers.getheader('If-None-Match') == etag:
+            self.count('not_modified')
+            handler.send(304, '', {'ETag': etag})
+            return
+        self.count('ok')
+        issue = self.issue(issueno)
+        handler.send(200, json.dumps({'issue': issue}),
+                     {'Content-Type': 'application/json', 'ETag': etag})
+
+    def list_issues(self, handler, query):
+        # Only the issue_id filter is supported.
+        issuenos = [int(issueno) for issueno
+                    in query.get('issue_id', [''])[0].split(',')
+                    if issueno.isdigit() and int(issueno) > 0]
+        self.count('ok')
+        issues = [self.issue(issueno) for issueno in issuenos]
+        handler.send(200, json.dumps({'issues': issues,
+                                      'total_count': len(issues),
+                                      'offset': 0,
+                                      'limit': len(issues)}),
+                     {'Content-Type': 'application/json'})
+
+    def issue(self, issueno):
+        return {'id': issueno,
+                'project': {'id': 1, 'name': 'Fake'},
+                'status': {'id': 1, 'name': 'New'},
+                'subject': 'Fake issue {0}'.format(issueno),
+                'description': 'x' * self.payload_size}
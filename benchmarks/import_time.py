@@ -0,0 +1,181 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measure how long loading each plugin takes, the way "python -X importtime"
+does on newer Pythons:  every module the plugin pulls in is timed, both on
+its own and with everything it imports in turn.  Each measurement runs in a
+fresh process, in a scratch directory so supybot's files don't end up in
+the repository.  The supybot modules that every plugin needs are loaded
+before timing starts, since the bot has loaded them long before it gets to
+any plugin.  Unlike the other benchmarks, this one needs supybot.
+
+Python normally saves compiled modules for next time, as it does for the
+bot.  If PYTHONDONTWRITEBYTECODE is set, every run compiles the plugins
+again and the times include that.
+
+Usage: python benchmarks/import_time.py [options] [<plugin> ...]
+       python benchmarks/import_time.py --help
+"""
+
+import imp
+import json
+import optparse
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PLUGINS = ('RTQuery', 'Redmine', 'SimpleJira')
+
+# What the bot has already loaded by the time it loads plugins
+SUPYBOT_MODULES = ('supybot.callbacks', 'supybot.commands', 'supybot.conf',
+                   'supybot.i18n', 'supybot.ircdb', 'supybot.ircmsgs',
+                   'supybot.ircutils', 'supybot.registry', 'supybot.schedule',
+                   'supybot.utils', 'supybot.world')
+
+
+class TimingFinder(object):
+    '''
+    A sys.meta_path hook that loads modules just as Python would, noting
+    how long each one took.  records gets (depth, name, self seconds,
+    cumulative seconds) for each module in the order they finish loading.
+    '''
+    def __init__(self):
+        self.records = []
+        self.__children = [0.0]  # time spent loading each level's imports
+
+    def find_module(self, fullname, path=None):
+        try:
+            found = imp.find_module(fullname.rpartition('.')[2], path)
+        except ImportError:
+            return None
+        return TimingLoader(self, found)
+
+    def load(self, fullname, found):
+        depth = len(self.__children) - 1
+        self.__children.append(0.0)
+        start = time.time()
+        try:
+            return imp.load_module(fullname, *found)
+        finally:
+            if found[0] is not None:
+                found[0].close()
+            elapsed = time.time() - start
+            children = self.__children.pop()
+            self.__children[-1] += elapsed
+            self.records.append((depth, fullname, elapsed - children,
+                                 elapsed))
+
+
+class TimingLoader(object):
+    def __init__(self, finder, found):
+        self.finder = finder
+        self.found  = found
+
+    def load_module(self, fullname):
+        if fullname in sys.modules:
+            # reload()
+            return imp.load_module(fullname, *self.found)
+        return self.finder.load(fullname, self.found)
+
+
+def measure(plugin, output):
+    '''
+    Load a plugin the way supybot does and write what TimingFinder saw to
+    a file as JSON.  This runs in a child process.
+    '''
+    sys.path.insert(0, REPO)
+    # supybot logs to stdout, which is where our report goes.
+    sys.stdout = open(os.devnull, 'w')
+    for name in SUPYBOT_MODULES:
+        __import__(name)
+    finder = TimingFinder()
+    sys.meta_path.insert(0, finder)
+    start = time.time()
+    __import__(plugin)
+    total = time.time() - start
+    sys.meta_path.remove(finder)
+    with open(output, 'w') as out:
+        json.dump({'total': total, 'records': finder.records}, out)
+
+def run_child(plugin, workdir):
+    output = os.path.join(workdir, plugin + '.json')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable, os.path.abspath(__file__),
+                               '--child', plugin, output],
+                              cwd=workdir, stdout=devnull, stderr=devnull)
+    with open(output) as results:
+        return json.load(results)
+
+def report(plugin, runs, opts):
+    best = min(runs, key=lambda run: run['total'])
+    records = best['records']
+    print '{0}: {1:.1f} ms (best of {2}), {3} modules'.format(
+            plugin, 1000 * best['total'], len(runs), len(records))
+    if opts.tree:
+        print '  import time: self [us] | cumulative | imported package'
+        for (depth, name, own, cumulative) in records:
+            print '  import time: {0:9d} | {1:10d} | {2}{3}'.format(
+                    int(1000000 * own), int(1000000 * cumulative),
+                    '  ' * depth, name)
+    else:
+        slowest = sorted(records, key=lambda record: -record[2])
+        for (depth, name, own, cumulative) in slowest[:opts.top]:
+            print '  {0:7.2f} ms  {1}'.format(1000 * own, name)
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        measure(*sys.argv[2:4])
+        return
+    parser = optparse.OptionParser(
+            usage='%prog [options] [<plugin> ...]',
+            description='Plugins: ' + ', '.join(PLUGINS) + ' (default: all)')
+    parser.add_option('-n', '--runs', type='int', default=5,
+                      help='times to load each plugin (default: 5)')
+    parser.add_option('-t', '--top', type='int', default=10,
+                      help='slowest modules to list (default: 10)')
+    parser.add_option('--tree', action='store_true',
+                      help='list every module, indented by who imported it')
+    (opts, args) = parser.parse_args()
+    if not args:
+        args = PLUGINS
+    if any(name not in PLUGINS for name in args):
+        parser.error('choose one or more of ' + ', '.join(PLUGINS))
+    workdir = tempfile.mkdtemp(prefix='import_time.')
+    try:
+        for plugin in args:
+            report(plugin, [run_child(plugin, workdir)
+                            for _ in xrange(opts.runs)], opts)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measure how much data and JSON decoding time SimpleJira saves by asking
+JIRA for only the issue fields it displays.
+
+Usage: python benchmarks/jira_fields.py [lookups] [payload_kb]
+"""
+
+import json
+import os.path
+import sys
+import time
+import urllib
+import urllib2
+
+import fakeservers
+
+# What SimpleJira asks for when securityFieldId is 10000
+FIELDS = 'status,resolution,priority,summary,customfield_10000'
+
+def run(name, server, lookups, fields):
+    server.reset_counters()
+    decode_time = 0.0
+    start = time.time()
+    for num in xrange(1, lookups + 1):
+        uri = server.uri + 'rest/api/2/issue/FAKE-{0}'.format(num)
+        if fields:
+            uri += '?' + urllib.urlencode({'fields': fields})
+        content = urllib2.urlopen(uri).read()
+        decode_start = time.time()
+        json.loads(content)
+        decode_time += time.time() - decode_start
+    elapsed = time.time() - start
+    print '{0:10} {1:10.1f} KB/issue {2:8.3f} ms decode/issue ' \
+          '{3:8.3f} ms total/issue'.format(
+                  name, server.counters.get('bytes', 0) / 1024.0 / lookups,
+                  decode_time * 1000 / lookups, elapsed * 1000 / lookups)
+
+def main():
+    lookups    = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    payload_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    server = fakeservers.FakeJira(payload_size=payload_kb * 1024).start()
+    try:
+        run('all', server, lookups, None)
+        run('projected', server, lookups, FIELDS)
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
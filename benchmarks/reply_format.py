@@ -0,0 +1,134 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measure how fast SimpleJira turns issues into replies, the old way (a list
+of pieces put together for each issue, with the link joined to the base
+URI every time) against replyTemplate compiled once.
+
+Usage: python benchmarks/reply_format.py [issues]
+"""
+
+import operator
+import os.path
+import sys
+import time
+from urlparse import urljoin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'SimpleJira'))
+from local import replyformat
+
+BASE_URI = 'https://issues.example.com/jira/'
+TEMPLATE = u'{key}{flags}: {summary} - {url}'
+
+STATUSES = (('Open', None, 'Major'), ('In Progress', None, 'Blocker'),
+            ('Resolved', 'Fixed', 'Minor'), ('Closed', "Won't Fix", 'Major'))
+
+
+def make_issues(count):
+    issues = []
+    for num in xrange(count):
+        (status, resolution, priority) = STATUSES[num % len(STATUSES)]
+        issues.append({'key':        u'FAKE-{0}'.format(num),
+                       'status':     status,
+                       'resolution': resolution,
+                       'priority':   priority,
+                       'summary':    u'Fake issue number {0}'.format(num),
+                       'security':   'Yes' if num % 10 == 0 else None})
+    return issues
+
+# How SimpleJira used to do it, minus looking up the base URI in the
+# registry for every issue, which made it slower still
+def format_by_hand(issue):
+    msg_bits = [issue['key']]
+    issue_flags = []
+    status     = issue['status']
+    resolution = issue['resolution']
+    if resolution and status in ('Release Pending', 'Resolved', 'Closed'):
+        issue_flags.append('{0} ({1})'.format(status, resolution))
+    else:
+        issue_flags.append(status)
+    if issue['priority'] == 'Blocker':
+        issue_flags.append('Blocker')
+    if (issue['security'] or '').lower() == 'yes':
+        issue_flags.append('Security')
+    if issue_flags:
+        msg_bits.append('(' + ', '.join(issue_flags) + ')')
+    msg_bits[-1] += ':'
+    msg_bits.append(issue['summary'] or '(no summary)')
+    msg_bits.append('-')
+    msg_bits.append(urljoin(BASE_URI, 'browse/' + issue['key']))
+    return ' '.join(msg_bits)
+
+# SimpleJira's issue_flags and issue_reply_fields
+def issue_flags(issue):
+    issue_flags = []
+    status     = issue['status']
+    resolution = issue['resolution']
+    if resolution and status in ('Release Pending', 'Resolved', 'Closed'):
+        issue_flags.append('{0} ({1})'.format(status, resolution))
+    else:
+        issue_flags.append(status)
+    if issue['priority'] == 'Blocker':
+        issue_flags.append('Blocker')
+    if (issue['security'] or '').lower() == 'yes':
+        issue_flags.append('Security')
+    return issue_flags
+
+def issue_reply_fields(base_uri):
+    browse_uri = urljoin(base_uri, 'browse/')
+    return {'key':        operator.itemgetter('key'),
+            'flags':      lambda issue: replyformat.format_flags(
+                                  issue_flags(issue)),
+            'status':     operator.itemgetter('status'),
+            'resolution': lambda issue: issue['resolution'] or '',
+            'priority':   operator.itemgetter('priority'),
+            'summary':    lambda issue: issue['summary'] or '(no summary)',
+            'url':        lambda issue: browse_uri + issue['key']}
+
+
+def run(name, issues, format_issue):
+    start = time.time()
+    for issue in issues:
+        format_issue(issue)
+    elapsed = time.time() - start
+    print '{0:10} {1:10.0f} issues/s {2:8.2f} us/issue'.format(
+            name, len(issues) / elapsed, elapsed * 1000000 / len(issues))
+
+def main():
+    count  = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    issues = make_issues(count)
+    compiled = replyformat.compile_template(TEMPLATE,
+                                            issue_reply_fields(BASE_URI))
+    # Both ways must say the same thing.
+    for issue in issues[:len(STATUSES) * 10]:
+        assert format_by_hand(issue) == compiled(issue), issue
+    run('by hand', issues, format_by_hand)
+    run('template', issues, compiled)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compare RT logins and connections per ticket lookup between the old
+login-on-every-request approach and RTQuery's shared RTSession.
+
+Usage: python benchmarks/rt_logins.py [lookups] [threads]
+"""
+
+import cookielib
+import os.path
+import sys
+import threading
+import time
+import urllib
+import urllib2
+from urlparse import urljoin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'RTQuery'))
+from local import httppool
+from local import rtsession
+
+import fakeservers
+
+def old_getticket(base_uri, ticketno):
+    # What RTQuery.getticket used to do for every lookup
+    rest_uri = urljoin(base_uri, 'REST/1.0/ticket/{0}'.format(ticketno))
+    cjar   = cookielib.CookieJar()
+    opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cjar))
+    ldata  = urllib.urlencode({'user': 'bot', 'pass': 'secret'})
+    return opener.open(urllib2.Request(rest_uri, ldata)).read()
+
+def run(name, lookup, server, lookups, nthreads):
+    server.reset_counters()
+    per_thread = lookups // nthreads
+    def worker():
+        for ticketno in xrange(1, per_thread + 1):
+            lookup(ticketno)
+    threads = [threading.Thread(target=worker) for _ in xrange(nthreads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    counters = server.counters
+    print '{0:8} {1:6} lookups {2:6} requests {3:5} logins {4:5} conns ' \
+          '{5:8.1f} req/login {6:8.1f} lookups/s'.format(
+                  name, per_thread * nthreads, counters.get('requests', 0),
+                  counters.get('logins', 0), counters.get('connections', 0),
+                  float(counters.get('requests', 0)) /
+                      max(counters.get('logins', 0), 1),
+                  per_thread * nthreads / elapsed)
+
+def main():
+    lookups  = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nthreads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    server = fakeservers.FakeRT(session_requests=200).start()
+    try:
+        run('before', lambda n: old_getticket(server.uri, n), server,
+            lookups, nthreads)
+        pool    = httppool.PoolManager()
+        session = rtsession.RTSession(pool, server.uri, 'builtin', 'bot',
+                                      'secret')
+        def new_getticket(ticketno):
+            response = session.get('REST/1.0/ticket/{0}'.format(ticketno))
+            response.read()
+            response.close()
+        run('after', new_getticket, server, lookups, nthreads)
+        pool.close()
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Compare the time and memory RTQuery's old readlines()-based response
+parser and its streaming parser need for large synthetic RT responses.
+
+Usage: python benchmarks/rt_parser.py [megabytes]
+"""
+
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'RTQuery'))
+from local import rtparse
+
+TICKET_FIELDS = ('id', 'Status', 'Subject', 'CF.{Security}',
+                 'CF.{Security Threat}')
+
+class SyntheticResponse(object):
+    '''
+    Produces a response body on the fly, like a socket would, so the body
+    is never in memory unless the parser puts it there.
+    '''
+    def __init__(self, pieces):
+        self.pieces = iter(pieces)
+        self.buf    = ''
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self.buf + ''.join(self.pieces)
+            self.buf = ''
+            return data
+        pieces = [self.buf]
+        size = len(self.buf)
+        for piece in self.pieces:
+            pieces.append(piece)
+            size += len(piece)
+            if size >= amt:
+                break
+        data = ''.join(pieces)
+        (data, self.buf) = (data[:amt], data[amt:])
+        return data
+
+    def readlines(self):
+        return self.read().splitlines(True)
+
+    def geturl(self):
+        return 'http://rt.example.com/REST/1.0/ticket/1'
+
+def huge_multiline_field(name, size):
+    yield '{0}: first line of a very long log\n'.format(name)
+    line = ' ' * (len(name) + 2) + 'step: did something (x' + 'x' * 60 + ')\n'
+    for _ in xrange(size // len(line)):
+        yield line
+
+def huge_single_line_field(name, size):
+    yield '{0}: '.format(name)
+    for _ in xrange(size // 4096):
+        yield 'y' * 4096
+    yield '\n'
+
+def small_fields():
+    yield ('id: ticket/1\nQueue: General\nSubject: Crash on startup\n'
+           'Status: open\nCF.{Security}: yes\nCF.{Security Threat}: high\n')
+
+def scenario(name, size):
+    def pieces():
+        yield 'RT/4.0.13 200 Ok\n\n'
+        if name == 'fields first':
+            for piece in small_fields():
+                yield piece
+            for piece in huge_multiline_field('CF.{Build Log}', size):
+                yield piece
+        elif name == 'fields last':
+            for piece in huge_multiline_field('CF.{Build Log}', size):
+                yield piece
+            for piece in small_fields():
+                yield piece
+        elif name == 'one long line':
+            for piece in huge_single_line_field('CF.{Core Dump}', size):
+                yield piece
+            for piece in small_fields():
+                yield piece
+        elif name == 'long line last':
+            for piece in small_fields():
+                yield piece
+            for piece in huge_single_line_field('CF.{Core Dump}', size):
+                yield piece
+        yield '\n'
+    return pieces()
+
+def old_parse(response):
+    # RTQuery's original parser, minus the error handling
+    attrs = {}
+    for line in response.readlines():
+        if line.startswith('RT/'):
+            pass
+        elif line.startswith('#'):
+            pass
+        elif ':' in line:
+            (key, val) = line.split(':', 1)
+            attrs[key.strip()] = val.strip()
+    return attrs
+
+def new_parse(response):
+    for record in rtparse.parse_rt_stream(response.read, response.geturl(),
+                                          TICKET_FIELDS):
+        return record
+
+def measure(parse, name, size):
+    # Run in a child process so each measurement gets its own peak RSS.
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        attrs = parse(SyntheticResponse(scenario(name, size)))
+        elapsed = time.time() - start
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(wfd, '{0} {1} {2}'.format(elapsed, after - before,
+                                           (attrs or {}).get('Status')))
+        os._exit(0)
+    os.close(wfd)
+    result = os.read(rfd, 1024).split()
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    return (float(result[0]), int(result[1]), result[2])
+
+def main():
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 \
+            else 32 * 1024 * 1024
+    print 'Synthetic ticket with a {0} MB custom field'.format(
+            size // (1024 * 1024))
+    for name in ('fields first', 'fields last', 'one long line',
+                 'long line last'):
+        for (label, parse) in (('old', old_parse), ('new', new_parse)):
+            (elapsed, rss, status) = measure(parse, name, size)
+            print '{0:14} {1}: {2:8.3f} s {3:8d} KB peak RSS growth ' \
+                  '(Status={4})'.format(name, label, elapsed, rss, status)
+
+if __name__ == '__main__':
+    main()
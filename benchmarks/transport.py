@@ -0,0 +1,218 @@
+###
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Send the same HTTP requests that the plugins' commands send to a fake
+tracker, through the plugins' connection pool, RT session and RT parser,
+and report latency percentiles, throughput and peak memory use.  This
+measures only that transport.  It doesn't call the commands themselves,
+so their caches, circuit breakers, rate limits, request engine and reply
+formatting play no part; commands.py measures those.  The fake server
+runs in a child process so it doesn't count toward our memory use.
+Nothing here needs a network or supybot.
+
+Usage: python benchmarks/transport.py [options] <workload> ...
+       python benchmarks/transport.py --help
+"""
+
+import itertools
+import json
+import optparse
+import os
+import os.path
+import resource
+import signal
+import sys
+import threading
+import time
+import urllib
+from urlparse import urljoin
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'RTQuery'))
+from local import httppool
+from local import rtparse
+from local import rtsession
+
+import fakeservers
+
+# What RTQuery and SimpleJira ask their trackers for
+RT_TICKET_FIELDS = ('id', 'Status', 'Subject', 'CF.{Security}',
+                    'CF.{Security Threat}')
+JIRA_FIELDS = 'status,resolution,priority,summary,customfield_10000'
+
+
+# Each workload takes a tracker's base URI and a PoolManager and returns a
+# function that performs one command's requests for a given issue number.
+
+def rt_getticket(base_uri, pool):
+    session = rtsession.RTSession(pool, base_uri, 'builtin', 'bot', 'secret')
+    def getticket(num):
+        response = session.get('REST/1.0/ticket/{0}'.format(num))
+        try:
+            for record in rtparse.parse_rt_stream(response.read,
+                    response.geturl(), RT_TICKET_FIELDS):
+                if isinstance(record, rtparse.RTError):
+                    raise record
+                return record
+        finally:
+            response.close()
+    return getticket
+
+def jira_getissue(base_uri, pool):
+    def getissue(num):
+        uri = urljoin(base_uri, 'rest/api/2/issue/FAKE-{0}?{1}'.format(
+                num, urllib.urlencode({'fields': JIRA_FIELDS})))
+        return json.loads(pool.request('GET', uri).read())
+    return getissue
+
+def jira_assign(base_uri, pool):
+    headers = {'Content-Type': 'application/json'}
+    def assign(num):
+        uri = urljoin(base_uri, 'rest/api/2/issue/FAKE-{0}'.format(num))
+        data = {'fields': {'assignee': {'name': 'bob'}},
+                'update': {'comment': [{'add': {'body': 'Assigned to bob'}}]}}
+        pool.request('PUT', uri, json.dumps(data), headers).read()
+    return assign
+
+def redmine_getissue(base_uri, pool):
+    def getissue(num):
+        uri = urljoin(base_uri, 'issues/{0}.json'.format(num))
+        return json.loads(pool.request('GET', uri).read())
+    return getissue
+
+WORKLOADS = {'rt-getticket':     (fakeservers.FakeRT,      rt_getticket),
+             'jira-getissue':    (fakeservers.FakeJira,    jira_getissue),
+             'jira-assign':      (fakeservers.FakeJira,    jira_assign),
+             'redmine-getissue': (fakeservers.FakeRedmine, redmine_getissue)}
+
+
+def start_server(server_class, **options):
+    '''
+    Fork a child process that serves a fake tracker and return its PID and
+    base URI.
+    '''
+    server = server_class(**options)
+    uri = server.uri
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.httpd.serve_forever()
+        finally:
+            os._exit(0)
+    server.httpd.server_close()
+    return (pid, uri)
+
+def stop_server(pid):
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def run(name, opts):
+    (server_class, workload) = WORKLOADS[name]
+    (pid, uri) = start_server(server_class, latency=opts.latency,
+                              error_rate=opts.error_rate,
+                              payload_size=opts.payload_kb * 1024)
+    pool = httppool.PoolManager(maxsize=opts.concurrency, timeout=30)
+    operation = workload(uri, pool)
+    counter   = itertools.count()
+    latencies = []
+    errors    = [0]
+    lock      = threading.Lock()
+
+    def worker():
+        mine = []
+        failed = 0
+        while True:
+            num = next(counter)
+            if num >= opts.requests:
+                break
+            start = time.time()
+            try:
+                operation(num % opts.issues + 1)
+            except (httppool.URLError, rtparse.RTError, ValueError):
+                failed += 1
+            mine.append(time.time() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker)
+               for _ in xrange(opts.concurrency)]
+    start = time.time()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        elapsed = time.time() - start
+        pool.close()
+        stop_server(pid)
+
+    latencies.sort()
+    print '{0}: {1} requests, concurrency {2}, {3} errors'.format(
+            name, len(latencies), opts.concurrency, errors[0])
+    print '  latency ms: p50 {0:.2f}  p95 {1:.2f}  p99 {2:.2f}  ' \
+          'max {3:.2f}'.format(*[1000 * value for value in
+                (percentile(latencies, 50), percentile(latencies, 95),
+                 percentile(latencies, 99), latencies[-1] if latencies else 0)])
+    print '  throughput: {0:.1f} requests/s'.format(len(latencies) / elapsed)
+    # ru_maxrss is in kilobytes on Linux.
+    print '  peak RSS:   {0:.1f} MB'.format(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+def main():
+    parser = optparse.OptionParser(
+            usage='%prog [options] <workload> ...',
+            description='Workloads: ' + ', '.join(sorted(WORKLOADS)) +
+                        ', or "all"')
+    parser.add_option('-n', '--requests', type='int', default=1000,
+                      help='requests to send per workload (default: 1000)')
+    parser.add_option('-c', '--concurrency', type='int', default=4,
+                      help='requests to send at once (default: 4)')
+    parser.add_option('-i', '--issues', type='int', default=100,
+                      help='distinct issues to cycle through (default: 100)')
+    parser.add_option('-l', '--latency', type='float', default=0.0,
+                      help='seconds the server waits before each response')
+    parser.add_option('-e', '--error-rate', type='float', default=0.0,
+                      help='fraction of requests the server fails')
+    parser.add_option('-s', '--payload-kb', type='int', default=0,
+                      help='extra KB of data in each issue the server sends')
+    (opts, args) = parser.parse_args()
+    if args == ['all']:
+        args = sorted(WORKLOADS)
+    if not args or any(name not in WORKLOADS for name in args):
+        parser.error('choose one or more workloads')
+    for name in args:
+        run(name, opts)
+
+if __name__ == '__main__':
+    main()